@@ -0,0 +1,170 @@
+'''
+Adaptive sizing of bounded SEND_BATCH requests.
+
+`SEND_BATCH -1 1` streams until another command interrupts it, and the
+interruption can land in the middle of a frame (README, Known Issues). The
+scheduled receiver (wubCTL.scheduled_batchmode_recv) instead keeps issuing
+bounded requests, `SEND_BATCH n 0`: the device sends at most n frames and stops
+by itself, on a frame boundary, when the count is reached or its hit memory is
+empty. Stopping then only means not issuing the next request.
+
+wubBatchScheduler picks n and the pause between requests:
+
+  * a batch that came back full means hits are waiting, so the next request is
+    doubled, up to the caps below, and follows without a pause;
+  * a short batch means the device ran dry; the next request is sized to the
+    observed hit rate over `target_period` and is issued after `idle_wait`,
+    which bounds the extra latency at low rates;
+  * n is capped by max_batch, by the host receive buffer headroom and by
+    max_batch_time of wire time, so a stop never waits long for a batch to end.
+
+A short batch is recognized by the link going quiet for `quiet_time`. USB-serial
+bridges hold received bytes for up to their latency timer (16 ms by default
+on FTDI chips) before passing them on, so the quiet time has to exceed it;
+port_quiet_time() derives it from the port.
+'''
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+
+from . import parser
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Bits on the wire per byte (8N1).
+UART_BITS_PER_BYTE = 10
+
+# Quiet time when the port's latency timer is unknown; safe with the 16 ms
+# default of FTDI bridges.
+DEFAULT_QUIET_TIME = 0.05
+
+# Margin added to a known latency timer.
+QUIET_TIME_MARGIN = 0.01
+
+
+def port_quiet_time(port: str) -> float:
+    '''Silence after which a batch can be taken as finished on `port`, in seconds.
+
+    Twice the latency timer of a Linux USB-serial port (from sysfs) plus a
+    margin, or DEFAULT_QUIET_TIME if the port has none.
+    '''
+    name = os.path.basename(os.path.realpath(port)) if port else ""
+    try:
+        with open(f"/sys/bus/usb-serial/devices/{name}/latency_timer") as f:
+            latency = int(f.read()) * 1e-3
+    except (OSError, ValueError):
+        return DEFAULT_QUIET_TIME
+    return 2 * latency + QUIET_TIME_MARGIN
+
+
+@dataclass
+class wubBatchResult:
+    ntosend: int
+    nframes: int
+    nbytes: int
+    tstart: float
+    elapsed: float
+
+    @property
+    def full(self) -> bool:
+        return self.nframes >= self.ntosend
+
+
+class wubBatchScheduler():
+    '''
+    Args:
+        min_batch (int): Smallest request.
+        max_batch (int): Largest request.
+        target_period (float): Seconds of hits a request should cover at the observed rate.
+        idle_wait (float): Pause after a batch that came back short, in seconds.
+        max_batch_time (float): Longest a request may keep the link busy, in seconds of wire time.
+        headroom_fraction (float): Share of the free host receive buffer one request may fill.
+        quiet_time (float): Silence after which a short batch counts as finished, in seconds;
+            port_quiet_time() of the link if None.
+        smoothing (float): Weight of the newest sample in the rate and frame size averages.
+    '''
+
+    def __init__(self, min_batch: int = 16, max_batch: int = 8192, target_period: float = 0.05,
+                 idle_wait: float = 0.01, max_batch_time: float = 0.25, headroom_fraction: float = 0.5,
+                 quiet_time: float = None, smoothing: float = 0.3):
+        if min_batch < 1 or max_batch < min_batch:
+            raise ValueError(f"Invalid batch bounds [{min_batch}, {max_batch}].")
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.target_period = target_period
+        self.idle_wait = idle_wait
+        self.max_batch_time = max_batch_time
+        self.headroom_fraction = headroom_fraction
+        self.quiet_time = quiet_time
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        self.rate = None
+        self.frame_bytes = float(parser.START_BYTE_WIDTH + parser.calc_frame_size(16))
+        self._last = None
+
+        self.nbatches = 0
+        self.nbatches_full = 0
+        self.nframes = 0
+
+    def _average(self, old: float, new: float) -> float:
+        return new if old is None else old + self.smoothing * (new - old)
+
+    def update(self, result: wubBatchResult):
+        '''Account for a finished batch.'''
+        if result.nframes > 0:
+            self.frame_bytes = self._average(self.frame_bytes, result.nbytes / result.nframes)
+
+        # A short batch empties the device, so it sent what arrived since the previous batch
+        # ended; a full batch only gives a lower bound, so the estimate is not lowered by it.
+        if self._last is not None:
+            interval = result.tstart + result.elapsed - (self._last.tstart + self._last.elapsed)
+            if interval > 0:
+                sample = result.nframes / interval
+                if not result.full or self.rate is None or sample > self.rate:
+                    self.rate = self._average(self.rate, sample)
+
+        self._last = result
+        self.nbatches += 1
+        self.nbatches_full += result.full
+        self.nframes += result.nframes
+
+    def next_request(self, headroom_bytes: int = None, baud: int = None) -> int:
+        '''Size of the next SEND_BATCH request.
+
+        Args:
+            headroom_bytes (int): Free space in the host receive buffer.
+            baud (int): Link rate, to bound the wire time of a request.
+        '''
+        last = self._last
+        if last is None:
+            n = self.min_batch
+        elif last.full:
+            n = 2 * last.ntosend
+        elif self.rate is None:
+            n = self.min_batch
+        else:
+            # Twice the expected count, so a steady rate is drained by one request.
+            n = 2 * self.rate * self.target_period
+
+        n = min(n, self.max_batch)
+        if headroom_bytes is not None:
+            n = min(n, self.headroom_fraction * headroom_bytes / self.frame_bytes)
+        if baud is not None:
+            n = min(n, self.max_batch_time * baud / (UART_BITS_PER_BYTE * self.frame_bytes))
+        return max(self.min_batch, int(n))
+
+    def wait_time(self) -> float:
+        '''Pause before the next request.'''
+        if self._last is None or self._last.full:
+            return 0.0
+        return self.idle_wait
+
+    def summary(self) -> dict:
+        return dict(nbatches=self.nbatches, nbatches_full=self.nbatches_full, nframes=self.nframes,
+                    rate=self.rate, frame_bytes=self.frame_bytes)
@@ -0,0 +1,72 @@
+'''
+Baud rates negotiated per device, kept between sessions.
+
+wubCTL.negotiate_baud() finds the fastest rate a given link carries without
+errors; the result depends on the device's clock and on the cable, so it is
+stored per device UID (and port) and tried first the next time.
+'''
+
+from __future__ import annotations
+
+import os
+import json
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Candidate rates, fastest first. 1181818 is the highest exact rate of the
+# wuBase UART clock that has been used in test setups.
+BAUD_CANDIDATES = [3000000, 2000000, 1500000, 1181818, 1000000, 921600, 
+                   500000, 460800, 230400, 115200]
+
+# Largest relative difference between a proposed rate and the rate the device
+# can actually generate (CHECK_PROPOSED_BAUD) that a UART still tolerates.
+BAUD_TOLERANCE = 0.02
+
+
+def uart_log_errors(values: list) -> int:
+    '''Error count from GET_UART_LOG retargs (IIHHHHH).
+
+    The two 32-bit fields are taken as traffic counters and the five 16-bit
+    fields as error counters.
+    '''
+    return sum(int(v) for v in values[2:7])
+
+
+class wubBaudCache():
+    '''
+    JSON file mapping "uid@port" to the last negotiated baud rate.
+
+    Args:
+        filename (str): Cache file; created on the first put().
+    '''
+
+    def __init__(self, filename: str):
+        self._filename = filename
+        self._entries = {}
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable baud cache {filename}: {e}")
+
+    @staticmethod
+    def key(uid: str, port: str) -> str:
+        return f"{uid}@{port}"
+
+    def get(self, uid: str, port: str) -> int:
+        entry = self._entries.get(self.key(uid, port))
+        return None if entry is None else entry['baud']
+
+    def put(self, uid: str, port: str, baud: int):
+        self._entries[self.key(uid, port)] = dict(baud=baud, timestamp=time.time())
+        tmp = f"{self._filename}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp, self._filename)
+
+    def drop(self, uid: str, port: str):
+        self._entries.pop(self.key(uid, port), None)
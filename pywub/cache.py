@@ -0,0 +1,92 @@
+'''
+Cache for slow-control readbacks.
+
+Which commands are cached, and which commands make cached values stale, is
+catalog metadata (wubCMD_entry.cache_policy and wubCMD_entry.invalidates).
+Session-cached values (VERSION, GET_UID, ...) are kept until invalidated;
+averaged telemetry is kept for `ttl` seconds. Responses are cached per comms
+mode since ASCII and binary responses have different shapes.
+'''
+
+from __future__ import annotations
+
+import copy
+import time
+import threading
+
+from .catalog import wubCMD_entry, CACHE_SESSION, CACHE_TTL
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class wubReadbackCache():
+    '''
+    Args:
+        ttl (float): Seconds averaged telemetry stays valid; 0 disables caching it.
+        session (bool): Cache values that are fixed for the session.
+    '''
+
+    def __init__(self, ttl: float = 0.0, session: bool = True):
+        self.ttl = ttl
+        self.session = session
+
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _enabled(self, command: wubCMD_entry) -> bool:
+        if command.cache_policy == CACHE_SESSION:
+            return self.session
+        if command.cache_policy == CACHE_TTL:
+            return self.ttl > 0
+        return False
+
+    def lookup(self, command: wubCMD_entry, mode: str) -> dict:
+        '''Return a copy of the cached response, or None on a miss.'''
+        if not self._enabled(command):
+            return None
+
+        with self._lock:
+            entry = self._entries.get((command.name, mode[0].upper()))
+            if entry is not None:
+                expires, resp = entry
+                if expires is None or time.monotonic() < expires:
+                    self.hits += 1
+                    return copy.deepcopy(resp)
+            self.misses += 1
+            return None
+
+    def store(self, command: wubCMD_entry, mode: str, resp: dict):
+        if not self._enabled(command):
+            return
+        expires = None if command.cache_policy == CACHE_SESSION else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[(command.name, mode[0].upper())] = (expires, copy.deepcopy(resp))
+
+    def invalidate(self, names: set = None):
+        '''Drop the cached responses of the given command names (all of them if None).'''
+        with self._lock:
+            if names is None:
+                n = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [key for key in self._entries if key[0] in names]
+                n = len(keys)
+                for key in keys:
+                    del self._entries[key]
+            self.invalidations += n
+        if n > 0:
+            logger.debug(f"Invalidated {n} cached readback(s).")
+
+    @property
+    def hit_rate(self) -> float:
+        nlookups = self.hits + self.misses
+        return self.hits / nlookups if nlookups > 0 else 0.0
+
+    def stats(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, hit_rate=self.hit_rate,
+                    invalidations=self.invalidations, entries=len(self._entries))
@@ -0,0 +1,244 @@
+'''
+Run HV scans and calibrations on many bases at once.
+
+The procedures run on the wuBase itself; the host only has to start them and
+ask when they are done. wubCalibrationRunner therefore starts the procedure on
+every base back to back, then polls each base's status command on its own
+schedule, backing off while the procedure keeps running. A base's results are
+read out as soon as it finishes, so the total time is set by the slowest base
+rather than the sum over all of them.
+'''
+
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Callable
+
+from .catalog import ctlg as wubCMD_catalog
+from .catalog import wubCMD_entry
+from .control import parse_response
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class wubProcedure:
+    '''Commands that start, poll, read out and abort one on-board procedure.'''
+    name: str
+    start: wubCMD_entry
+    status: wubCMD_entry
+    readout: wubCMD_entry = None
+    abort: wubCMD_entry = None
+
+
+PROCEDURES = {
+    'scan': wubProcedure('scan', wubCMD_catalog.scan, wubCMD_catalog.scanstatus,
+                         wubCMD_catalog.scanprint, wubCMD_catalog.scanabort),
+    'quickscan': wubProcedure('quickscan', wubCMD_catalog.quickscan, wubCMD_catalog.scanstatus,
+                              wubCMD_catalog.scanprint, wubCMD_catalog.scanabort),
+    'quickscanup': wubProcedure('quickscanup', wubCMD_catalog.quickscanup, wubCMD_catalog.scanstatus,
+                                wubCMD_catalog.scanprint, wubCMD_catalog.scanabort),
+    'quickscanrange': wubProcedure('quickscanrange', wubCMD_catalog.quickscanrange, wubCMD_catalog.scanstatus,
+                                   wubCMD_catalog.scanprint, wubCMD_catalog.scanabort),
+    'cal10': wubProcedure('cal10', wubCMD_catalog.cal10, wubCMD_catalog.cal10status,
+                          wubCMD_catalog.cal10print, wubCMD_catalog.cal10abort),
+}
+
+
+def procedure_done(status: int) -> bool:
+    '''Default interpretation of SCANSTATUS/CAL10STATUS: 0 means nothing is running.'''
+    return status == 0
+
+
+@dataclass
+class wubCalibrationResult:
+    base: int
+    port: str
+    procedure: str
+    args: list
+    state: str = 'pending'      # pending, running, done, failed, timeout, aborted
+    tstart: float = None
+    tstop: float = None
+    npolls: int = 0
+    status: int = None
+    result: list = field(default_factory=list)
+    error: str = None
+
+    @property
+    def duration(self) -> float:
+        if self.tstart is None or self.tstop is None:
+            return None
+        return self.tstop - self.tstart
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d['duration'] = self.duration
+        return d
+
+
+class _job():
+
+    def __init__(self, wubctl, result: wubCalibrationResult, poll_initial: float):
+        self.wubctl = wubctl
+        self.result = result
+        self.interval = poll_initial
+        self.next_poll = None
+
+
+class wubCalibrationRunner():
+    '''
+    Starts one procedure on several bases and collects the results as they finish.
+
+    Polling starts poll_initial seconds after a base was started, and the interval
+    grows by backoff after each poll that finds the procedure still running, up
+    to poll_max. All polling happens from the calling thread; each poll is a
+    single short round trip on that base's own port.
+
+    Args:
+        wubctls (list): wubCTL objects, one per base; wubctl.basenumber labels the results.
+        procedure (str): One of PROCEDURES.
+        args (list): Arguments for the start command.
+        poll_initial (float): Seconds before the first status poll.
+        poll_max (float): Longest interval between polls of one base.
+        backoff (float): Factor applied to the poll interval while a base is busy.
+        timeout (float): Give up on (and abort) bases still running after this many seconds; None waits forever.
+        is_done (callable): Maps the status value to True once the procedure has finished.
+        on_result (callable): Called with each wubCalibrationResult as soon as its base finishes.
+    '''
+
+    def __init__(self, wubctls: list, procedure: str, args: list = None,
+                 poll_initial: float = 1.0, poll_max: float = 30.0, backoff: float = 1.5,
+                 timeout: float = None, is_done: Callable[[int], bool] = procedure_done,
+                 on_result: Callable[[wubCalibrationResult], None] = None):
+        if procedure not in PROCEDURES:
+            raise ValueError(f"{procedure} not an acceptable procedure: {', '.join(PROCEDURES)}")
+
+        self._procedure = PROCEDURES[procedure]
+        self._args = list(args) if args is not None else []
+        self._poll_initial = poll_initial
+        self._poll_max = poll_max
+        self._backoff = backoff
+        self._timeout = timeout
+        self._is_done = is_done
+        self._on_result = on_result
+
+        self._jobs = [_job(wubctl, wubCalibrationResult(wubctl.basenumber, wubctl._port,
+                                                         procedure, self._args), poll_initial)
+                      for wubctl in wubctls]
+
+        self.tstart = None
+        self.tstop = None
+
+    @property
+    def results(self) -> list[wubCalibrationResult]:
+        return [job.result for job in self._jobs]
+
+    def _start(self, job: _job):
+        res = job.result
+        res.tstart = time.time()
+        ok, _ = parse_response(self._procedure.start,
+                               job.wubctl.send_recv(self._procedure.start, *self._args))
+        if not ok:
+            self._finish(job, 'failed', f"{self._procedure.start.name} was rejected")
+            return
+
+        res.state = 'running'
+        job.next_poll = time.monotonic() + job.interval
+        logger.info(f"Base {res.base}: {self._procedure.start.name} started.")
+
+    def _poll(self, job: _job):
+        res = job.result
+        res.npolls += 1
+        ok, values = parse_response(self._procedure.status, job.wubctl.send_recv(self._procedure.status))
+        if not ok or len(values) == 0:
+            logger.warning(f"Base {res.base}: no valid {self._procedure.status.name} response; retrying.")
+        else:
+            res.status = values[0]
+            if self._is_done(res.status):
+                self._finish(job, 'done')
+                return
+
+        job.interval = min(job.interval * self._backoff, self._poll_max)
+        job.next_poll = time.monotonic() + job.interval
+
+    def _finish(self, job: _job, state: str, error: str = None):
+        res = job.result
+        res.tstop = time.time()
+        res.state = state
+        res.error = error
+
+        if state == 'done' and self._procedure.readout is not None:
+            ok, values = parse_response(self._procedure.readout, job.wubctl.send_recv(self._procedure.readout))
+            if ok:
+                res.result = values
+            else:
+                res.error = f"{self._procedure.readout.name} was rejected"
+
+        if state == 'done':
+            logger.info(f"Base {res.base}: {self._procedure.name} finished after {res.duration:.1f} s ({res.npolls} polls).")
+        else:
+            logger.warning(f"Base {res.base}: {self._procedure.name} {state}" + (f" -- {error}" if error else "."))
+
+        if self._on_result is not None:
+            self._on_result(res)
+
+    def abort(self):
+        '''Abort the procedure on every base that is still running.'''
+        for job in self._jobs:
+            if job.result.state == 'running':
+                if self._procedure.abort is not None:
+                    job.wubctl.send_recv(self._procedure.abort)
+                self._finish(job, 'aborted')
+
+    def run(self) -> list[wubCalibrationResult]:
+        self.tstart = time.time()
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+
+        for job in self._jobs:
+            self._start(job)
+
+        try:
+            while True:
+                running = [job for job in self._jobs if job.result.state == 'running']
+                if len(running) == 0:
+                    break
+
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    for job in running:
+                        if self._procedure.abort is not None:
+                            job.wubctl.send_recv(self._procedure.abort)
+                        self._finish(job, 'timeout', f"still running after {self._timeout} s")
+                    break
+
+                for job in running:
+                    if job.next_poll <= now:
+                        self._poll(job)
+
+                pending = [job.next_poll for job in running if job.result.state == 'running']
+                wake = min(pending) if len(pending) > 0 else now
+                if deadline is not None:
+                    wake = min(wake, deadline)
+                time.sleep(max(wake - time.monotonic(), 0.0))
+
+        except KeyboardInterrupt:
+            logger.warning("Interrupted; aborting running procedures.")
+            self.abort()
+
+        self.tstop = time.time()
+        return self.results
+
+    def write_results(self, filename: str):
+        '''Store the run and all per-base results as JSON.'''
+        output = dict(procedure=self._procedure.name,
+                      args=self._args,
+                      tstart=self.tstart,
+                      tstop=self.tstop,
+                      wallclock=None if self.tstart is None or self.tstop is None else self.tstop - self.tstart,
+                      results=[res.to_dict() for res in self.results])
+        with open(filename, 'w') as f:
+            json.dump(output, f, indent=2)
+        logger.info(f"Wrote {self._procedure.name} results to {filename}.")
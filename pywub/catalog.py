@@ -37,11 +37,15 @@ def parse_setup_config(filename:str = None, config:list[str] = None):
                 s.strip()
 
             mask = None 
-            try: 
-                mask = int(spl[0], 16)
-                offset = 1
-            except ValueError:
-                offset = 0
+            offset = 0
+            # Command names such as "dac" are valid hex too, so only a token that
+            # is not a command can be a mask.
+            if spl[0].strip('"').upper() not in command_names:
+                try: 
+                    mask = int(spl[0], 16)
+                    offset = 1
+                except ValueError:
+                    pass
 
             command = spl[0 + offset]
             sleeptime = spl[1 + offset]
@@ -85,6 +89,28 @@ class wubCMD_RC(IntEnum):
     CMD_RC_RESP_TIMEOUT = auto()
     CMD_RC_INVALID = auto()
 
+
+# Readback caching policy (used by pywub.cache through wubCTL.send_recv).
+# Session-cached values never change while the MCU is running; TTL-cached values
+# are running averages that may be reused for a configurable time.
+CACHE_SESSION = 'session'
+CACHE_TTL = 'ttl'
+
+_SESSION_CACHED = {"VERSION", "GET_UID", "GET_ASSUMED_CONSTANTS"}
+_AVERAGED = {"MONSTATUS", "REPORTAVG", "GET_AVG_V10", "GET_AVG_DI10", "GET_AVG_ISUP", 
+             "GET_AVG_VSUP", "GET_AVG_FRAC", "GET_AVG_VDDU", "GET_AVG_TEMP"}
+
+# Commands that make cached readbacks stale.
+_CACHE_INVALIDATION = {
+    "RESET_MCU": _SESSION_CACHED | _AVERAGED,
+    "RESETAVG": _AVERAGED,
+    "SET_VDDU": {"GET_AVG_VDDU", "REPORTAVG", "MONSTATUS"},
+    "SET_HVMON_SERIES_R": {"GET_ASSUMED_CONSTANTS"} | _AVERAGED,
+    "SET_HVMON_SENSE_R": {"GET_ASSUMED_CONSTANTS"} | _AVERAGED,
+}
+for _name in ["VOLTAGE", "FRACTION", "PWMSTART", "PWMSTOP", "MONSTART", "MONSTOP", "TRIP", "TRIP_RESET"]:
+    _CACHE_INVALIDATION[_name] = _AVERAGED
+
     
 class wubCMD_entry():
     
@@ -114,46 +140,70 @@ class wubCMD_entry():
         #Fix the VERSION command format string:
         if self.cmd_name.lower() == "cmd_version":
             self.retargs = "30sb30sb"
+
+        self._compile()
+
+        if self.name in _SESSION_CACHED:
+            self.cache_policy = CACHE_SESSION
+        elif self.name in _AVERAGED:
+            self.cache_policy = CACHE_TTL
+        else:
+            self.cache_policy = None
+        self.invalidates = frozenset(_CACHE_INVALIDATION.get(self.name, ()))
+
+    def _compile(self):
+        '''Precompute everything build() and unpack() need on every call.
+
+        The struct codecs, the binary header and the ASCII command prefix depend
+        only on the catalog entry, so they are built once per process here rather
+        than once per command sent.
+        '''
+        self.args_struct = struct.Struct(f"!{self.args}")
+        self.retargs_struct = struct.Struct(f">{self.retargs}")
+        self.retargs_size = self.retargs_struct.size
+        self.nargs = len(self.args)
+
+        self.header = struct.pack("!HH", 0, self.cmd_id)
+        self.ascii_name = self.name.upper()
         
     def __repr__(self):
         return f"ID: {hex(self.cmd_id)} CMD_NAME: {self.cmd_name:25s} \
                 ARGS: {self.args if len(self.args) > 0 else None} RETARGS: {self.retargs if len(self.retargs) > 0 else None}"
     
-    def build(self, mode : str = 'b', args: list = []) -> bytes:
+    def build(self, mode : str = 'b', *args) -> bytes:
         '''Build a bytes object from a wubCMD and related arguments. 
         
         Args:
             mode (str): comms mode (ascii || binary)
-            args (list): Variable length argument list to pass along with command. 
+            *args: Variable length argument list to pass along with command. 
             
         Returns:
             bytes: formatted command object with delimeter. 
         
         '''
-        command_str = ''
-        arg_str = ''
-        build = None
-        if(mode.upper()[0] == 'A'): #Covers 'ascii, a, ASCII, asc, etc.'
-            command_str = f"{self.name.upper()}"
-
-            if self.args is not None:
-                for i, fmt in enumerate(self.args):
-                    arg_str += f" {args[i]}"
-
-            build = (command_str + arg_str.format(*args))
-
-            return build 
+        if mode[0] in 'aA': #Covers 'ascii, a, ASCII, asc, etc.'
+            if len(args) == 0:
+                return f"{self.ascii_name}\n".encode()
+            arg_str = " ".join([f"{arg}" for arg in args[0:self.nargs]])
+            return f"{self.ascii_name} {arg_str}\n".encode()
             
         else: #Binary
-            
-            command_str = struct.pack("!HH", 0, self.cmd_id) 
-            arg_str = struct.pack("!{self.args}", *args)
-            #print(self.args)
-            build = command_str + arg_str
+            return cobs.encode(self.header + self.args_struct.pack(*args))
 
-            build = cobs.encode(build)
+    def unpack(self, readback: bytes) -> tuple[int, list]:
+        '''Split a binary readback into the return code and the return arguments. 
+
+        Args:
+            readback (bytes): The readback buffer, ending with the CMD_RC byte.
+
+        Returns:
+            tuple: (CMD_RC, retargs)
+        '''
+        retargs = []
+        if self.retargs_size > 0:
+            retargs = list(self.retargs_struct.unpack(readback[-(self.retargs_size + 1):-1]))
 
-            return build
+        return readback[-1], retargs
             
 @dataclass
 class wubCMD_resp:
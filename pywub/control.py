@@ -1,22 +1,31 @@
 import serial
+import os
 import sys
 import time
+import select
 #import numpy as np
 import struct
 from enum import IntEnum, auto
-from io import TextIOWrapper
+from io import TextIOWrapper, TextIOBase
 #import yaml
 import threading
+from dataclasses import dataclass
 
 
 
 from . import parser as parser
-from collections import deque 
+from . import records
 from queue import Queue
 
 from . import catalog
 from .catalog import ctlg as wubCMD_catalog
 from .catalog import wubCMD_RC
+from .metrics import wubMetrics
+from .rxring import wubRxRing
+from .batching import wubBatchScheduler, wubBatchResult, port_quiet_time
+from .cache import wubReadbackCache
+from .wubase import wuBase
+from .baud import BAUD_CANDIDATES, BAUD_TOLERANCE, uart_log_errors, wubBaudCache
 
 wubCMD_entry = catalog.wubCMD_entry
 
@@ -29,6 +38,128 @@ class readout_state(IntEnum):
     waiting_on_payload = auto()
 
 
+ASCII_TERMINATOR = b"OK\n"
+ASCII_ERROR = b"?"
+
+
+class ascii_response_scanner():
+    '''Incremental terminator and error detection for ASCII responses.
+
+    Chunks are fed as they come off the wire. Only the last few bytes are carried 
+    between calls, so the cost per chunk is a couple of bytes.find() calls 
+    regardless of how much data has been received.
+    '''
+
+    def __init__(self, terminator: bytes = ASCII_TERMINATOR):
+        self._terminator = terminator
+        self._tail = b""
+        self.error_found = False
+        self.terminated = False
+
+    def feed(self, chunk: bytes) -> bool:
+        '''Scan a chunk; returns True if the stream now ends with the terminator.'''
+        if not self.error_found and chunk.find(ASCII_ERROR) >= 0:
+            self.error_found = True
+
+        n = len(self._terminator)
+        # Only short chunks need the carried-over tail; avoid copying big ones.
+        window = chunk if len(chunk) >= n else self._tail + chunk
+        start = len(window) - n
+        self.terminated = start >= 0 and window.find(self._terminator, start) >= 0
+        self._tail = window[-n:]
+
+        return self.terminated
+
+
+# Seconds (at least) without new bytes after a plausible verbose-mode response 
+# before it is taken as complete.
+VERBOSE_QUIET_TIME = 2e-3
+
+_VALID_RCS = frozenset(int(rc) for rc in wubCMD_RC)
+
+
+class binary_response_scanner():
+    '''Separates device debug text from a fixed-size binary response.
+
+    With VERBOSE on, the firmware prints newline-terminated text ahead of the
+    response (the retargs followed by the CMD_RC byte). Chunks are fed as they 
+    come off the wire; the buffer holds a plausible response once it is at least
+    `size` bytes long, ends with a valid CMD_RC, and has only whole text lines 
+    in front of the last `size` bytes. Each feed checks a couple of bytes.
+    '''
+
+    def __init__(self, size: int):
+        self._size = size
+        self._buf = bytearray()
+        self.complete = False
+
+    def feed(self, chunk: bytes) -> bool:
+        '''Add a chunk; returns True if the buffer now ends with a plausible response.'''
+        buf = self._buf
+        buf += chunk
+        size = self._size
+        self.complete = (len(buf) >= size and buf[-1] in _VALID_RCS and 
+                         (len(buf) == size or buf[-size - 1] == 0x0A))
+        return self.complete
+
+    @property
+    def response(self) -> bytes:
+        return bytes(self._buf[-self._size:])
+
+    @property
+    def text(self) -> bytes:
+        return bytes(self._buf[:-self._size]) if len(self._buf) > self._size else b""
+
+    @property
+    def readback(self) -> bytes:
+        return bytes(self._buf)
+
+
+_ASCII_INT_CODES = "bBhHiIlLqQnN"
+_ASCII_FLOAT_CODES = "efd"
+
+
+def parse_response(command: wubCMD_entry, resp: dict) -> tuple[bool, list]:
+    '''Reduce a send_recv() result to (ok, retargs) in either comms mode.
+
+    Binary responses carry the CMD_RC and the unpacked retargs. ASCII responses
+    are checked for the error marker and terminator, and the whitespace separated
+    values before "OK" are converted following the command's retargs format. 
+    Values that do not convert (e.g. free-form printouts) are returned as strings.
+
+    Args:
+        command (wubCMD_entry): The command that produced the response.
+        resp (dict): Return value of send_recv(), send_recv_ascii() or send_recv_binary().
+
+    Returns:
+        tuple: (ok, retargs)
+    '''
+    response = resp['response']
+    if isinstance(response, dict):
+        return response['CMD_RC'] == wubCMD_RC.CMD_RC_OK, list(response['retargs'])
+
+    text = response.strip()
+    ok = not text.startswith(ASCII_ERROR.decode()) and text.endswith(ASCII_TERMINATOR.decode().strip())
+    if not ok:
+        return False, []
+
+    tokens = text[:-len(ASCII_TERMINATOR.strip())].split()
+    codes = [c for c in command.retargs if c.isalpha() or c == '?']
+    values = []
+    for index, token in enumerate(tokens):
+        code = codes[index] if index < len(codes) else None
+        try:
+            if code is not None and code in _ASCII_INT_CODES:
+                values.append(int(token, 0))
+            elif code is not None and code in _ASCII_FLOAT_CODES:
+                values.append(float(token))
+            else:
+                values.append(token)
+        except ValueError:
+            values.append(token)
+    return True, values
+
+
 class CustomFormatter(logging.Formatter):
     """Logging colored formatter, adapted from https://stackoverflow.com/a/56944256/3638629"""
 
@@ -61,6 +192,23 @@ class CustomFormatter(logging.Formatter):
 
 
     
+# Kernel line discipline buffer (N_TTY_BUF_SIZE) on POSIX; the most that 
+# in_waiting can report before the tty layer starts throttling or dropping data.
+DEFAULT_RX_CAPACITY = 4096
+
+# Fractions of the receive buffer capacity used by the overflow watch.
+RX_AGGRESSIVE_FRACTION = 0.5
+RX_RELAXED_FRACTION = 0.25
+RX_NEAR_OVERFLOW_FRACTION = 0.9
+
+
+@dataclass
+class rx_overflow_event:
+    timestamp: float
+    in_waiting: int
+    capacity: int
+
+
 class InvalidCommandException(Exception):
     """Raised when an invalid command is sent to the wuBase."""
     pass
@@ -75,10 +223,13 @@ class wubCTL():
     
     def __init__(self, port=None, baud=1181818, mode="ascii", 
                  autobaud=True, timeout=1, verbosity=False,
-                 store_mode='bulk', parity=False):
+                 store_mode='bulk', parity=False, basenumber=0,
+                 rx_buffer_size=1 << 20, rx_capacity=None, readback_ttl=0.0,
+                 state_file=None, revert_on_close=True):
         
         self._s = None
         self._port = port
+        self._basenumber = basenumber
         self._baudrate = baud
         self._parity = serial.PARITY_EVEN if parity else serial.PARITY_NONE
 
@@ -87,15 +238,28 @@ class wubCTL():
         #DAQ settings
         self._store_mode = store_mode
         self._batch_mode_running = False
+        self._batch_done_callbacks = []
+        self._frame_listeners = []
+        self.nbatches_done = 0
         self.request_abort = False #Flag 
         self.request_stop  = False
         self._abort_requested = False
         self._stop_requested = False        
 
         #wuBase operation mode
-        self._autobaud=autobaud
         self._mode = mode.upper()
 
+        #Link state of the device itself (see pywub.wubase). A state file saved
+        #by a previous session lets ensure_link() skip transitions already made.
+        self._state_file = state_file
+        self._revert_on_close = revert_on_close
+        if state_file is not None and os.path.exists(state_file):
+            self.device = wuBase.load(state_file, basenumber)
+            logger.info(f"Loaded link state {self.device} from {state_file}.")
+        else:
+            self.device = wuBase(basenumber)
+            self.device.setautobaud(autobaud)
+
         #DAQ settings (ASCII mode)
         
         #DAQ settings (BINARY mode)
@@ -105,6 +269,19 @@ class wubCTL():
         self.nbytes_recv = 0
         self.nframes_binary = 0
 
+        #Receive buffer of the 'ring' store mode, allocated on first use and kept (see pywub.rxring)
+        self._rx_ring = None
+        self._record_buf = bytearray()
+
+        #Transport health counters (see pywub.metrics)
+        self.metrics = wubMetrics(name=f"{port}")
+
+        #Slow-control readback cache (see pywub.cache)
+        self.readback_cache = wubReadbackCache(ttl=readback_ttl)
+        cache = self.readback_cache
+        self.metrics.register_gauge("readback_cache_hits", lambda: cache.hits)
+        self.metrics.register_gauge("readback_cache_misses", lambda: cache.misses)
+
         self.catalog = wubCMD_catalog
         
         if mode.lower() != "ascii" and mode.lower() != 'binary':
@@ -113,6 +290,8 @@ class wubCTL():
             self._mode = "ascii"
         else:
             self._mode = mode
+        #Comms mode ensure_link() brings the link to; self._mode follows the device.
+        self._link_mode = self._mode
             
         try:
             self._s = serial.Serial(self._port, self._baudrate, 
@@ -123,48 +302,57 @@ class wubCTL():
             self._s.flushInput()
             self._s.flushOutput()
                        
+            self._setup_rx_watch(rx_buffer_size, rx_capacity)
             
         except serial.SerialException: 
             logger.error(f"Failed to open port \"{port}\"; exiting.")
             exit(1)
             #raise serial.SerialException("") 
 
-        def create_method(command:wubCMD_entry):
-            def new_method(self, *args, **kwargs):
-                return self.send_recv(command, *args)
-
-            name = f"cmd_{command.name.lower()}"
-            new_method.__name__ = name
-        
-            setattr(wubCTL, name, new_method)
-
-        logger.info(f"Generating {len(self.catalog.keys())} methods from catalog")
-        for cmd in self.catalog.keys():
-            create_method(self.catalog[cmd])
-
         logger.info(f"Done creating {self.__class__.__name__} object on port {port} with baudrate {self._baudrate}.")
         logger.info(f"Operations mode: {self._mode}")
             
 
 
     def __del__(self):
-        if self._s:
-            if not self.isascii:
-                logger.info("Reverting to ASCII mode.")
-                self.cmd_asciimode()
-            if not self.autobaud:
-                logger.info("Reverting to autobaud mode.")
-                self.set_autobaud()
+        self.close()
 
+    def close(self, revert:bool = None):
+        '''Revert the link, save the device state and close the serial port.
+
+        Does nothing once the port is closed, so it is safe to call more than once.
+
+        Args:
+            revert (bool): Return the wuBase to ASCII and autobaud mode first; 
+                the revert_on_close setting if None.
+        '''
+        if not getattr(self, '_s', None):
+            return
+        revert = self._revert_on_close if revert is None else revert
+        try:
+            if revert:
+                if not self.device.isascii:
+                    logger.info("Reverting to ASCII mode.")
+                    self.send_recv_binary(wubCMD_catalog.asciimode)
+                if not self.device.autobaud:
+                    logger.info("Reverting to autobaud mode.")
+                    self.set_autobaud()
+            self.save_state()
+        finally:
             logger.info("Shutting down serial connection.")
             self._s.close()
+            self._s = None
+
+    @property
+    def basenumber(self):
+        return self._basenumber
 
     @property
     def binaryverbose(self):
         return self._binaryverbosity
     @property
     def autobaud(self):
-        return self._autobaud
+        return self.device.autobaud
 
     @property 
     def mode(self):
@@ -181,9 +369,120 @@ class wubCTL():
     def batch_mode_running(self):
         return self._batch_mode_running
     
+    def _setup_rx_watch(self, rx_buffer_size:int, rx_capacity:int = None):
+        '''Request a large host receive buffer and set the occupancy thresholds.
+
+        pyserial can only resize the driver buffer on Windows; elsewhere the
+        capacity falls back to DEFAULT_RX_CAPACITY unless rx_capacity is given.
+        '''
+        capacity = DEFAULT_RX_CAPACITY
+        if rx_buffer_size is not None and hasattr(self._s, 'set_buffer_size'):
+            try:
+                self._s.set_buffer_size(rx_size=rx_buffer_size)
+                capacity = rx_buffer_size
+                logger.debug(f"Requested a {rx_buffer_size} byte receive buffer.")
+            except (serial.SerialException, ValueError) as e:
+                logger.warning(f"Could not set receive buffer size: {e}")
+        if rx_capacity is not None:
+            capacity = rx_capacity
+
+        self.rx_capacity = capacity
+        self._rx_aggressive_level = int(capacity * RX_AGGRESSIVE_FRACTION)
+        self._rx_relaxed_level = int(capacity * RX_RELAXED_FRACTION)
+        self._rx_near_overflow_level = int(capacity * RX_NEAR_OVERFLOW_FRACTION)
+
+        self._drain_aggressive = False
+        self._rx_near_overflow = False
+        self.overflow_events = []
+
+    @property
+    def draining_aggressively(self) -> bool:
+        return self._drain_aggressive
+
+    def _check_rx_occupancy(self, n:int):
+        if n >= self._rx_aggressive_level:
+            if not self._drain_aggressive:
+                self._drain_aggressive = True
+                logger.debug(f"Receive buffer at {n}/{self.rx_capacity} bytes; draining aggressively.")
+
+            if n >= self._rx_near_overflow_level:
+                if not self._rx_near_overflow:
+                    self._rx_near_overflow = True
+                    self.overflow_events.append(rx_overflow_event(time.time(), n, self.rx_capacity))
+                    self.metrics.near_overflows += 1
+                    logger.warning(f"Receive buffer near overflow: {n}/{self.rx_capacity} bytes in waiting.")
+            else:
+                self._rx_near_overflow = False
+
+        elif n <= self._rx_relaxed_level:
+            self._rx_near_overflow = False
+            if self._drain_aggressive:
+                self._drain_aggressive = False
+                logger.debug(f"Receive buffer back to {n}/{self.rx_capacity} bytes.")
+
+    def drain(self) -> bytes:
+        '''Read whatever is waiting, blocking for at least one byte (up to the timeout).
+
+        While the receive buffer is filling up this keeps reading until it has been
+        emptied, so a single, larger chunk is handed to the caller's processing.
+        '''
+        n = self.bytes_in_waiting
+        if not self._drain_aggressive:
+            return self.read(n or 1)
+
+        chunks = []
+        while n > 0:
+            chunks.append(self.read(n))
+            n = self.bytes_in_waiting
+        return b"".join(chunks)
+
+    def add_frame_listener(self, fn):
+        '''Register fn(frames, basenumber, timestamp), called from the receive thread
+        with each batch of decoded frames in 'frame' and 'ring' store mode. 
+
+        Listeners run in the hot path and should only hand the frames off (e.g. 
+        pywub.shmring.wubShmRingProducer.publish_frames). In 'ring' store mode the 
+        frames are memoryviews into the receive ring, valid only during the call; 
+        copy them (bytes(frame)) to keep them. pywub.hitview.hit_views(frames) gives 
+        numpy arrays over the same memory, under the same contract.
+        '''
+        self._frame_listeners.append(fn)
+
+    def remove_frame_listener(self, fn):
+        if fn in self._frame_listeners:
+            self._frame_listeners.remove(fn)
+
+    def add_batch_done_callback(self, fn):
+        '''Register fn() to be called from the receive thread when a batch readout ends.'''
+        self._batch_done_callbacks.append(fn)
+
+    def remove_batch_done_callback(self, fn):
+        if fn in self._batch_done_callbacks:
+            self._batch_done_callbacks.remove(fn)
+
+    def _batch_finished(self):
+        self._batch_mode_running = False
+        self.nbatches_done += 1
+        for fn in list(self._batch_done_callbacks):
+            fn()
+
+    def prepare_batch(self):
+        '''Clear the stop/abort flags and counters left by a previous batch on this link.'''
+        self.request_abort = False
+        self.request_stop = False
+        self._abort_requested = False
+        self._stop_requested = False
+        self.nbytes_recv = 0
+        self.nframes_binary = 0
+        self.metrics.reset()
+
     @property
     def bytes_in_waiting(self):
-        return self._s.in_waiting
+        n = self._s.in_waiting
+        self.metrics.update_in_waiting(n)
+        if n >= self._rx_aggressive_level or self._drain_aggressive:
+            self._check_rx_occupancy(n)
+        return n
     
     def set_comms_mode(self, mode:str):
         if (mode.upper())[0] == 'A':
@@ -195,13 +494,9 @@ class wubCTL():
 
     def set_baud(self, baud:int):
         if baud < 1: 
-            ret = self.cmd_baud(-1)
-            self._autobaud = True
+            return self.cmd_baud(-1)
         else:
-            ret = self.cmd_baud(baud)
-            self._autobaud = False
-
-        return ret
+            return self.cmd_baud(baud)
     
     def set_autobaud(self):
         return self.set_baud(-1)
@@ -216,10 +511,14 @@ class wubCTL():
         Returns: 
             int: The number of bytes written. 
         '''
+        tstart = time.perf_counter()
+        nautobaud = 0
         if self.autobaud:
             #print("autobaud")
-            self._s.write('U'.encode())
-        return self._s.write(cmd)
+            nautobaud = self._s.write('U'.encode())
+        nsent = self._s.write(cmd)
+        self.metrics.record_write(nautobaud + nsent, time.perf_counter() - tstart)
+        return nsent
         
     def recv(self, size:int = None) -> bytes:
         '''Returns bytes waiting in the UART buffer. 
@@ -232,16 +531,20 @@ class wubCTL():
             
         '''
         if size is None: 
-            return self._s.read(size=self._s.in_waiting)
+            return self.read(self._s.in_waiting)
         else:
-            return self._s.read(size=size)
+            return self.read(size)
     
     def read(self, size:int) -> bytes:
         '''Just simplifies reading from the serial port. 
         
         '''
+        tstart = time.perf_counter()
         data = self._s.read(size=size)
-        #self.nbytes_recv += len(data)
+        metrics = self.metrics
+        metrics.read_time += time.perf_counter() - tstart
+        metrics.nreads += 1
+        metrics.bytes_recv += len(data)
         return data
 
     def unpack_readback(self, command: wubCMD_entry, readback: bytes) -> dict:
@@ -257,17 +560,12 @@ class wubCTL():
         '''
         
         
-        cmd_return_args_size = struct.calcsize(command.retargs)
-        cmd_return_code = readback[-1]
-        retargs = []
-        logger.debug(readback)
-        if len(command.retargs) > 0:
-            retargs = [i for i in struct.unpack(f'>{command.retargs}', readback[-(cmd_return_args_size+1):-1])]
+        cmd_return_code, retargs = command.unpack(readback)
         
         return dict(CMD_RC=cmd_return_code, retargs=retargs)
     
                
-    def send_recv_ascii(self, command: wubCMD_entry, *args) -> dict:    
+    def send_recv_ascii(self, command: wubCMD_entry, *args, response_timeout: float = None) -> dict:    
         '''Send a ASCII-formatted command and return the response.
         
         Blocks until there is at least one byte in the readback buffer. 
@@ -275,40 +573,37 @@ class wubCTL():
         Args:
             command (wubCMD): wubCMD object. 
             *args: Variable length argument list to pass along with command. 
+            response_timeout (float): Give up on an unterminated response after this 
+                many seconds (None waits indefinitely).
         
         '''
         logger.debug("ASCII send_recv")
-        deq = deque(['0','0','0'], maxlen=3)
             
         cmd = command.build('a', *args)
-        logger.debug(f"Command string being sent: {cmd}")
+        logger.debug("Command string being sent: %s", cmd)
         self.send(cmd)
         recv_buf = []
+        scanner = ascii_response_scanner()
         
-        error_found = False
-        #FIXME: Add a timeout here.
-        while("".join(deq) != 'OK\n' and not error_found):
-            response = self._s.read(size=self._s.in_waiting)
-            recv_buf += response
-            for i in response.decode():
-                if i == '?':
-                    error_found = True
-                deq.append(i)
+        deadline = None if response_timeout is None else time.monotonic() + response_timeout
+        while not scanner.terminated and not scanner.error_found:
+            response = self.read(self._s.in_waiting or 1)
+            if response:
+                recv_buf.append(response)
+                scanner.feed(response)
+            elif deadline is not None and time.monotonic() > deadline:
+                logger.debug(f"No complete response to {command.name} within {response_timeout} s.")
+                break
         
         if command == wubCMD_catalog.binarymode:
             self.set_comms_mode("BINARY")
-        elif command == wubCMD_catalog.baud:
-            if args[0] == -1:
-                self._autobaud = True
-                self._s.baudrate = self._baudrate
-            else:
-                self._autobaud = False
-                self._s.baudrate = args[0]
-                self._baudrate = args[0]            
         
-        logger.debug(f"Command response bytes: {recv_buf}")
+        recv_buf = b"".join(recv_buf)
+        logger.debug("Command response bytes: %s", recv_buf)
         
-        return dict(response=bytes(recv_buf).decode())
+        resp = dict(response=recv_buf.decode())
+        self._track(command, args, resp)
+        return resp
     
     def send_recv_binary(self, command: wubCMD_entry, *args) -> dict:
         '''Send a binary-formatted command and return the response.
@@ -326,57 +621,342 @@ class wubCTL():
 
         #logger.debug(f"nsent: {nsent}\t len(command_bytes): {len(command_bytes)}")
         #print([f"{b:x}" for b in command_bytes])
-        cmd_return_args_size = struct.calcsize(command.retargs)
+        cmd_return_args_size = command.retargs_size
         #while self._s.in_waiting != cmd_return_args_size + 1:
         #Wait for at least one byte (the return code).
     
         #FIXME: Need to catch case where insufficient bytes are transmitted. 
         readback = None       
-        if self.binaryverbose:
-            time.sleep(0.5) #Ensure we have everything. 
-
-            readback = self._s.read(size=self._s.in_waiting)
+        verbose_text = b""
+        # VERBOSE itself may already be answered with debug text.
+        if self.binaryverbose or command == wubCMD_catalog.verbose:
+            readback, verbose_text = self._read_verbose_response(cmd_return_args_size + 1)
 
             logger.debug("Verbose mode bytes captured: ")
-            verbose_output = readback[0:-(cmd_return_args_size + 1)]
-            if(len(verbose_output) > 0):
-                logger.debug(verbose_output.decode())
+            if(len(verbose_text) > 0):
+                for line in verbose_text.decode(errors='replace').splitlines():
+                    logger.debug(line)
             else:
                 logger.debug("No verbose response.")
 
-            
         else:
-            readback = self._s.read(size=cmd_return_args_size + 1) #+1 for the CMD_RC
+            readback = self.read(cmd_return_args_size + 1) #+1 for the CMD_RC
 
             #This is a lazy way to do this. 
             # FIXME: make this a for loop, try it a few times, and throw an error if it fails
             if len(readback) != cmd_return_args_size + 1:
-                readback2 = self._s.read(size=cmd_return_args_size + 1 - len(readback)) 
+                readback2 = self.read(cmd_return_args_size + 1 - len(readback)) 
                 readback = readback + readback2
 
         response = self.unpack_readback(command, readback[-(cmd_return_args_size + 1)::])
         #logger.debug(f"Command: {command.name}"
-        logger.debug("---------------")
-        logger.debug(f"Readback: {readback}")
-        logger.debug("---------------")
-        # logger.debug("*** Decoded: ")
-        # logger.debug(readback[0:-(cmd_return_args_size+1)].decode())
-        logger.debug("*** Unpacked: ")
         try:
-            logger.debug(f"***\tCMD_RC: {wubCMD_RC(response['CMD_RC']).name}")
-            logger.debug(f"***\tRetargs: {response['retargs']}")
+            rc_name = wubCMD_RC(response['CMD_RC']).name
         except ValueError:
+            rc_name = None
             logger.warning(f"*** Invalid RC code in response (likely due to verbosity)\n")
-            
-        logger.debug("---------------")
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("---------------")
+            logger.debug(f"Readback: {readback}")
+            logger.debug("---------------")
+            # logger.debug("*** Decoded: ")
+            # logger.debug(readback[0:-(cmd_return_args_size+1)].decode())
+            logger.debug("*** Unpacked: ")
+            logger.debug(f"***\tCMD_RC: {rc_name}")
+            logger.debug(f"***\tRetargs: {response['retargs']}")
+            logger.debug("---------------")
 
         if command == wubCMD_catalog.asciimode:
             self.set_comms_mode("ASCII")
 
-        return dict(response=response)
+        resp = dict(response=response)
+        if len(verbose_text) > 0:
+            resp['verbose'] = verbose_text.decode(errors='replace')
+        self._track(command, args, resp)
+        return resp
+
+    def _read_verbose_response(self, size: int) -> tuple[bytes, bytes]:
+        '''Read a binary response of `size` bytes preceded by any amount of verbose text.
+
+        Bytes are consumed as they arrive. Once they end with a plausible response
+        (see binary_response_scanner), the link has to stay quiet for a short
+        while (VERBOSE_QUIET_TIME, or 32 characters of wire time if longer) for 
+        the response to be accepted; otherwise reading continues. A read that 
+        times out on the serial port ends the wait.
+
+        Returns:
+            tuple: (all bytes read, the verbose text in front of the response)
+        '''
+        scanner = binary_response_scanner(size)
+        quiet = max(VERBOSE_QUIET_TIME, 320 / self._s.baudrate) if self._s.baudrate else VERBOSE_QUIET_TIME
+        while True:
+            if scanner.complete:
+                time.sleep(quiet)
+                if self._s.in_waiting == 0:
+                    break
+            chunk = self.read(self._s.in_waiting or 1)
+            if len(chunk) == 0:
+                logger.warning(f"Incomplete verbose-mode response: {scanner.readback}")
+                break
+            scanner.feed(chunk)
+        return scanner.readback, scanner.text
     
-    def send_recv(self, command: wubCMD_entry, *args) -> dict:       
-       
+    def _track(self, command: wubCMD_entry, args: tuple, resp: dict):
+        '''Feed a response to the device state and follow baud changes on the port.'''
+        if command not in _LINK_COMMANDS:
+            return
+
+        ok = parse_response(command, resp)[0]
+        self.device.update(command, args, ok)
+
+        # A rejected BAUD leaves the device at its old rate.
+        if command == wubCMD_catalog.baud and ok:
+            if args[0] == -1:
+                self._s.baudrate = self._baudrate
+            else:
+                self._s.baudrate = args[0]
+                self._baudrate = args[0]
+
+        self.save_state()
+
+    def save_state(self):
+        if self._state_file is not None:
+            self.device.save(self._state_file)
+
+    def _probe(self, request: bytes, expected: bytes, timeout: float) -> bool:
+        self._s.reset_input_buffer()
+        self._s.write(request)
+        saved_timeout = self._s.timeout
+        self._s.timeout = timeout
+        try:
+            data = self._s.read_until(expected, size=len(expected) + 64)
+        finally:
+            self._s.timeout = saved_timeout
+        return data.endswith(expected)
+
+    def _probe_binary(self, timeout: float) -> bool:
+        return self._probe(wubCMD_catalog.ok.build('b'), bytes([wubCMD_RC.CMD_RC_OK]), timeout)
+
+    def _probe_ascii(self, autobaud: bool, timeout: float) -> bool:
+        prefix = b"U" if autobaud else b""
+        return self._probe(prefix + wubCMD_catalog.ok.build('a'), ASCII_TERMINATOR, timeout)
+
+    def verify_link(self, timeout: float = 0.2) -> bool:
+        '''Confirm the recorded device state with a single OK round trip.'''
+        if not self.device.autobaud:
+            self._s.baudrate = self.device.baud
+        if self.device.isascii:
+            ok = self._probe_ascii(self.device.autobaud, timeout)
+        else:
+            ok = self._probe_binary(timeout)
+
+        if ok:
+            self.device.mark_verified()
+        return ok
+
+    def probe_link(self, timeout: float = 0.2) -> bool:
+        '''Work out the device's comms mode and baud mode at the port's baud rate.
+
+        Tries, in order: binary at a fixed baud, ASCII at a fixed baud and ASCII 
+        in autobaud, each with one OK round trip.
+        '''
+        baud = self._s.baudrate
+        if self._probe_binary(timeout):
+            self.device.set_comms_mode("BINARY")
+            self.device.setbaud(baud)
+        else:
+            # Terminate whatever partial line the binary probe left behind.
+            self._probe(b"\n", ASCII_TERMINATOR, timeout)
+            if self._probe_ascii(False, timeout):
+                self.device.set_comms_mode("ASCII")
+                self.device.setbaud(baud)
+            elif self._probe_ascii(True, timeout):
+                self.device.reset()
+            else:
+                logger.warning(f"No response from the device on {self._port} at {baud} baud.")
+                return False
+
+        self.device.mark_verified()
+        logger.info(f"Probed link state: {self.device}")
+        self.save_state()
+        return True
+
+    def ensure_link(self, mode: str = None, baud: int = None) -> list[str]:
+        '''Bring the device to a fixed baud rate and comms mode, skipping what is already done.
+
+        The recorded state is verified first (or probed if unknown), so only the
+        missing transitions are sent. The host side follows the device to the 
+        requested comms mode.
+
+        Args:
+            mode (str): Target comms mode; defaults to the mode given to the constructor.
+            baud (int): Target baud rate; defaults to the constructor's baud.
+
+        Returns:
+            list: Names of the commands that had to be sent.
+        '''
+        mode = self._link_mode if mode is None else mode
+        baud = self._baudrate if baud is None else baud
+
+        if self.device.known and not self.verify_link():
+            logger.info(f"Recorded link state {self.device} did not verify; probing.")
+            self.device.forget()
+            self._s.baudrate = baud
+        if not self.device.known and not self.probe_link():
+            logger.warning("Assuming the device is in its boot state (ASCII, autobaud).")
+            self.device.reset()
+
+        # Frame commands the way the device currently expects them.
+        self.set_comms_mode(self.device.comms_mode)
+
+        needed = self.device.transitions(mode, baud)
+        accepted = True
+        for name in needed:
+            command = wubCMD_catalog.get_command(name)
+            args = (baud,) if command == wubCMD_catalog.baud else ()
+            logger.info(f"Link setup: {name} {' '.join(str(a) for a in args)}")
+            resp = self.send_recv(command, *args)
+            if not parse_response(command, resp)[0]:
+                logger.warning(f"{name} was not accepted during link setup.")
+                accepted = False
+
+        if accepted and self.device.known:
+            self.device.mark_verified()
+            self.save_state()
+        self.set_comms_mode(mode)
+        if len(needed) == 0:
+            logger.info(f"Link already in {self.device}; nothing to do.")
+        return needed
+
+    def device_uid(self) -> str:
+        '''The device UID (GET_UID) as a hex string, or None if it can't be read.'''
+        ok, values = parse_response(wubCMD_catalog.get_uid, self.cmd_get_uid())
+        if not ok or len(values) < 3:
+            return None
+        return "-".join(f"{int(v):08X}" for v in values[0:3])
+
+    def _ascii_ok(self, command: wubCMD_entry, *args, timeout: float = 0.5) -> tuple[bool, list]:
+        return parse_response(command, self.send_recv_ascii(command, *args, response_timeout=timeout))
+
+    def validate_baud(self, nechoes: int = 32, timeout: float = 0.5) -> bool:
+        '''Check the current rate with a burst of ECHO_PACKET round trips and the UART error counters.'''
+        if not self._ascii_ok(wubCMD_catalog.uart_log_reset, timeout=timeout)[0]:
+            return False
+        for i in range(nechoes):
+            if not self._ascii_ok(wubCMD_catalog.echo_packet, i & 0xFF, timeout=timeout)[0]:
+                logger.debug(f"Echo {i} failed at {self._s.baudrate} baud.")
+                return False
+
+        ok, values = self._ascii_ok(wubCMD_catalog.get_uart_log, timeout=timeout)
+        if not ok or len(values) < 7:
+            return False
+        nerrors = uart_log_errors(values)
+        if nerrors > 0:
+            logger.debug(f"{nerrors} UART errors at {self._s.baudrate} baud.")
+        return nerrors == 0
+
+    def _try_baud(self, rate: int, nechoes: int) -> bool:
+        safe_baud = self._s.baudrate
+        try:
+            self._s.baudrate = rate
+        except (ValueError, serial.SerialException) as e:
+            logger.info(f"{rate} baud not supported by the host port: {e}")
+            return False
+        finally:
+            self._s.baudrate = safe_baud
+
+        ok, values = self._ascii_ok(wubCMD_catalog.check_proposed_baud, rate)
+        if not ok:
+            return False
+        actual = int(values[0]) if len(values) > 0 and isinstance(values[0], int) else rate
+        if abs(actual - rate) > BAUD_TOLERANCE * rate:
+            logger.info(f"{rate} baud: device would run at {actual}; skipping.")
+            return False
+
+        self._ascii_ok(wubCMD_catalog.baud, rate)
+        if self.validate_baud(nechoes):
+            return True
+
+        # Fall back to autobaud at the rate the device is at now, then re-find it.
+        logger.info(f"{rate} baud failed validation; reverting to autobaud.")
+        self._ascii_ok(wubCMD_catalog.baud, -1)
+        self._baudrate = safe_baud
+        self._s.baudrate = safe_baud
+        if not self.probe_link() or not self.device.autobaud:
+            raise serial.SerialException(f"Lost the link to {self._port} after trying {rate} baud.")
+        return False
+
+    def negotiate_baud(self, candidates: list[int] = None, cache_file: str = None,
+                       nechoes: int = 32, safe_baud: int = 115200) -> int:
+        '''Find the fastest rate this link carries without errors and switch to it.
+
+        Starts from autobaud in ASCII mode. Each candidate (fastest first) is
+        checked with CHECK_PROPOSED_BAUD, set with BAUD and validated with an
+        ECHO_PACKET burst plus the GET_UART_LOG error counters. A rate that fails
+        is abandoned for autobaud before trying the next one. With a cache file,
+        the rate found for this device UID and port is tried first.
+
+        Args:
+            candidates (list): Rates to try; defaults to BAUD_CANDIDATES.
+            cache_file (str): Per-device cache of negotiated rates (see pywub.baud).
+            nechoes (int): ECHO_PACKET round trips per validation.
+            safe_baud (int): Port rate used while in autobaud.
+
+        Returns:
+            int: The negotiated baud rate; the link is left fixed at it. None if no
+                candidate passed, in which case the device is left in autobaud.
+        '''
+        candidates = sorted(BAUD_CANDIDATES if candidates is None else candidates, reverse=True)
+        was_ascii = self.device.isascii
+
+        # Negotiation runs in ASCII; the mode ensure_link() brings the link to is kept.
+        if not self.device.isascii:
+            self.send_recv(wubCMD_catalog.asciimode)
+        self.set_comms_mode("ASCII")
+        if not self.device.autobaud:
+            self.set_autobaud()
+        self._baudrate = safe_baud
+        self._s.baudrate = safe_baud
+
+        uid = self.device_uid()
+        cache = wubBaudCache(cache_file) if cache_file is not None else None
+        cached = cache.get(uid, self._port) if cache is not None and uid is not None else None
+        if cached is not None:
+            logger.info(f"Trying cached rate {cached} baud for device {uid}.")
+            candidates = [cached] + [c for c in candidates if c != cached]
+
+        rate = None
+        for candidate in candidates:
+            tstart = time.perf_counter()
+            if self._try_baud(candidate, nechoes):
+                rate = candidate
+                logger.info(f"Negotiated {rate} baud in {time.perf_counter() - tstart:.2f} s.")
+                break
+            if candidate == cached:
+                cache.drop(uid, self._port)
+
+        if rate is None:
+            logger.error(f"No candidate baud rate passed validation on {self._port}.")
+        elif cache is not None and uid is not None:
+            cache.put(uid, self._port, rate)
+
+        if not was_ascii and rate is not None:
+            self.send_recv(wubCMD_catalog.binarymode)
+        return rate
+
+    def send_recv(self, command: wubCMD_entry, *args, fresh: bool = False) -> dict:       
+        '''Send a command in the current comms mode and return the response.
+
+        Readbacks the catalog marks as cacheable are answered from readback_cache
+        while valid, unless fresh is set. Commands that change the device state 
+        drop the cached readbacks they affect.
+        '''
+        if command.cache_policy is not None and not fresh:
+            resp = self.readback_cache.lookup(command, self._mode)
+            if resp is not None:
+                return resp
+
         if self.isascii:
             resp = self.send_recv_ascii(command, *args)
         else:  
@@ -391,14 +971,11 @@ class wubCTL():
             self.set_comms_mode("BINARY")
         elif command == wubCMD_catalog.verbose:
             self._binaryverbosity = args[0]
-        elif command == wubCMD_catalog.baud:
-            if args[0] == -1:
-                self._autobaud = True
-                self._s.baudrate = self._baudrate
-            else:
-                self._autobaud = False
-                self._s.baudrate = args[0]
-                self._baudrate = args[0]
+
+        if len(command.invalidates) > 0:
+            self.readback_cache.invalidate(command.invalidates)
+        if command.cache_policy is not None and parse_response(command, resp)[0]:
+            self.readback_cache.store(command, self._mode, resp)
 
         return resp
 
@@ -413,22 +990,17 @@ class wubCTL():
         self._batch_mode_running = True
         logger.info(f"Issuing batchmode send with ntosend = {ntosend} and modenostop = {modenostop}")
         # Hard-code this bit to allow the while loop to execute.
-        self.send(f"send_batch {ntosend} {modenostop}\n".encode())
+        self.send(wubCMD_catalog.send_batch.build('a', ntosend, modenostop))
 
-        nbytes_recv = 0
-        response_deq = deque(maxlen=3)
-
-        command_response_error=False
-        ok = "OK\n" 
-        answer = ""
-        data = ""
+        scanner = ascii_response_scanner()
+        answer = []
+        # Data are handled as raw bytes throughout; only decode per chunk if the 
+        # caller handed us a text-mode file. 
+        text_datafile = isinstance(datafile, TextIOBase)
 
         tstart = time.time()
         #Wait for some return data to arrive. 
         while True:
-            logger.debug(f"request_abort : {self.request_abort}")
-            logger.debug(f"request_stop  : {self.request_stop}")
-
             if self.request_abort and not self._abort_requested:
                 #e.g. if we control+C'd out of the batch.
                 logger.warning("Abort requested.")
@@ -440,49 +1012,60 @@ class wubCTL():
                 self._stop_requested = True
                 resp = self.cmd_ok()['response']
                 logger.debug(resp)
-                response_deq.extend([resp[i] for i in range(len(resp))])   
                 break
             
             #blocking read of at least one byte:
             #if timeout, len(data) = 0
-            data=self._s.read(self._s.in_waiting or 1).decode()
-            response_deq.extend([data[i] for i in range(len(data))])   
-            
-#            if self._verbose:
-            logger.debug(f"batchmode data: {data}")
-            logger.debug(f"batchmode data_deq: {response_deq}")
+            data=self.read(self._s.in_waiting or 1)
 
             if len(data)>0:
-                # if nbytes_recv == 0:
-                # #check for ? at beginning of response to catch that an inva
-                #     if data[0]=='?': 
-                #         command_response_error=True
-                        
+                scanner.feed(data)
                 self.nbytes_recv += len(data)
                 
-                if datafile is not None:
+                if datafile is None:
+                    answer.append(data)
+                elif text_datafile:
+                    datafile.write(data.decode())
+                else:
                     datafile.write(data)
-                else: 
-                    answer += data
                     
             else: #Socket timeout 
-                if "".join(response_deq) == ok: 
+                if scanner.terminated: 
                     logger.debug("EOL detected")
                     break
                 elif time.time() > tstart + self._timeout:
                     logger.debug(f"Socket timeout detected.")
                     #break
-
-            # if "".join(response_deq) == ok: 
-            #     logger.debug("EOL detected")
-            #     break
                 
          
         logger.info(f"Total number of bytes received:  {self.nbytes_recv}")
 
-        self._batch_mode_running = False        
-        return dict(response=answer)
+        self._batch_finished()
+        return dict(response=b"".join(answer).decode())
     
+    def _store_frames(self, frames: list, tarrival: float, datafile, write_frames):
+        '''Count decoded frames, write them as records and hand them to the frame listeners.'''
+        nframes = len(frames)
+        self.nframes_binary += nframes
+        self.metrics.frames += nframes
+        if datafile is not None:
+            if self._store_mode == "ring":
+                # Packed into a reused buffer; the frames are memoryviews into the receive ring.
+                size = records.pack_records_into(self._record_buf, frames, self._basenumber, tarrival)
+                with memoryview(self._record_buf)[:size] as packed:
+                    if write_frames is not None:
+                        write_frames(packed, nframes, tarrival)
+                    else:
+                        datafile.write(packed)
+            else:
+                packed = records.pack_records(frames, self._basenumber, tarrival)
+                if write_frames is not None:
+                    write_frames(packed, nframes, tarrival)
+                else:
+                    datafile.write(packed)
+        for fn in self._frame_listeners:
+            fn(frames, self._basenumber, tarrival)
+
     def binary_stop_batch(self):
 
         self.send(wubCMD_catalog.ok.build('b'))
@@ -493,9 +1076,14 @@ class wubCTL():
         time.sleep(0.01) #Wait long enough for the most recent frame to be done.,
         resp = self.read(self._s.in_waiting) #Flush
 
-        resp_rc = resp[-1]             
         logger.debug(f"Stop return bytes: {resp}")
-        logger.info(wubCMD_RC(resp_rc).name)
+        if len(resp) == 0:
+            logger.warning("No answer to OK after stopping the batch.")
+            return
+        try:
+            logger.info(wubCMD_RC(resp[-1]).name)
+        except ValueError:
+            logger.warning(f"Unexpected last byte after stopping the batch: {resp[-1]:#x}")
 
 
 
@@ -529,6 +1117,25 @@ class wubCTL():
         waiting_for_header = True
 
         self.ro_state = readout_state.waiting_on_start_word
+        in_sync = True
+        decoder = parser.FrameDecoder()
+        nresyncs = 0
+        debug_decode = logger.isEnabledFor(logging.DEBUG)
+        # Segmented writers (pywub.segments) track frame ranges per segment.
+        write_frames = getattr(datafile, 'write_frames', None)
+
+        ring = None
+        if self._store_mode == "ring":
+            if self._rx_ring is None:
+                self._rx_ring = wubRxRing()
+            ring = self._rx_ring
+            ring.reset()
+            # The ring's counters are cumulative over batches.
+            nresyncs = ring.nresyncs
+            fd = self._s.fileno()
+            poller = select.poll()
+            poller.register(fd, select.POLLIN)
+            poll_timeout = None if self._timeout is None else int(self._timeout * 1000)
 
         logger.info(f"Note: data storage being done using '{self._store_mode}' method.")
         while True:
@@ -562,20 +1169,24 @@ class wubCTL():
                     dc = struct.unpack("<B", start_byte)[0]
                     if dc  != parser.START_BYTE:
                         logger.warning(f"Start byte not read at expected spot! {dc:x}") 
+                        if in_sync:
+                            self.metrics.resyncs += 1
+                            in_sync = False
                         self.ro_state = readout_state.waiting_on_start_word
                     else:
+                        in_sync = True
                         self.ro_state = readout_state.waiting_on_nsamples
 
                 elif self.ro_state == readout_state.waiting_on_nsamples:
-                    logger.debug("Waiting on nsamples...")
 
                     if self.bytes_in_waiting >= parser.NSAMPLES_WIDTH:
                         nsamples_bytes = self.read(parser.NSAMPLES_WIDTH)
                         self.nbytes_recv += len(nsamples_bytes)
 
                         nsamples = parser.unpack_nsamples(nsamples_bytes)
-                        hex_nsamples = [f"{i:x}" for i in nsamples_bytes]
-                        logger.debug(f"Decoded nsamples: {nsamples}; bytes = {hex_nsamples}")
+                        if debug_decode and not self._drain_aggressive:
+                            hex_nsamples = [f"{i:x}" for i in nsamples_bytes]
+                            logger.debug(f"Decoded nsamples: {nsamples}; bytes = {hex_nsamples}")
                         
                         self.ro_state = readout_state.waiting_on_payload
 
@@ -589,7 +1200,6 @@ class wubCTL():
 
 
                     frame_size = parser.calc_frame_size(nsamples)
-                    logger.debug(f"Waiting on payload... Required/In waiting: {frame_size - parser.NSAMPLES_WIDTH } / {self.bytes_in_waiting}")
 
                     
                     if self.bytes_in_waiting >= frame_size - parser.NSAMPLES_WIDTH:
@@ -598,28 +1208,77 @@ class wubCTL():
                         self.nbytes_recv += len(readout)
 
 
-                        header = (nsamples_bytes + readout)[0:parser.HEADER_SIZE]
-                        #logger.debug(header)
-                        nsamples, frame_id, fpga_ts, fpga_tdc = parser.unpack_header(header)
+                        # Header and payload decoding are only needed for the debug log;
+                        # skip them entirely when the receive buffer is filling up.
+                        if debug_decode and not self._drain_aggressive:
+                            header = (nsamples_bytes + readout)[0:parser.HEADER_SIZE]
+                            #logger.debug(header)
+                            nsamples, frame_id, fpga_ts, fpga_tdc = parser.unpack_header(header)
 
-                        logger.debug(f"{nsamples:4X} {frame_id:4X} {fpga_ts:8X} {fpga_tdc:16X}");
-                        
-                        payload = (nsamples_bytes + readout)[parser.HEADER_SIZE::]
-                        payload_hex = [f"{i:x}" for i in payload]
-                        logger.debug(f"Payload size: {parser.calc_payload_size(nsamples)}")
-                        logger.debug(f"Payload hex:  {payload_hex}")
+                            logger.debug(f"{nsamples:4X} {frame_id:4X} {fpga_ts:8X} {fpga_tdc:16X}");
+                            
+                            payload = (nsamples_bytes + readout)[parser.HEADER_SIZE::]
+                            payload_hex = [f"{i:x}" for i in payload]
+                            logger.debug(f"Payload size: {parser.calc_payload_size(nsamples)}")
+                            logger.debug(f"Payload hex:  {payload_hex}")
                         self.ro_state = readout_state.waiting_on_start_word
 
                         if datafile is not None:
                             datafile.write(readout)
 
                         self.nframes_binary += 1
+                        self.metrics.frames += 1
                     else: 
                         continue
                         
+            elif self._store_mode == "frame":
+                ## Chunked reads split by a streaming decoder; each frame is stored as a 
+                ## self-framed record carrying the host arrival time and base number.
+                data = self.drain()
+                if len(data) == 0:
+                    continue
+
+                tarrival = time.time()
+                self.nbytes_recv += len(data)
+
+                frames = decoder.feed(data)
+                if len(frames) > 0:
+                    self._store_frames(frames, tarrival, datafile, write_frames)
+
+                if decoder.nresyncs != nresyncs:
+                    if not self._drain_aggressive:
+                        logger.warning(f"Frame decoder resynchronized; {decoder.nbytes_skipped} bytes skipped so far.")
+                    self.metrics.resyncs += decoder.nresyncs - nresyncs
+                    nresyncs = decoder.nresyncs
+
+            elif self._store_mode == "ring":
+                ## Like 'frame', but reads go straight into a preallocated ring (readinto) and
+                ## frames are memoryviews into it, valid until ring.release() below. Records
+                ## are packed into a reused buffer, so steady state allocates next to nothing.
+                if len(poller.poll(poll_timeout)) == 0:
+                    continue
+                n = ring.readinto_fd(fd)
+                if n == 0:
+                    continue
+
+                tarrival = time.time()
+                self.nbytes_recv += n
+                self.metrics.nreads += 1
+                self.metrics.bytes_recv += n
+
+                frames = ring.frames()
+                if len(frames) > 0:
+                    self._store_frames(frames, tarrival, datafile, write_frames)
+                    ring.release()
+
+                if ring.nresyncs != nresyncs:
+                    logger.warning(f"Frame decoder resynchronized; {ring.nbytes_skipped} bytes skipped so far.")
+                    self.metrics.resyncs += ring.nresyncs - nresyncs
+                    nresyncs = ring.nresyncs
+
             elif self._store_mode == "bulk":
                 ## BASIC DUMP METHOD
-                data = self.read(self.bytes_in_waiting)
+                data = self.drain()
                 if datafile is not None:
                     #datafile.write(start_word)
                     datafile.write(data)
@@ -666,6 +1325,7 @@ class wubCTL():
                         # payload_size = calc_payload_size(nsamples)                
 
                         if len(data) != payload_len_total - parser.NSAMPLES_WIDTH: #timeout?
+                            self.metrics.decode_errors += 1
                             logger.error(f"Readback was not the right length: {len(data)} vs {payload_len_total-parser.NSAMPLES_WIDTH}")
                             logger.error(f"nsamples_bytes: {bt}\t ")
                             #logger.error(data)
@@ -677,6 +1337,7 @@ class wubCTL():
                             break
                         
                         self.nbytes_recv += len(data) + parser.NSAMPLES_WIDTH
+                        self.metrics.frames += 1
                         
                         if datafile is not None:
                             datafile.write(start_word)
@@ -697,14 +1358,185 @@ class wubCTL():
                     
         if self._store_mode != "bulk":
             logger.info(f"Frames received: {self.nframes_binary} (0x{self.nframes_binary:X})")
+        if self._store_mode == "frame" and decoder.pending > 0:
+            logger.warning(f"{decoder.pending} bytes of an incomplete frame were discarded.")
+        if self._store_mode == "ring" and ring.pending > 0:
+            logger.warning(f"{ring.pending} bytes of an incomplete frame were discarded.")
         logger.info(f"Bytes received:  {self.nbytes_recv} (0x{self.nbytes_recv:X})")
-        self._batch_mode_running = False
         
         self.read(self._s.in_waiting)
+        self._batch_finished()
 
         return 0
 
 
+    def scheduled_batchmode_recv(self, ntosend:int = -1, datafile:TextIOWrapper=None, 
+                                 scheduler:wubBatchScheduler = None) -> dict:
+        '''
+        Binary receiver issuing bounded SEND_BATCH requests sized by a wubBatchScheduler
+        (see pywub.batching) instead of one open-ended batch.
+
+        Each request ends on a frame boundary by itself, so request_stop lets the current 
+        request finish and issues no new one: no frame is cut off. request_abort stops at 
+        once, as in batchmode_recv. Frames are stored as in the 'frame' and 'ring' store modes.
+
+        Args:
+            ntosend (int): Total number of hits to receive, or negative for no limit.
+            datafile: Record file, or a segmented writer.
+            scheduler (wubBatchScheduler): Batch sizing policy; a default one if None.
+
+        Returns:
+            dict: Hits and bytes received, and the scheduler summary.
+        '''
+        if self.isascii:
+            raise ValueError("Scheduled batches need a BINARY link.")
+        if self._store_mode not in ("frame", "ring"):
+            raise ValueError(f"Scheduled batches store frames in 'frame' or 'ring' mode, not '{self._store_mode}'.")
+        if scheduler is None:
+            scheduler = wubBatchScheduler()
+
+        logger.debug("Entering scheduled BINARY batchmode reciever.")
+        self._batch_mode_running = True
+        write_frames = getattr(datafile, 'write_frames', None)
+
+        fd = self._s.fileno()
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        quiet_time = scheduler.quiet_time if scheduler.quiet_time is not None else port_quiet_time(self._s.port)
+        poll_timeout = max(1, int(quiet_time * 1000))
+        logger.debug(f"Batches end after {1e3 * quiet_time:.0f} ms of silence.")
+
+        ring = None
+        decoder = None
+        if self._store_mode == "ring":
+            if self._rx_ring is None:
+                self._rx_ring = wubRxRing()
+            ring = self._rx_ring
+            ring.reset()
+            nresyncs = ring.nresyncs
+        else:
+            decoder = parser.FrameDecoder()
+            nresyncs = 0
+
+        def receive() -> tuple[int, int]:
+            '''Read what is waiting and store the complete frames; returns (bytes, frames).'''
+            nonlocal nresyncs
+            if ring is not None:
+                nread = ring.readinto_fd(fd)
+            else:
+                try:
+                    data = os.read(fd, 1 << 16)
+                except BlockingIOError:
+                    data = b""
+                nread = len(data)
+            if nread == 0:
+                return 0, 0
+
+            tarrival = time.time()
+            self.nbytes_recv += nread
+            self.metrics.nreads += 1
+            self.metrics.bytes_recv += nread
+
+            frames = ring.frames() if ring is not None else decoder.feed(data)
+            if len(frames) > 0:
+                self._store_frames(frames, tarrival, datafile, write_frames)
+                if ring is not None:
+                    ring.release()
+
+            skipped = ring if ring is not None else decoder
+            if skipped.nresyncs != nresyncs:
+                logger.warning(f"Frame decoder resynchronized; {skipped.nbytes_skipped} bytes skipped so far.")
+                self.metrics.resyncs += skipped.nresyncs - nresyncs
+                nresyncs = skipped.nresyncs
+            return nread, len(frames)
+
+        logger.info(f"Note: data storage being done using '{self._store_mode}' method.")
+        nreceived = 0
+        aborted = False
+        while (ntosend < 0 or nreceived < ntosend) and not aborted:
+            if self.request_abort or self.request_stop:
+                break
+            wait = scheduler.wait_time()
+            if wait > 0:
+                time.sleep(wait)
+
+            # Frames of the previous batch held back longer than quiet_time (e.g. by a
+            # USB-serial latency timer) would otherwise be read as the RC of the next request.
+            nlate = 0
+            while len(poller.poll(0)) > 0:
+                nread, nframes = receive()
+                if nread == 0:
+                    break
+                nlate += nframes
+            if nlate > 0:
+                nreceived += nlate
+                logger.debug(f"{nlate} frames of the previous batch arrived after it was taken as finished.")
+            pending = ring.pending if ring is not None else decoder.pending
+            if pending > 0:
+                logger.warning(f"Discarding {pending} bytes of an incomplete frame before the next request.")
+                (ring if ring is not None else decoder).reset()
+            if ntosend >= 0 and nreceived >= ntosend:
+                break
+
+            # Data move on into the ring as they arrive, so its free space counts as headroom too.
+            headroom = self.rx_capacity - self.bytes_in_waiting
+            if ring is not None:
+                headroom += ring.capacity - ring.pending
+            n = scheduler.next_request(headroom_bytes=headroom, baud=self._s.baudrate)
+            if ntosend >= 0:
+                n = min(n, ntosend - nreceived)
+
+            tstart = time.monotonic()
+            resp = self.cmd_send_batch(n, 0)['response']
+            if resp['CMD_RC'] != wubCMD_RC.CMD_RC_OK:
+                logger.error(f"SEND_BATCH {n} 0 answered {resp['CMD_RC']}; stopping.")
+                break
+
+            # The batch is over once n frames arrived, or when the link stays quiet 
+            # between frames (the device ran out of hits).
+            nframes = 0
+            nbytes = 0
+            tlast = tstart
+            while nframes < n:
+                if self.request_abort:
+                    logger.info("Abort requested. This may leave the wuBase in a weird state.")
+                    self.binary_stop_batch()
+                    aborted = True
+                    break
+
+                ready = len(poller.poll(poll_timeout)) > 0
+                now = time.monotonic()
+                if not ready:
+                    pending = ring.pending if ring is not None else decoder.pending
+                    if pending == 0 and now - tlast >= quiet_time:
+                        break
+                    if now - tlast >= self._timeout:
+                        logger.warning(f"Batch stalled with {pending} bytes of a frame pending.")
+                        break
+                    continue
+
+                nread, nnew = receive()
+                if nread == 0:
+                    continue
+                tlast = now
+                nbytes += nread
+                nframes += nnew
+
+            nreceived += nframes
+            scheduler.update(wubBatchResult(n, nframes, nbytes, tstart, time.monotonic() - tstart))
+
+        pending = ring.pending if ring is not None else decoder.pending
+        if pending > 0:
+            logger.warning(f"{pending} bytes of an incomplete frame were discarded.")
+        summary = scheduler.summary()
+        logger.info(f"Frames received: {nreceived} in {summary['nbatches']} batches "
+                    f"({summary['nbatches_full']} full).")
+        logger.info(f"Bytes received:  {self.nbytes_recv} (0x{self.nbytes_recv:X})")
+
+        self._batch_finished()
+        return dict(summary, nreceived=nreceived, nbytes=self.nbytes_recv)
+
+
     def batchmode_recv(self, ntosend:int, modenostop:bool, datafile:TextIOWrapper=None) -> dict:
         '''
         Args: 
@@ -725,6 +1557,27 @@ class wubCTL():
             return self.binary_batchmode_recv(ntosend, modenostop, datafile)
         
 
+# Commands whose responses are fed to wubCTL.device.
+_LINK_COMMANDS = {wubCMD_catalog.baud, wubCMD_catalog.asciimode, 
+                  wubCMD_catalog.binarymode, wubCMD_catalog.reset_mcu}
+
+
+def _create_method(command:wubCMD_entry):
+    def new_method(self, *args, **kwargs):
+        return self.send_recv(command, *args, **kwargs)
+
+    name = f"cmd_{command.name.lower()}"
+    new_method.__name__ = name
+    new_method.__qualname__ = f"wubCTL.{name}"
+
+    setattr(wubCTL, name, new_method)
+
+# The command methods depend only on the catalog, so they are generated once 
+# per process when this module is imported rather than on every wubCTL().
+logger.debug(f"Generating {len(wubCMD_catalog.name_dict)} methods from catalog")
+for _cmd in wubCMD_catalog.name_dict.values():
+    _create_method(_cmd)
+
 
 
 
@@ -0,0 +1,335 @@
+'''
+Long-lived DAQ process that keeps the serial links of several bases open.
+
+Opening a port, negotiating the baud rate, switching to BINARY and running the
+full setup costs more than a short calibration run takes. wubDaqDaemon does
+that once: it owns one wubCTL per base, brings every link to a fixed baud in
+the requested comms mode (wubCTL.ensure_link) and leaves it there between runs.
+For each run only the setup commands whose arguments differ from what the base
+was last given are sent.
+
+Requests arrive on a UNIX-domain socket, one JSON object per line, and each
+gets one JSON line back:
+
+    {"cmd": "status"}
+    {"cmd": "setup", "config": ["DAC 0.1 0 2000", ...], "bases": [0, 1]}
+    {"cmd": "run", "config": [...], "ntosend": -1, "runtime": 5, "ofile": "run_{base}.dat"}
+    {"cmd": "stop"}
+    {"cmd": "shutdown"}
+
+Config lines use the parse_setup_config format. A run blocks its connection
+until the data taking ends; "stop" from another connection ends it early.
+'''
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import socket
+import threading
+
+from .control import wubCTL
+from .catalog import parse_setup_config, mask_to_base_numbers
+from .monitor import wubRunMonitor
+from .segments import wubSegmentedWriter
+from .sequencer import wubSetupSequencer
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Commands that act rather than configure; they are sent every time they appear.
+ACTION_COMMANDS = {"FLUSH_EVENTS", "RESETAVG", "HIST_RESET", "TRIG_EVENTS_RESET", "SYNC_RESET",
+                   "TRIP_RESET", "PULSER_START", "CAL10RESET", "ECHO_PACKET_RESET",
+                   "UART_LOG_RESET", "COMMS_ERR_CT_RESET", "TESTPACKETS", "OK"}
+
+# Number of leading arguments that select which setting a command changes,
+# e.g. DAC <channel> <value> holds one value per channel.
+SETTING_KEY_NARGS = {"DAC": 1}
+
+
+class wubSetupTracker():
+    '''Remembers the setup commands a base has accepted, to send only the differences.
+
+    A line is skipped when an earlier setup left that setting at the same value.
+    Within one setup every repeat of a setting is sent again, so sequences such 
+    as FPGALOAD, ADCCONFIG, FPGALOAD or toggling FPGATRIG keep their meaning.
+    '''
+
+    def __init__(self):
+        self.applied = {}
+        self._previous = {}
+        self._touched = set()
+
+    @staticmethod
+    def key(name: str, args: list) -> tuple:
+        nkey = SETTING_KEY_NARGS.get(name, 0)
+        return (name,) + tuple(args[0:nkey])
+
+    def begin(self):
+        '''Start a new setup pass.'''
+        self._previous = dict(self.applied)
+        self._touched = set()
+
+    def needed(self, name: str, args: list) -> bool:
+        if name in ACTION_COMMANDS:
+            return True
+        key = self.key(name, args)
+        return key in self._touched or self._previous.get(key) != list(args)
+
+    def accepted(self, name: str, args: list):
+        if name == "RESET_MCU":
+            self.applied.clear()
+            self._previous = {}
+        elif name not in ACTION_COMMANDS:
+            key = self.key(name, args)
+            self.applied[key] = list(args)
+            self._touched.add(key)
+
+    def forget(self):
+        self.applied.clear()
+
+
+class wubDaqDaemon():
+    '''
+    Args:
+        ports (dict): Serial port of each base number.
+        socket_path (str): Path of the control socket.
+        baud (int): Fixed baud rate kept on every link.
+        mode (str): Comms mode kept on every link (ascii or binary).
+        store_mode (str): wubCTL store mode used for runs.
+        state_dir (str): Directory for the per-base link state files (None disables them).
+        timeout (float): Serial read timeout.
+    '''
+
+    def __init__(self, ports: dict[int, str], socket_path: str, baud: int = 1181818,
+                 mode: str = 'binary', store_mode: str = 'frame', state_dir: str = None,
+                 timeout: float = 1):
+        self._ports = dict(ports)
+        self._socket_path = socket_path
+        self._baud = baud
+        self._mode = mode
+        self._store_mode = store_mode
+        self._state_dir = state_dir
+        self._timeout = timeout
+
+        self.wubctls = {}
+        self.setups = {}
+        self.nruns = 0
+
+        self._run_lock = threading.Lock()
+        self._monitor = None
+        self._sock = None
+        self._running = False
+
+    def open_links(self):
+        for base, port in sorted(self._ports.items()):
+            state_file = None
+            if self._state_dir is not None:
+                os.makedirs(self._state_dir, exist_ok=True)
+                state_file = os.path.join(self._state_dir, f"wubase_{base}.json")
+
+            wubctl = wubCTL(port, baud=self._baud, mode=self._mode, timeout=self._timeout,
+                            store_mode=self._store_mode, basenumber=base,
+                            state_file=state_file, revert_on_close=False)
+            transitions = wubctl.ensure_link()
+            logger.info(f"Base {base} on {port}: link {wubctl.device} (sent {transitions if transitions else 'nothing'}).")
+
+            self.wubctls[base] = wubctl
+            self.setups[base] = wubSetupTracker()
+
+    def close_links(self, revert: bool = False):
+        for base, wubctl in self.wubctls.items():
+            wubctl.close(revert=revert)
+        self.wubctls = {}
+
+    def _bases(self, request: dict) -> list[int]:
+        bases = request.get('bases')
+        return sorted(self.wubctls) if bases is None else [b for b in bases if b in self.wubctls]
+
+    def apply_setup(self, config: list[str], bases: list[int]) -> dict:
+        '''Send the setup lines each base does not have yet.
+
+        Returns:
+            dict: Per base, the commands sent, skipped and rejected.
+        '''
+        setup = parse_setup_config(config=config)['setup']
+        report = {}
+        for base in bases:
+            wubctl = self.wubctls[base]
+            tracker = self.setups[base]
+            sequencer = wubSetupSequencer(wubctl)
+            sent, skipped, rejected = [], [], []
+            tracker.begin()
+            for line in setup:
+                if line['mask'] is not None and base not in mask_to_base_numbers(line['mask']):
+                    continue
+
+                name = line['name'].upper()
+                args = line['args'] if line['args'] is not None else []
+                if not tracker.needed(name, args):
+                    skipped += [name]
+                    continue
+
+                step = sequencer.run_step(name, args)
+                if step.ok:
+                    tracker.accepted(name, args)
+                    sent += [name]
+                else:
+                    rejected += [name]
+                    logger.warning(f"Base {base}: {name} {args} was rejected.")
+
+            report[base] = dict(sent=sent, skipped=skipped, rejected=rejected)
+            logger.info(f"Base {base}: setup sent {len(sent)}, skipped {len(skipped)}, rejected {len(rejected)}.")
+        return report
+
+    def run(self, request: dict) -> dict:
+        bases = self._bases(request)
+        with self._run_lock:
+            setup = self.apply_setup(request.get('config', []), bases)
+
+            ntosend = request.get('ntosend', -1)
+            ofile = request.get('ofile')
+            monitor = wubRunMonitor(interval=request.get('interval', 1.0),
+                                    maxruntime=request.get('runtime', -1),
+                                    stall_timeout=request.get('stall_timeout', 3.0),
+                                    expected_frames=ntosend)
+            self._monitor = monitor
+
+            try:
+                threads, outputs = {}, {}
+                for base in bases:
+                    wubctl = self.wubctls[base]
+                    wubctl.prepare_batch()
+                    if ofile is not None:
+                        filename = ofile.format(base=base, run=self.nruns)
+                        if request.get('segment_size', 0) > 0:
+                            outputs[base] = wubSegmentedWriter(filename, max_bytes=int(request['segment_size'] * 1e6))
+                        else:
+                            outputs[base] = open(filename, "wb")
+                    monitor.add_wubctl(wubctl, name=f"base {base}")
+                    threads[base] = threading.Thread(target=wubctl.batchmode_recv, args=(ntosend, 1),
+                                                     kwargs=dict(datafile=outputs.get(base)))
+
+                tstart = time.time()
+                for thread in threads.values():
+                    thread.start()
+
+                reason = monitor.run()
+                if reason != 'done':
+                    for base in bases:
+                        self.wubctls[base].request_stop = True
+
+                summary = {}
+                for base, thread in threads.items():
+                    thread.join(5)
+                    wubctl = self.wubctls[base]
+                    if thread.is_alive():
+                        logger.error(f"Base {base}: receive thread failed to complete!")
+                    elif not wubctl.isascii:
+                        wubctl.cmd_ok()
+                    if base in outputs:
+                        outputs[base].flush()
+                        outputs[base].close()
+                    summary[base] = dict(nbytes=wubctl.nbytes_recv, frames=wubctl.metrics.frames,
+                                         complete=not thread.is_alive())
+            finally:
+                # The links outlive this run; do not leave the monitor attached to them.
+                for base in bases:
+                    monitor.remove_wubctl(self.wubctls[base])
+                self._monitor = None
+
+            self.nruns += 1
+            return dict(run=self.nruns - 1, reason=reason, duration=time.time() - tstart,
+                        setup=setup, bases=summary)
+
+    def stop_run(self) -> bool:
+        monitor = self._monitor
+        if monitor is None:
+            return False
+        monitor.stop()
+        return True
+
+    def status(self) -> dict:
+        return dict(nruns=self.nruns, running=self._monitor is not None,
+                    bases={base: dict(port=wubctl._port, link=wubctl.device.to_dict(),
+                                      setup={" ".join(str(k) for k in key): args
+                                             for key, args in self.setups[base].applied.items()})
+                           for base, wubctl in self.wubctls.items()})
+
+    def handle(self, request: dict) -> dict:
+        cmd = request.get('cmd')
+        if cmd == 'status':
+            return self.status()
+        elif cmd == 'setup':
+            with self._run_lock:
+                return dict(setup=self.apply_setup(request.get('config', []), self._bases(request)))
+        elif cmd == 'run':
+            return self.run(request)
+        elif cmd == 'stop':
+            return dict(stopped=self.stop_run())
+        elif cmd == 'forget':
+            # E.g. after a power cycle: resend the full setup next time.
+            for base in self._bases(request):
+                self.setups[base].forget()
+            return dict(forgotten=self._bases(request))
+        elif cmd == 'shutdown':
+            self.stop_run()
+            self._running = False
+            if self._sock is not None:
+                # Wakes up the accept() in serve_forever.
+                self._sock.shutdown(socket.SHUT_RDWR)
+            return dict(shutdown=True)
+        raise ValueError(f"{cmd} not an acceptable request: status, setup, run, stop, forget, shutdown")
+
+    def _serve_connection(self, conn: socket.socket):
+        with conn, conn.makefile('rwb') as f:
+            for line in f:
+                try:
+                    reply = dict(ok=True, **self.handle(json.loads(line.decode())))
+                except Exception as e:
+                    logger.exception("Request failed.")
+                    reply = dict(ok=False, error=f"{e}")
+                f.write((json.dumps(reply) + "\n").encode())
+                f.flush()
+
+    def serve_forever(self, revert_on_exit: bool = False):
+        '''Open the links and answer requests until a shutdown request arrives.'''
+        self.open_links()
+
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self._socket_path)
+        self._sock.listen()
+        self._running = True
+        logger.info(f"DAQ daemon listening on {self._socket_path} for bases {sorted(self.wubctls)}.")
+
+        try:
+            while self._running:
+                try:
+                    conn, _ = self._sock.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        except KeyboardInterrupt:
+            logger.info("KeyboardInterrupt detected. Shutting down.")
+            self.stop_run()
+        finally:
+            if self._sock is not None:
+                self._sock.close()
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+            with self._run_lock:
+                self.close_links(revert=revert_on_exit)
+
+
+def daemon_request(socket_path: str, request: dict) -> dict:
+    '''Send one request to a running wubDaqDaemon and return its reply.'''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as f:
+            f.write((json.dumps(request) + "\n").encode())
+            f.flush()
+            return json.loads(f.readline().decode())
@@ -0,0 +1,166 @@
+'''
+NumPy views of received hits.
+
+hit_views() turns a batch of frames, as handed to frame listeners, into numpy
+structured arrays with one record per hit:
+
+    start         the start byte (0x21)
+    nsamples      samples per ADC channel
+    hit_number
+    fpga_ts_lo    low 32 bits of the 48-bit FPGA timestamp
+    fpga_ts_hi    high 16 bits
+    fpga_tdc
+    samples       (nsamples, 2) uint16: ADC channel 0 and 1 per sample
+
+Hits with the same nsamples that lie back to back in one buffer share a single
+array. In the 'ring' store mode the frames are memoryviews into the receive
+ring (pywub.rxring), so the arrays view the ring itself and nothing is copied:
+
+    def listener(frames, base, timestamp):
+        with hit_views(frames) as hits:
+            for run in hits.runs:
+                amplitude = run['samples'][:, :, 0].max(axis=1)
+
+Release contract: the arrays are only valid until the receive loop releases the
+ring, i.e. for the duration of the listener call. release() (or leaving the
+`with` block) drops them; use copy() for arrays that must outlive the call.
+Frames given as bytes ('frame' store mode) are copied once into a private
+buffer, and the same arrays are returned.
+'''
+
+from __future__ import annotations
+
+from . import parser
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+_dtypes = {}
+
+
+def hit_dtype(nsamples: int):
+    '''Structured dtype of a frame of `nsamples`, start byte included (no padding).'''
+    dtype = _dtypes.get(nsamples)
+    if dtype is None:
+        skip = parser.START_BYTE_WIDTH
+        ts_offset = skip + parser.FPGA_TS_OFFSET
+        dtype = np.dtype(dict(
+            names=['start', 'nsamples', 'hit_number', 'fpga_ts_lo', 'fpga_ts_hi', 'fpga_tdc', 'samples'],
+            formats=['u1', f"<u{parser.NSAMPLES_WIDTH}", f"<u{parser.HIT_NUMBER_WIDTH}", '<u4', '<u2', '<u8',
+                     ('<u2', (nsamples, 2))],
+            offsets=[0, skip + parser.NSAMPLES_OFFSET, skip + parser.HIT_NUMBER_OFFSET, ts_offset, ts_offset + 4,
+                     skip + parser.FPGA_TDC_OFFSET, skip + parser.ADC_DATA_OFFSET],
+            itemsize=skip + parser.calc_frame_size(nsamples)))
+        _dtypes[nsamples] = dtype
+    return dtype
+
+
+def fpga_ts(run) -> "np.ndarray":
+    '''The 48-bit FPGA timestamps of a run of hits.'''
+    return run['fpga_ts_lo'].astype(np.uint64) | (run['fpga_ts_hi'].astype(np.uint64) << np.uint64(32))
+
+
+def _address(frame: memoryview) -> int:
+    return np.frombuffer(frame, dtype=np.uint8).__array_interface__['data'][0]
+
+
+class wubHitViews():
+    '''
+    Hits of one batch of frames as numpy structured arrays; see the module docstring.
+
+    Args:
+        frames (list): Frames without their start byte: memoryviews into one buffer
+            (viewed in place) or bytes (copied once).
+    '''
+
+    def __init__(self, frames: list):
+        if np is None:
+            raise ImportError("NumPy hit views need numpy.")
+        self._runs = []
+        self.nhits = len(frames)
+        self.copied = False
+        if self.nhits == 0:
+            return
+
+        first = frames[0]
+        base = getattr(first, 'obj', None) if isinstance(first, memoryview) else None
+        if base is None or any(getattr(f, 'obj', None) is not base for f in frames):
+            self._runs = self._copy_runs(frames)
+            self.copied = True
+            return
+
+        origin = np.frombuffer(base, dtype=np.uint8).__array_interface__['data'][0]
+        skip = parser.START_BYTE_WIDTH
+        i = 0
+        n = len(frames)
+        while i < n:
+            # A run: frames of equal length, checked to lie back to back by their end points.
+            size = len(frames[i])
+            j = i + 1
+            while j < n and len(frames[j]) == size:
+                j += 1
+            start = _address(frames[i]) - origin - skip
+            stride = size + skip
+            if j - i > 1 and _address(frames[j - 1]) - origin - skip != start + (j - i - 1) * stride:
+                # Bytes were skipped inside the run (resync); view the frames one by one.
+                for k in range(i, j):
+                    self._runs.append(self._view(base, frames[k], _address(frames[k]) - origin - skip, 1))
+            else:
+                self._runs.append(self._view(base, frames[i], start, j - i))
+            i = j
+
+    @staticmethod
+    def _nsamples(frame) -> int:
+        return (len(frame) - parser.calc_frame_size(0)) // parser.calc_payload_size(1)
+
+    def _view(self, base, frame, offset: int, count: int):
+        return np.frombuffer(base, dtype=hit_dtype(self._nsamples(frame)), count=count, offset=offset)
+
+    def _copy_runs(self, frames: list) -> list:
+        start = bytes([parser.START_BYTE])
+        buf = start + start.join(frames)
+        runs = []
+        offset = 0
+        i = 0
+        while i < len(frames):
+            size = len(frames[i])
+            j = i + 1
+            while j < len(frames) and len(frames[j]) == size:
+                j += 1
+            runs.append(np.frombuffer(buf, dtype=hit_dtype(self._nsamples(frames[i])), count=j - i, offset=offset))
+            offset += (j - i) * (size + parser.START_BYTE_WIDTH)
+            i = j
+        return runs
+
+    @property
+    def runs(self) -> list:
+        '''One structured array per run of hits with equal nsamples, in arrival order.'''
+        if self._runs is None:
+            raise ValueError("Hit views used after release().")
+        return self._runs
+
+    def copy(self) -> list:
+        '''Arrays owning their data, valid after release().'''
+        return [run.copy() for run in self.runs]
+
+    def release(self):
+        '''Drop the views; the receive buffer may be reused after this.'''
+        self._runs = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+def hit_views(frames: list) -> wubHitViews:
+    '''View a batch of frames (as passed to frame listeners) as numpy arrays.'''
+    return wubHitViews(frames)
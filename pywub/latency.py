@@ -0,0 +1,273 @@
+'''
+Round-trip latency profiling of slow-control commands.
+
+wubLatencyProfiler sends ECHO_PACKET and a set of catalog commands many times,
+interleaved, and times every round trip in four phases:
+
+    encode  building the command bytes
+    write   handing them to the serial port
+    wait    from the end of the write until the whole response has arrived
+    decode  unpacking / parsing the response
+
+The wire time of the request and response at the port's baud rate is
+subtracted from `wait` to estimate how long the device took to answer
+(the turnaround). ECHO_PACKET does no work on the device, so its turnaround is
+the reference: commands whose median turnaround is well above it, or whose
+p99 is well above their own median, are flagged as blocking on the device.
+
+Reports are plain dicts (JSON) so that runs against different firmware
+versions can be compared with diff_reports().
+'''
+
+from __future__ import annotations
+
+import math
+import time
+
+from .catalog import ctlg as wubCMD_catalog
+from .catalog import wubCMD_entry, wubCMD_RC
+from .control import parse_response, ascii_response_scanner, ASCII_TERMINATOR, _LINK_COMMANDS
+from .metrics import wubHistogram
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+PHASES = ("encode", "write", "wait", "decode")
+
+# Read-only commands profiled by default.
+DEFAULT_COMMANDS = [("ECHO_PACKET", [0x5A]), ("OK", []), ("GET_UID", []), ("STATUS", []),
+                    ("MONSTATUS", []), ("GET_AVG_TEMP", []), ("GET_FB_MEASURED", []),
+                    ("BINARY_STATS", []), ("GET_UART_LOG", [])]
+
+# Never profiled: they change the link or start streaming.
+_EXCLUDED = {c.name for c in _LINK_COMMANDS} | {"SEND_BATCH", "INFINITEPACKETS", "TESTPACKETS"}
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    '''Nearest-rank percentile of an already sorted list.'''
+    if len(sorted_values) == 0:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(values: list[float]) -> dict:
+    values = sorted(values)
+    if len(values) == 0:
+        return dict(n=0, mean=None, p50=None, p99=None, max=None)
+    return dict(n=len(values), mean=sum(values) / len(values), p50=percentile(values, 50),
+                p99=percentile(values, 99), max=values[-1])
+
+
+class wubCommandLatency():
+    '''Per-phase round-trip times of one command.'''
+
+    def __init__(self, command: wubCMD_entry, args: list):
+        self.command = command
+        self.args = list(args)
+        self.samples = {phase: [] for phase in PHASES}
+        self.total = []
+        self.turnaround = []
+        self.histogram = wubHistogram()
+        self.nfailed = 0
+        self.ntimeouts = 0
+
+    @property
+    def label(self) -> str:
+        return " ".join([self.command.name] + [f"{a}" for a in self.args])
+
+    def add(self, phases: dict, wire_time: float):
+        for phase in PHASES:
+            self.samples[phase] += [phases[phase]]
+        total = sum(phases.values())
+        self.total += [total]
+        self.turnaround += [max(0.0, phases['wait'] - wire_time)]
+        self.histogram.observe(total)
+
+    def summary(self) -> dict:
+        return dict(command=self.command.name, args=self.args, nfailed=self.nfailed, ntimeouts=self.ntimeouts,
+                    phases={phase: summarize(values) for phase, values in self.samples.items()},
+                    total=summarize(self.total), turnaround=summarize(self.turnaround),
+                    histogram=self.histogram.to_dict())
+
+
+class wubLatencyProfiler():
+    '''
+    Args:
+        wubctl (wubCTL): Link to profile; should not be running a batch.
+        commands (list): (name, args) pairs; defaults to DEFAULT_COMMANDS. ECHO_PACKET is always included.
+        timeout (float): Give up on a response after this many seconds.
+        block_factor (float): Flag a command whose median turnaround exceeds this many times
+            ECHO_PACKET's, or whose p99 exceeds this many times its own median.
+        block_margin (float): Seconds added to both thresholds, so sub-millisecond noise is not flagged.
+    '''
+
+    def __init__(self, wubctl, commands: list[tuple] = None, timeout: float = 1.0,
+                 block_factor: float = 4.0, block_margin: float = 0.5e-3):
+        self._wubctl = wubctl
+        self._timeout = timeout
+        self.block_factor = block_factor
+        self.block_margin = block_margin
+
+        commands = DEFAULT_COMMANDS if commands is None else commands
+        if "ECHO_PACKET" not in [name.upper() for name, _ in commands]:
+            commands = [DEFAULT_COMMANDS[0]] + list(commands)
+
+        self.stats = []
+        for name, args in commands:
+            command = wubCMD_catalog.get_command(name)
+            if command.name in _EXCLUDED:
+                raise ValueError(f"{command.name} changes the link state and can't be profiled.")
+            self.stats += [wubCommandLatency(command, args)]
+
+        self.tstart = None
+        self.tstop = None
+
+    def _wire_time(self, nbytes: int) -> float:
+        baud = self._wubctl._s.baudrate
+        return nbytes * 10 / baud if baud else 0.0
+
+    def _read_binary(self, size: int, deadline: float) -> bytes:
+        wubctl = self._wubctl
+        readback = b""
+        while len(readback) < size and time.perf_counter() < deadline:
+            readback += wubctl.read(size - len(readback))
+        return readback
+
+    def _read_ascii(self, deadline: float) -> bytes:
+        wubctl = self._wubctl
+        scanner = ascii_response_scanner()
+        chunks = []
+        while not scanner.terminated and not scanner.error_found and time.perf_counter() < deadline:
+            data = wubctl.read(wubctl._s.in_waiting or 1)
+            if data:
+                chunks.append(data)
+                scanner.feed(data)
+        return b"".join(chunks)
+
+    def round_trip(self, stats: wubCommandLatency) -> bool:
+        '''Time one command; returns False if it failed or timed out.'''
+        wubctl = self._wubctl
+        command, args = stats.command, stats.args
+        if wubctl._s.in_waiting > 0:
+            wubctl._s.reset_input_buffer()
+
+        ascii_mode = wubctl.isascii
+        t0 = time.perf_counter()
+        request = command.build('a' if ascii_mode else 'b', *args)
+        t1 = time.perf_counter()
+        wubctl.send(request)
+        t2 = time.perf_counter()
+        deadline = t2 + self._timeout
+        if ascii_mode:
+            readback = self._read_ascii(deadline)
+            complete = readback.endswith(ASCII_TERMINATOR) or readback.find(b"?") >= 0
+        else:
+            readback = self._read_binary(command.retargs_size + 1, deadline)
+            complete = len(readback) == command.retargs_size + 1
+        t3 = time.perf_counter()
+        if not complete:
+            stats.ntimeouts += 1
+            return False
+
+        if ascii_mode:
+            ok = parse_response(command, dict(response=readback.decode(errors='replace')))[0]
+        else:
+            ok = command.unpack(readback)[0] == wubCMD_RC.CMD_RC_OK
+        t4 = time.perf_counter()
+        if not ok:
+            stats.nfailed += 1
+            return False
+
+        nbytes = len(request) + (1 if wubctl.autobaud else 0) + len(readback)
+        stats.add(dict(encode=t1 - t0, write=t2 - t1, wait=t3 - t2, decode=t4 - t3), self._wire_time(nbytes))
+        return True
+
+    def run(self, n: int = 1000, warmup: int = 10) -> dict:
+        '''Send each command n times (after `warmup` untimed rounds), interleaved.'''
+        for i in range(warmup):
+            for stats in self.stats:
+                self.round_trip(wubCommandLatency(stats.command, stats.args))
+
+        self.tstart = time.time()
+        for i in range(n):
+            for stats in self.stats:
+                self.round_trip(stats)
+        self.tstop = time.time()
+        return self.report()
+
+    def flags(self) -> list[dict]:
+        '''Commands whose turnaround suggests the device blocks while answering them.'''
+        reference = next(s for s in self.stats if s.command.name == "ECHO_PACKET")
+        ref_p50 = summarize(reference.turnaround)['p50']
+        flags = []
+        for stats in self.stats:
+            turnaround = summarize(stats.turnaround)
+            if turnaround['n'] == 0:
+                continue
+            if stats is not reference and ref_p50 is not None and \
+                    turnaround['p50'] > self.block_factor * ref_p50 + self.block_margin:
+                flags += [dict(command=stats.label, reason='slow',
+                               detail=f"median turnaround {turnaround['p50']*1e3:.3f} ms vs "
+                                      f"{ref_p50*1e3:.3f} ms for ECHO_PACKET")]
+            if turnaround['p99'] > self.block_factor * turnaround['p50'] + self.block_margin:
+                flags += [dict(command=stats.label, reason='intermittent',
+                               detail=f"p99 turnaround {turnaround['p99']*1e3:.3f} ms vs "
+                                      f"median {turnaround['p50']*1e3:.3f} ms")]
+            if stats.nfailed + stats.ntimeouts > 0:
+                flags += [dict(command=stats.label, reason='errors',
+                               detail=f"{stats.nfailed} rejected, {stats.ntimeouts} timed out")]
+        return flags
+
+    def report(self, meta: dict = None) -> dict:
+        wubctl = self._wubctl
+        info = dict(port=wubctl._port, baud=wubctl._s.baudrate, mode=wubctl.mode,
+                    autobaud=wubctl.autobaud, tstart=self.tstart, tstop=self.tstop,
+                    block_factor=self.block_factor, block_margin=self.block_margin)
+        if meta is not None:
+            info.update(meta)
+        return dict(meta=info, commands={s.label: s.summary() for s in self.stats}, flags=self.flags())
+
+
+def _ms(value) -> str:
+    return "      -" if value is None else f"{value*1e3:7.3f}"
+
+
+def format_report(report: dict) -> str:
+    '''Text table of a report: p50/p99/max per phase in ms.'''
+    meta = report['meta']
+    lines = [f"Port {meta['port']} at {meta['baud']} baud ({meta['mode']}); firmware {meta.get('version', '?')}",
+             f"{'command':24s} {'n':>6s} " + " ".join(f"{phase + ' p50/p99':>16s}" for phase in PHASES) +
+             f" {'total p50/p99/max':>24s} {'turnaround p50':>15s}"]
+    for label, s in report['commands'].items():
+        phases = " ".join(f"{_ms(s['phases'][p]['p50'])}/{_ms(s['phases'][p]['p99']).strip():>8s}" for p in PHASES)
+        total = s['total']
+        lines += [f"{label:24s} {total['n']:6d} {phases} {_ms(total['p50'])}/{_ms(total['p99']).strip():>7s}/"
+                  f"{_ms(total['max']).strip():>7s} {_ms(s['turnaround']['p50']):>15s}"]
+    for flag in report['flags']:
+        lines += [f"FLAG {flag['reason']:12s} {flag['command']}: {flag['detail']}"]
+    return "\n".join(lines)
+
+
+def diff_reports(baseline: dict, current: dict, threshold: float = 0.2) -> list[str]:
+    '''Lines describing per-command p50/p99 changes larger than threshold (relative), and flag changes.'''
+    lines = []
+    for label, new in current['commands'].items():
+        old = baseline['commands'].get(label)
+        if old is None:
+            lines += [f"+ {label}: not in baseline"]
+            continue
+        for stat in ('p50', 'p99'):
+            a, b = old['total'][stat], new['total'][stat]
+            if a is None or b is None or a == 0:
+                continue
+            change = (b - a) / a
+            if abs(change) > threshold:
+                lines += [f"{'!' if change > 0 else ' '} {label}: total {stat} {a*1e3:.3f} -> {b*1e3:.3f} ms ({change:+.0%})"]
+
+    old_flags = {(f['command'], f['reason']) for f in baseline['flags']}
+    new_flags = {(f['command'], f['reason']) for f in current['flags']}
+    lines += [f"+ flag {reason}: {command}" for command, reason in sorted(new_flags - old_flags)]
+    lines += [f"- flag {reason}: {command}" for command, reason in sorted(old_flags - new_flags)]
+    return lines
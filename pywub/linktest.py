@@ -0,0 +1,374 @@
+'''
+Bit-error testing of the link with the TESTPACKETS stream.
+
+With TESTPACKETS enabled, SEND_BATCH streams frames of a known pattern instead
+of hits (see test_frame()): frame i carries i in its hit number, timestamp and
+TDC word, and its samples count up from i. wubLinkTestValidator checks every
+received frame against the frame it should be and counts
+
+    bit errors    bits that differ from the expected frame
+    byte slips    losses of byte alignment: the decoder resynchronized, or a
+                  frame arrived with the wrong nsamples
+    misaligned    frames shifted by a dropped or inserted byte
+    lost frames   gaps in the frame index
+
+and estimates the bit error rate with confidence bounds (ber_interval()).
+The pattern is what the simulator streams; firmware with a different pattern
+is checked by passing its frame function as `pattern` (the index is still read
+from the hit number, timestamp and first sample). If none of the first
+PATTERN_CHECK_FRAMES frames matches the pattern the validator logs an error and
+sets pattern_mismatch, rather than reporting every frame as misaligned.
+Frames are compared in batches with numpy when it is available, so a full-rate
+stream can be checked live (as a wubCTL frame listener) or from a file,
+without keeping the data.
+'''
+
+from __future__ import annotations
+
+import math
+import struct
+from statistics import NormalDist
+
+from . import parser
+from . import records
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+_HIT_OFFSET = parser.HIT_NUMBER_OFFSET
+_TS_OFFSET = parser.FPGA_TS_OFFSET
+_SAMPLE_OFFSET = parser.ADC_DATA_OFFSET
+
+# Frame indices further ahead than this are not believed; the frame is compared
+# against the next expected one instead.
+MAX_INDEX_GAP = 1 << 20
+
+# Frames checked before concluding that the stream does not follow the pattern.
+PATTERN_CHECK_FRAMES = 64
+
+# Above this many errors the Poisson bounds use the normal approximation.
+_EXACT_POISSON_LIMIT = 1000
+
+
+def test_frame(index: int, nsamples: int) -> bytes:
+    '''The index-th frame of the TESTPACKETS stream, including START_BYTE.
+
+    The hit number, timestamp and TDC word are the frame index; sample i of ADC
+    channel c is (index + 2*i + c) & 0xFFFF.
+    '''
+    samples = [(index + i) & 0xFFFF for i in range(2 * nsamples)]
+    header = struct.pack("<HHQQ", nsamples, index & 0xFFFF, index & 0xFFFFFFFFFFFF, index)
+    return (bytes([parser.START_BYTE]) + header[0:parser.FPGA_TS_OFFSET + parser.FPGA_TS_WIDTH] + header[12:] +
+            struct.pack(f"<{2*nsamples}H", *samples))
+
+
+def expected_frames(indices, nsamples: int):
+    '''The test frames (without START_BYTE) for an array of indices, as an (n, frame size) uint8 array.'''
+    idx = np.asarray(indices, dtype=np.uint64)
+    n = len(idx)
+    words = idx.astype("<u8").view(np.uint8).reshape(n, 8)
+
+    out = np.empty((n, parser.calc_frame_size(nsamples)), dtype=np.uint8)
+    out[:, 0:_HIT_OFFSET] = np.frombuffer(struct.pack("<H", nsamples), dtype=np.uint8)
+    out[:, _HIT_OFFSET:_TS_OFFSET] = words[:, 0:parser.HIT_NUMBER_WIDTH]
+    out[:, _TS_OFFSET:parser.FPGA_TDC_OFFSET] = words[:, 0:parser.FPGA_TS_WIDTH]
+    out[:, parser.FPGA_TDC_OFFSET:_SAMPLE_OFFSET] = words
+    samples = (idx[:, None] + np.arange(2 * nsamples, dtype=np.uint64)) & np.uint64(0xFFFF)
+    out[:, _SAMPLE_OFFSET:] = samples.astype("<u2").view(np.uint8).reshape(n, 4 * nsamples)
+    return out
+
+
+def _poisson_cdf(k: int, mu: float) -> float:
+    if mu <= 0:
+        return 1.0
+    log_mu = math.log(mu)
+    return min(1.0, math.fsum(math.exp(i * log_mu - mu - math.lgamma(i + 1)) for i in range(k + 1)))
+
+
+def _bisect(fn, lo: float, hi: float, target: float, decreasing: bool = True) -> float:
+    for _ in range(100):
+        mid = 0.5 * (lo + hi)
+        if (fn(mid) > target) == decreasing:
+            lo = mid
+        else:
+            hi = mid
+    return 0.5 * (lo + hi)
+
+
+def ber_interval(nerrors: int, nbits: int, confidence: float = 0.95) -> tuple[float, float]:
+    '''Bounds on the bit error rate after nerrors errors in nbits bits.
+
+    Errors are treated as Poisson distributed: the bounds are the exact two-sided
+    (Garwood) interval up to 1000 errors and the normal approximation above. With
+    no errors the upper bound is the one-sided limit -ln(1 - confidence) / nbits
+    (about 3 / nbits at 95%), as usually quoted for link tests.
+
+    Returns:
+        (lower, upper) bit error rates, or (None, None) before any bits were checked.
+    '''
+    if nbits <= 0:
+        return None, None
+    alpha = 1 - confidence
+
+    if nerrors == 0:
+        return 0.0, -math.log(alpha) / nbits
+
+    if nerrors > _EXACT_POISSON_LIMIT:
+        z = NormalDist().inv_cdf(1 - alpha / 2)
+        spread = z * math.sqrt(nerrors)
+        return max(0.0, nerrors - spread) / nbits, (nerrors + spread) / nbits
+
+    span = nerrors + 20 * math.sqrt(nerrors) + 20
+    upper = _bisect(lambda mu: _poisson_cdf(nerrors, mu), nerrors, span, alpha / 2)
+    lower = _bisect(lambda mu: _poisson_cdf(nerrors - 1, mu), 0.0, nerrors, 1 - alpha / 2)
+    return lower / nbits, upper / nbits
+
+
+def _popcount(data: bytes) -> int:
+    return bin(int.from_bytes(data, 'little')).count('1')
+
+
+if np is not None:
+    _POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class wubLinkTestValidator():
+    '''
+    Checks a TESTPACKETS stream against the expected pattern.
+
+    Use feed() for the raw byte stream (e.g. a 'bulk' store mode file) or
+    check_frames() for decoded frames; check_frames has the signature of a
+    wubCTL frame listener:
+
+        validator = wubLinkTestValidator(nsamples=16)
+        wubctl.add_frame_listener(validator.check_frames)
+
+    Each frame's index is taken from its timestamp when the hit number or first
+    sample agrees with it, otherwise from the hit number and first sample, and
+    otherwise assumed to be the next one in sequence. A byte dropped or inserted
+    inside a frame shifts the rest of it, which shows up as a run of wrong
+    bytes; such frames are counted as misaligned rather than as bit errors,
+    so the BER reflects bit flips only. A frame with a lower index
+    than expected but a consistent header starts the count over (TESTPACKETS
+    was re-enabled) and is counted as a restart.
+
+    Args:
+        nsamples (int): Samples per test frame (the TESTPACKETS argument).
+        confidence (float): Confidence level of the BER bounds.
+        max_error_bytes (int): A frame with more wrong bytes than this is counted as
+            misaligned and left out of the BER.
+        use_numpy (bool): Compare frames in numpy batches if numpy is installed.
+        pattern (callable): pattern(index, nsamples) -> the expected frame, START_BYTE
+            included; test_frame() if None.
+        expected (callable): expected(indices, nsamples) -> the frames as a uint8 array, as
+            expected_frames(); built from `pattern` if None.
+    '''
+
+    def __init__(self, nsamples: int, confidence: float = 0.95, max_error_bytes: int = 8,
+                 use_numpy: bool = True, pattern=None, expected=None):
+        self.nsamples = nsamples
+        self._pattern = test_frame if pattern is None else pattern
+        if expected is None:
+            expected = expected_frames if pattern is None else self._pattern_frames
+        self._expected_frames = expected
+        self.confidence = confidence
+        self.frame_size = parser.calc_frame_size(nsamples)
+        self.max_error_bytes = max_error_bytes
+        self._use_numpy = use_numpy and np is not None
+        self._decoder = parser.FrameDecoder()
+        self._expected = None
+        self.reset()
+
+    def reset(self):
+        self._decoder.reset()
+        self._expected = None
+        self.nframes = 0
+        self.nframes_errored = 0
+        self.nframes_lost = 0
+        self.nbits = 0
+        self.nbit_errors = 0
+        self.nbad_length = 0
+        self.nframes_misaligned = 0
+        self.nresyncs = 0
+        self.nbytes_skipped = 0
+        self.nrestarts = 0
+        self.first_index = None
+        self.last_index = None
+        self.pattern_mismatch = False
+        self._pattern_checked = False
+
+    @property
+    def nslips(self) -> int:
+        '''Byte alignment losses: decoder resyncs plus frames of the wrong size.'''
+        return self.nresyncs + self.nbad_length
+
+    def add_resyncs(self, nresyncs: int, nbytes_skipped: int = 0):
+        '''Count resyncs of a decoder outside the validator, e.g. wubCTL.metrics.resyncs in live tests.'''
+        self.nresyncs += nresyncs
+        self.nbytes_skipped += nbytes_skipped
+
+    def feed(self, data: bytes):
+        '''Check a chunk of the raw stream (start bytes included).'''
+        decoder = self._decoder
+        nresyncs, nskipped = decoder.nresyncs, decoder.nbytes_skipped
+        frames = decoder.feed(data)
+        self.add_resyncs(decoder.nresyncs - nresyncs, decoder.nbytes_skipped - nskipped)
+        self.check_frames(frames)
+
+    def check_frames(self, frames: list[bytes], basenumber: int = None, timestamp: float = None):
+        '''Check decoded frames (without start bytes), in stream order.'''
+        good = []
+        for frame in frames:
+            if len(frame) == self.frame_size:
+                good.append(frame)
+                continue
+            # A corrupted nsamples field; the frame is lost and the decoder has to resync.
+            self._check(good)
+            good = []
+            self.nbad_length += 1
+        self._check(good)
+
+    def _index(self, frame: bytes) -> int:
+        '''Best guess of the index of a test frame that is not simply the next one.'''
+        expected = self._expected
+        hit = int.from_bytes(frame[_HIT_OFFSET:_TS_OFFSET], 'little')
+        ts = int.from_bytes(frame[_TS_OFFSET:parser.FPGA_TDC_OFFSET], 'little')
+        sample = int.from_bytes(frame[_SAMPLE_OFFSET:_SAMPLE_OFFSET + 2], 'little')
+        low = ts & 0xFFFF
+
+        if low == hit or low == sample:
+            if expected is None or expected <= ts < expected + MAX_INDEX_GAP:
+                return ts
+            if ts < expected and low == hit == sample:
+                self.nrestarts += 1
+                return ts
+        if expected is None:
+            return ts if low == hit or low == sample else hit
+        if hit == sample:
+            return expected + ((hit - expected) & 0xFFFF)
+        return expected
+
+    def _indices(self, frames: list[bytes]) -> list[int]:
+        indices = []
+        for frame in frames:
+            index = self._index(frame)
+            if self._expected is not None and index > self._expected:
+                self.nframes_lost += index - self._expected
+            indices.append(index)
+            self._expected = index + 1
+        return indices
+
+    def _check(self, frames: list[bytes]):
+        if len(frames) == 0:
+            return
+        indices = self._check_numpy(frames) if self._use_numpy else self._check_python(frames)
+
+        if self.first_index is None:
+            self.first_index = int(indices[0])
+        self.last_index = int(indices[-1])
+
+        if not self._pattern_checked and self.nframes + self.nframes_misaligned >= PATTERN_CHECK_FRAMES:
+            self._pattern_checked = True
+            if self.nframes == 0:
+                self.pattern_mismatch = True
+                logger.error(f"None of the first {self.nframes_misaligned} frames matches the test pattern "
+                             f"({self.nsamples} samples); the stream is not TESTPACKETS or uses another pattern.")
+
+    def _pattern_frames(self, indices, nsamples: int):
+        frames = b"".join(self._pattern(int(i), nsamples)[parser.START_BYTE_WIDTH:] for i in indices)
+        return np.frombuffer(frames, dtype=np.uint8).reshape(len(indices), self.frame_size)
+
+    def _check_python(self, frames: list[bytes]) -> list[int]:
+        indices = self._indices(frames)
+        for frame, index in zip(frames, indices):
+            diff = bytes(a ^ b for a, b in zip(frame, self._pattern(index, self.nsamples)[parser.START_BYTE_WIDTH:]))
+            if len(diff) - diff.count(0) > self.max_error_bytes:
+                self.nframes_misaligned += 1
+                continue
+            self.nframes += 1
+            self.nbits += 8 * self.frame_size
+            nerrors = _popcount(diff)
+            if nerrors > 0:
+                self.nbit_errors += nerrors
+                self.nframes_errored += 1
+        return indices
+
+    def _check_numpy(self, frames: list[bytes]):
+        n = len(frames)
+        received = np.frombuffer(b"".join(frames), dtype=np.uint8).reshape(n, self.frame_size)
+
+        # Fast path: every timestamp is the next index in sequence.
+        indices = None
+        if self._expected is not None:
+            ts = np.zeros((n, 8), dtype=np.uint8)
+            ts[:, 0:parser.FPGA_TS_WIDTH] = received[:, _TS_OFFSET:parser.FPGA_TDC_OFFSET]
+            candidate = np.arange(self._expected, self._expected + n, dtype=np.uint64)
+            if np.array_equal(ts.view("<u8").ravel(), candidate):
+                indices = candidate
+                self._expected += n
+        if indices is None:
+            indices = self._indices(frames)
+
+        diff = received ^ self._expected_frames(indices, self.nsamples)
+        aligned = np.count_nonzero(diff, axis=1) <= self.max_error_bytes
+        nchecked = int(np.count_nonzero(aligned))
+        self.nframes_misaligned += n - nchecked
+        errors = _POPCOUNT[diff[aligned]].sum(axis=1, dtype=np.int64)
+        self.nframes += nchecked
+        self.nbits += 8 * self.frame_size * nchecked
+        self.nbit_errors += int(errors.sum())
+        self.nframes_errored += int(np.count_nonzero(errors))
+        return indices
+
+    def report(self) -> dict:
+        lower, upper = ber_interval(self.nbit_errors, self.nbits, self.confidence)
+        return dict(nsamples=self.nsamples, nframes=self.nframes, nframes_errored=self.nframes_errored,
+                    nframes_lost=self.nframes_lost, nbits=self.nbits, nbit_errors=self.nbit_errors,
+                    nslips=self.nslips, nresyncs=self.nresyncs, nbytes_skipped=self.nbytes_skipped,
+                    nbad_length=self.nbad_length, nframes_misaligned=self.nframes_misaligned, nrestarts=self.nrestarts,
+                    first_index=self.first_index, last_index=self.last_index,
+                    pattern_mismatch=self.pattern_mismatch,
+                    ber=self.nbit_errors / self.nbits if self.nbits > 0 else None,
+                    ber_lower=lower, ber_upper=upper, confidence=self.confidence)
+
+
+def validate_file(filename: str, nsamples: int, chunk_size: int = 1 << 20, **kwargs) -> wubLinkTestValidator:
+    '''Check a TESTPACKETS file: a raw stream ('bulk' store mode) or a record file ('frame' store mode).'''
+    validator = wubLinkTestValidator(nsamples, **kwargs)
+    with open(filename, "rb") as f:
+        is_records = f.read(len(records.RECORD_MAGIC)) == records.RECORD_MAGIC
+        f.seek(0)
+        if is_records:
+            frames = []
+            for rec in records.iter_records(f):
+                frames.append(rec.data)
+                if len(frames) >= 4096:
+                    validator.check_frames(frames)
+                    frames = []
+            validator.check_frames(frames)
+        else:
+            while True:
+                data = f.read(chunk_size)
+                if len(data) == 0:
+                    break
+                validator.feed(data)
+    return validator
+
+
+def format_report(report: dict) -> str:
+    def rate(value):
+        return "-" if value is None else f"{value:.3g}"
+    mismatch = "Stream does not match the test pattern. " if report.get('pattern_mismatch') else ""
+    return (f"{mismatch}{report['nframes']} frames ({report['nbits']} bits) checked: "
+            f"{report['nbit_errors']} bit errors in {report['nframes_errored']} frames, "
+            f"{report['nframes_lost']} frames lost, {report['nframes_misaligned']} misaligned, "
+            f"{report['nslips']} byte slips "
+            f"({report['nbytes_skipped']} bytes skipped). "
+            f"BER {rate(report['ber'])} [{rate(report['ber_lower'])}, {rate(report['ber_upper'])}] "
+            f"at {report['confidence']:.0%}")
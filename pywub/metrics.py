@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from dataclasses import dataclass, field, asdict
+from typing import Callable
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the write latency histogram buckets.
+# The last bucket catches everything above the largest bound.
+LATENCY_BUCKETS = (1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 1e-1, 3e-1, 1.0)
+
+
+class wubHistogram():
+    '''
+    Fixed-bucket histogram. observe() is a bisect and a handful of additions.
+    '''
+
+    def __init__(self, bounds: tuple = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def to_dict(self) -> dict:
+        return dict(bounds=list(self.bounds), counts=list(self.counts),
+                    sum=self.sum, count=self.count, max=self.max)
+
+
+@dataclass
+class wubMetricsSnapshot:
+    '''
+    Point-in-time copy of a wubMetrics object, with rates computed against the previous snapshot.
+    '''
+    name: str
+    timestamp: float
+    uptime: float
+
+    #Counters
+    bytes_recv: int = 0
+    bytes_sent: int = 0
+    frames: int = 0
+    decode_errors: int = 0
+    resyncs: int = 0
+    near_overflows: int = 0
+    nreads: int = 0
+    nwrites: int = 0
+
+    #Time spent blocked in the serial port (seconds)
+    read_time: float = 0.0
+    write_time: float = 0.0
+
+    #Gauges
+    in_waiting: int = 0
+    in_waiting_hwm: int = 0
+    gauges: dict = field(default_factory=dict)
+
+    #Rates since the previous snapshot
+    bytes_per_s: float = 0.0
+    frames_per_s: float = 0.0
+
+    write_latency: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def to_prometheus(self, prefix: str = "pywub") -> str:
+        '''Render the snapshot in the Prometheus text exposition format.'''
+        return render_prometheus([self], prefix)
+
+    def prometheus_families(self) -> list[tuple]:
+        '''(name, type, help, [(labels, value), ...]) for every exported metric.'''
+        label = f'name="{self.name}"'
+        families = [
+            ("bytes_received_total", "counter", "Bytes read from the serial port.", self.bytes_recv),
+            ("bytes_sent_total", "counter", "Bytes written to the serial port.", self.bytes_sent),
+            ("frames_total", "counter", "Frames received.", self.frames),
+            ("decode_errors_total", "counter", "Frames that failed to decode.", self.decode_errors),
+            ("resyncs_total", "counter", "Times the receiver had to search for a start byte.", self.resyncs),
+            ("near_overflows_total", "counter", "Times the host receive buffer came close to overflowing.", self.near_overflows),
+            ("read_seconds_total", "counter", "Time spent blocked in serial reads.", self.read_time),
+            ("write_seconds_total", "counter", "Time spent blocked in serial writes.", self.write_time),
+            ("in_waiting_bytes", "gauge", "Bytes waiting in the host receive buffer.", self.in_waiting),
+            ("in_waiting_hwm_bytes", "gauge", "High-water mark of in_waiting.", self.in_waiting_hwm),
+            ("bytes_per_second", "gauge", "Receive rate since the previous snapshot.", self.bytes_per_s),
+            ("frames_per_second", "gauge", "Frame rate since the previous snapshot.", self.frames_per_s),
+        ]
+        families = [(name, kind, help_str, [(label, value)]) for name, kind, help_str, value in families]
+
+        for gauge, value in self.gauges.items():
+            families += [(gauge, "gauge", f"Registered gauge '{gauge}'.", [(label, value)])]
+
+        hist = self.write_latency
+        if hist:
+            samples = []
+            cumulative = 0
+            for bound, count in zip(list(hist['bounds']) + ["+Inf"], hist['counts']):
+                cumulative += count
+                samples += [(f'{label},le="{bound}"', cumulative)]
+            families += [("write_latency_seconds_bucket", "histogram", "Serial write latency.", samples),
+                         ("write_latency_seconds_sum", None, None, [(label, hist['sum'])]),
+                         ("write_latency_seconds_count", None, None, [(label, hist['count'])])]
+
+        return families
+
+
+def render_prometheus(snapshots: list[wubMetricsSnapshot], prefix: str = "pywub") -> str:
+    '''Render several snapshots as one exposition, with each metric family grouped.'''
+    grouped = {}
+    for snap in snapshots:
+        for name, kind, help_str, samples in snap.prometheus_families():
+            if name not in grouped:
+                grouped[name] = (kind, help_str, [])
+            grouped[name][2].extend(samples)
+
+    lines = []
+    for name, (kind, help_str, samples) in grouped.items():
+        if kind == "histogram":
+            base = name[:-len("_bucket")]
+            lines += [f"# HELP {prefix}_{base} {help_str}", f"# TYPE {prefix}_{base} histogram"]
+        elif kind is not None:
+            lines += [f"# HELP {prefix}_{name} {help_str}", f"# TYPE {prefix}_{name} {kind}"]
+        lines += [f"{prefix}_{name}{{{labels}}} {value}" for labels, value in samples]
+
+    return "\n".join(lines) + "\n"
+
+
+class wubMetrics():
+    '''
+    Counters and gauges describing the health of one serial link.
+
+    The receive and transmit paths update plain attributes directly (e.g.
+    `metrics.frames += 1`), so instrumentation costs an attribute increment.
+    Rates and copies are only computed when snapshot() is called.
+    '''
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._tstart = time.time()
+
+        self.bytes_recv = 0
+        self.bytes_sent = 0
+        self.frames = 0
+        self.decode_errors = 0
+        self.resyncs = 0
+        self.near_overflows = 0
+        self.nreads = 0
+        self.nwrites = 0
+
+        self.read_time = 0.0
+        self.write_time = 0.0
+
+        self.in_waiting = 0
+        self.in_waiting_hwm = 0
+
+        self.write_latency = wubHistogram()
+
+        self._gauges = {}
+        self._last = None
+
+    def register_gauge(self, name: str, fn: Callable[[], float]):
+        '''Register a callable sampled at snapshot time, e.g. a queue depth.'''
+        self._gauges[name] = fn
+
+    def unregister_gauge(self, name: str):
+        self._gauges.pop(name, None)
+
+    def update_in_waiting(self, n: int):
+        self.in_waiting = n
+        if n > self.in_waiting_hwm:
+            self.in_waiting_hwm = n
+
+    def record_write(self, nbytes: int, dt: float):
+        self.bytes_sent += nbytes
+        self.nwrites += 1
+        self.write_time += dt
+        self.write_latency.observe(dt)
+
+    def reset(self):
+        '''Zero all counters; registered gauges are kept.'''
+        gauges = self._gauges
+        self.__init__(self.name)
+        self._gauges = gauges
+
+    def snapshot(self) -> wubMetricsSnapshot:
+        now = time.time()
+
+        gauges = {}
+        for name, fn in list(self._gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception as e:
+                logger.debug(f"Gauge '{name}' failed: {e}")
+
+        snap = wubMetricsSnapshot(name=self.name, timestamp=now, uptime=now - self._tstart,
+                                  bytes_recv=self.bytes_recv, bytes_sent=self.bytes_sent,
+                                  frames=self.frames, decode_errors=self.decode_errors,
+                                  resyncs=self.resyncs, near_overflows=self.near_overflows,
+                                  nreads=self.nreads, nwrites=self.nwrites,
+                                  read_time=self.read_time, write_time=self.write_time,
+                                  in_waiting=self.in_waiting, in_waiting_hwm=self.in_waiting_hwm,
+                                  gauges=gauges, write_latency=self.write_latency.to_dict())
+
+        last = self._last
+        if last is not None and now > last.timestamp:
+            dt = now - last.timestamp
+            snap.bytes_per_s = (snap.bytes_recv - last.bytes_recv) / dt
+            snap.frames_per_s = (snap.frames - last.frames) / dt
+        elif snap.uptime > 0:
+            snap.bytes_per_s = snap.bytes_recv / snap.uptime
+            snap.frames_per_s = snap.frames / snap.uptime
+
+        self._last = snap
+        return snap
+
+
+class wubMetricsExporter():
+    '''
+    Periodically writes snapshots of one or more wubMetrics objects to a local file.
+
+    fmt='prom' rewrites the file atomically on every interval (suitable for a
+    node_exporter textfile collector); fmt='jsonl' appends one line per snapshot.
+    '''
+
+    def __init__(self, metrics: wubMetrics | list[wubMetrics], filename: str,
+                 fmt: str = 'jsonl', interval: float = 1.0):
+        if fmt not in ['prom', 'jsonl']:
+            raise ValueError(f"{fmt} not an acceptable metrics format: prom, jsonl")
+
+        self._metrics = metrics if isinstance(metrics, list) else [metrics]
+        self._filename = filename
+        self._fmt = fmt
+        self._interval = interval
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="wubMetricsExporter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.export()
+
+    def export(self):
+        snapshots = [m.snapshot() for m in self._metrics]
+
+        if self._fmt == 'prom':
+            tmp = f"{self._filename}.tmp"
+            with open(tmp, 'w') as f:
+                f.write(render_prometheus(snapshots))
+            os.replace(tmp, self._filename)
+        else:
+            with open(self._filename, 'a') as f:
+                for snap in snapshots:
+                    f.write(snap.to_json() + "\n")
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                self.export()
+            except OSError as e:
+                logger.warning(f"Failed to export metrics to {self._filename}: {e}")
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import math
+import time
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class wubRateEstimator():
+    '''
+    Exponentially weighted rate estimate of a monotonically increasing counter.
+
+    The weight of each update depends on the time elapsed since the previous one,
+    so irregular sampling (e.g. an early wake-up) does not bias the estimate.
+    '''
+
+    def __init__(self, tau: float = 3.0):
+        self._tau = tau
+        self._last_value = None
+        self._last_time = None
+        self._primed = False
+        self.rate = 0.0
+
+    def update(self, value: float, now: float = None) -> float:
+        now = time.monotonic() if now is None else now
+
+        if self._last_time is None:
+            self._last_value = value
+            self._last_time = now
+            return self.rate
+
+        dt = now - self._last_time
+        if dt <= 0:
+            return self.rate
+
+        inst = (value - self._last_value) / dt
+        if self._primed:
+            alpha = 1.0 - math.exp(-dt / self._tau)
+            self.rate += alpha * (inst - self.rate)
+        else:
+            self.rate = inst
+            self._primed = True
+
+        self._last_value = value
+        self._last_time = now
+        return self.rate
+
+
+@dataclass
+class wubMonitorSource:
+    name: str
+    nbytes: Callable[[], int]
+    nframes: Callable[[], int] = None
+    in_waiting: Callable[[], int] = None
+    done: Callable[[], bool] = None
+
+    def __post_init__(self):
+        self.byte_rate = wubRateEstimator()
+        self.frame_rate = wubRateEstimator()
+        self.last_nbytes = 0
+        self.last_change = time.monotonic()
+        self.stalled = False
+
+
+class wubRunMonitor():
+    '''
+    Progress and stall monitor for one or more DAQ receivers.
+
+    run() sleeps on a condition variable between reports instead of polling, and
+    is woken immediately through notify() when a source finishes (wubCTL calls it
+    via add_batch_done_callback when attached with add_wubctl()).
+
+    Args:
+        interval (float): Seconds between progress reports.
+        maxruntime (float): Stop waiting after this many seconds (<= 0 means no limit).
+        stall_timeout (float): Alert when a source delivers no data for this long.
+        min_rate (float): Also alert when the estimated rate drops below this (bytes/s); 0 disables.
+        expected_frames (int): Frames expected per source; used for the ETA when known.
+        on_stall (callable): Called as on_stall(name, seconds_without_data).
+    '''
+
+    def __init__(self, interval: float = 1.0, maxruntime: float = -1,
+                 stall_timeout: float = 3.0, min_rate: float = 0.0, expected_frames: int = None,
+                 on_stall: Callable[[str, float], None] = None):
+        self._interval = interval
+        self._maxruntime = maxruntime
+        self._stall_timeout = stall_timeout
+        self._min_rate = min_rate
+        self._expected_frames = expected_frames if expected_frames is not None and expected_frames > 0 else None
+        self._on_stall = on_stall
+
+        self._sources = []
+        self._wubctl_sources = {}
+        self._cond = threading.Condition()
+        self._stop_requested = False
+        self._notified = False
+        self._tstart = None
+
+    def add_source(self, name: str, nbytes: Callable[[], int], nframes: Callable[[], int] = None,
+                   in_waiting: Callable[[], int] = None, done: Callable[[], bool] = None) -> wubMonitorSource:
+        source = wubMonitorSource(name, nbytes, nframes, in_waiting, done)
+        self._sources.append(source)
+        return source
+
+    def add_wubctl(self, wubctl, name: str = None) -> wubMonitorSource:
+        '''Monitor a wubCTL's batch readout.'''
+        name = wubctl._port if name is None else name
+        in_waiting = None if wubctl.isascii else (lambda: wubctl.bytes_in_waiting)
+        # Count completions rather than reading batch_mode_running, which is still 
+        # False if the receive thread has not started yet.
+        nbatches = wubctl.nbatches_done
+        wubctl.add_batch_done_callback(self.notify)
+        source = self.add_source(name,
+                                 nbytes=lambda: wubctl.nbytes_recv,
+                                 nframes=lambda: wubctl.metrics.frames,
+                                 in_waiting=in_waiting,
+                                 done=lambda: wubctl.nbatches_done > nbatches)
+        self._wubctl_sources[wubctl] = source
+        return source
+
+    def remove_wubctl(self, wubctl):
+        '''Detach from a wubCTL attached with add_wubctl(), which may outlive the monitor.'''
+        wubctl.remove_batch_done_callback(self.notify)
+        source = self._wubctl_sources.pop(wubctl, None)
+        if source in self._sources:
+            self._sources.remove(source)
+
+    def notify(self):
+        '''Wake run() now, e.g. because a source finished.'''
+        with self._cond:
+            self._notified = True
+            self._cond.notify_all()
+
+    def stop(self):
+        with self._cond:
+            self._stop_requested = True
+            self._cond.notify_all()
+
+    @property
+    def elapsed(self) -> float:
+        return 0.0 if self._tstart is None else time.monotonic() - self._tstart
+
+    def _all_done(self) -> bool:
+        return all(s.done is not None and s.done() for s in self._sources)
+
+    def _eta(self, source: wubMonitorSource, nframes: int) -> float:
+        etas = []
+        if self._maxruntime > 0:
+            etas += [max(self._maxruntime - self.elapsed, 0.0)]
+        if self._expected_frames is not None and source.frame_rate.rate > 0:
+            etas += [max(self._expected_frames - nframes, 0) / source.frame_rate.rate]
+        return min(etas) if len(etas) > 0 else None
+
+    def report(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        for source in self._sources:
+            nbytes = source.nbytes()
+            byte_rate = source.byte_rate.update(nbytes, now)
+
+            info_str = f"{source.name} Progress: {nbytes:8.4e} bytes ({byte_rate/1e3:8.2f} kB/s)"
+
+            if source.nframes is not None:
+                nframes = source.nframes()
+                frame_rate = source.frame_rate.update(nframes, now)
+                if nframes > 0:
+                    info_str += f" -- {nframes} frames ({frame_rate:8.1f} /s)"
+            else:
+                nframes = 0
+
+            if source.in_waiting is not None:
+                info_str += f" -- bytes in_waiting: {source.in_waiting()}"
+
+            eta = self._eta(source, nframes)
+            if eta is not None:
+                info_str += f" -- ETA: {eta:6.1f} s"
+
+            logger.info(info_str)
+            self._check_stall(source, nbytes, now)
+
+    def _check_stall(self, source: wubMonitorSource, nbytes: int, now: float):
+        if nbytes != source.last_nbytes:
+            source.last_nbytes = nbytes
+            source.last_change = now
+
+        idle = now - source.last_change
+        slow = (self._min_rate > 0 and self.elapsed >= self._stall_timeout 
+                and source.byte_rate.rate < self._min_rate)
+        stalled = idle >= self._stall_timeout or slow
+
+        if stalled and not source.stalled:
+            logger.warning(f"{source.name}: stalled -- no new data for {idle:.1f} s, "
+                           f"rate estimate {source.byte_rate.rate/1e3:.2f} kB/s.")
+            if self._on_stall is not None:
+                self._on_stall(source.name, idle)
+        elif source.stalled and not stalled:
+            logger.info(f"{source.name}: data flow resumed.")
+
+        source.stalled = stalled
+
+    def run(self) -> str:
+        '''Block until every source is done, maxruntime is exceeded or stop() is called.
+
+        Returns:
+            str: 'done', 'runtime' or 'stopped'.
+        '''
+        self._tstart = time.monotonic()
+        next_report = self._tstart + self._interval
+        deadline = self._tstart + self._maxruntime if self._maxruntime > 0 else None
+
+        # The sources and on_stall are called without holding the condition, so
+        # a callback that calls notify() or stop() cannot deadlock; _notified
+        # keeps a notify() that arrives in the meantime from being missed.
+        while True:
+            with self._cond:
+                if self._stop_requested:
+                    return 'stopped'
+                self._notified = False
+
+            if len(self._sources) > 0 and self._all_done():
+                self.report()
+                return 'done'
+
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                self.report(now)
+                return 'runtime'
+
+            if now >= next_report:
+                self.report(now)
+                # Skip missed report slots rather than bursting to catch up.
+                next_report += self._interval * (math.floor((now - next_report) / self._interval) + 1)
+
+            wake = next_report if deadline is None else min(next_report, deadline)
+            with self._cond:
+                if not self._notified and not self._stop_requested:
+                    self._cond.wait(max(wake - time.monotonic(), 0.0))
@@ -21,6 +21,12 @@ ADC_DATA_OFFSET   = FPGA_TDC_OFFSET   + FPGA_TDC_WIDTH
 
 HEADER_SIZE = NSAMPLES_WIDTH + HIT_NUMBER_WIDTH + FPGA_TS_WIDTH + FPGA_TDC_WIDTH
 
+# Frames claiming more samples than this are treated as corrupt by FrameDecoder.
+MAX_NSAMPLES = 4096
+
+_START_BYTE = bytes([START_BYTE])
+_NSAMPLES_STRUCT = struct.Struct("<H" if NSAMPLES_WIDTH == 2 else "<B")
+
 def unpack_nsamples(d: bytes) -> int:
 
     if NSAMPLES_WIDTH == 2:
@@ -103,4 +109,70 @@ def parse_single_raw_hit(hit_data:bytearray) -> bool:
 
         print(f"------------------------------------")
 
-        return True
\ No newline at end of file
+        return True
+
+
+class FrameDecoder():
+    '''
+    Streaming splitter for the binary hit stream.
+
+    Feed it chunks of any size straight from the serial port; it returns every
+    complete frame (header + payload, without the start byte) and keeps the
+    incomplete remainder for the next call. When a start byte is missing or a
+    frame claims an impossible nsamples, the decoder skips ahead to the next 
+    start byte and counts a resync.
+    '''
+
+    def __init__(self, max_nsamples: int = MAX_NSAMPLES):
+        self._max_nsamples = max_nsamples
+        self._buf = bytearray()
+
+        self.nframes = 0
+        self.nresyncs = 0
+        self.nbytes_skipped = 0
+
+    @property
+    def pending(self) -> int:
+        '''Number of buffered bytes not yet returned as a frame.'''
+        return len(self._buf)
+
+    def reset(self):
+        self._buf.clear()
+
+    def feed(self, data: bytes) -> list[bytes]:
+        buf = self._buf
+        buf += data
+
+        frames = []
+        pos = 0
+        end = len(buf)
+        unpack_nsamples = _NSAMPLES_STRUCT.unpack_from
+        header_end = START_BYTE_WIDTH + NSAMPLES_WIDTH
+
+        while end - pos >= header_end:
+            if buf[pos] != START_BYTE:
+                nxt = buf.find(_START_BYTE, pos + 1)
+                skip_to = end if nxt < 0 else nxt
+                self.nbytes_skipped += skip_to - pos
+                self.nresyncs += 1
+                pos = skip_to
+                continue
+
+            nsamples = unpack_nsamples(buf, pos + START_BYTE_WIDTH)[0]
+            if nsamples > self._max_nsamples:
+                # Not a real start byte; look for the next one.
+                self.nbytes_skipped += 1
+                self.nresyncs += 1
+                pos += 1
+                continue
+
+            frame_end = pos + START_BYTE_WIDTH + calc_frame_size(nsamples)
+            if frame_end > end:
+                break
+
+            frames.append(bytes(buf[pos + START_BYTE_WIDTH:frame_end]))
+            pos = frame_end
+
+        del buf[:pos]
+        self.nframes += len(frames)
+        return frames
@@ -0,0 +1,241 @@
+'''
+Single-thread readout of many bases.
+
+The usual way to take data from several bases is one thread per wubCTL running
+batchmode_recv, each polling its own port. wubReadoutEngine instead registers
+the serial file descriptors of all bases with a selector (epoll on Linux) and
+serves them from one thread:
+
+    engine = wubReadoutEngine()
+    for wubctl in wubctls:
+        engine.add(wubctl, datafile=open(f"run_{wubctl.basenumber}.dat", "wb"))
+    engine.start_batches()
+    engine.run(duration=60)        # or engine.stop() from another thread
+
+Readable ports are drained with a single non-blocking read into a per-base
+buffer. Buffered data are split into frames (parser.FrameDecoder) once a base
+has batch_bytes pending or its oldest pending chunk is max_latency old, and the
+frames are written as records (pywub.records) to the base's datafile, or to
+one shared file given as `merged` (records carry their base number). Frame
+listeners registered on each wubCTL are called as in the 'frame' store mode.
+
+Only BINARY links are supported.
+'''
+
+from __future__ import annotations
+
+import os
+import time
+import selectors
+import threading
+
+from . import parser
+from . import records
+from .catalog import ctlg as wubCMD_catalog
+from .catalog import wubCMD_RC
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Largest single read from one port.
+READ_SIZE = 1 << 16
+
+
+class _wubReadoutLink():
+    '''Per-base state of the engine.'''
+
+    def __init__(self, wubctl, datafile):
+        self.wubctl = wubctl
+        self.datafile = datafile
+        self.write_frames = getattr(datafile, 'write_frames', None)
+        self.fd = wubctl._s.fileno()
+        self.decoder = parser.FrameDecoder()
+        self.chunks = []
+        self.npending = 0
+        self.tfirst = None
+        self.nresyncs = 0
+
+
+class wubReadoutEngine():
+    '''
+    Args:
+        merged (file): Write the records of every base to this file instead of
+            per-base datafiles.
+        batch_bytes (int): Decode a base's pending data once this many bytes are buffered.
+        max_latency (float): Decode pending data at the latest this many seconds after it arrived.
+        select_timeout (float): Longest wait for a readable port, in seconds.
+        min_interval (float): Shortest time between two rounds of reads, so data from busy
+            ports are read in larger chunks with fewer system calls.
+        stop_wait (float): Seconds to let frames already in flight arrive after stopping the batches.
+    '''
+
+    def __init__(self, merged=None, batch_bytes: int = 1 << 16, max_latency: float = 0.05,
+                 select_timeout: float = 0.05, min_interval: float = 0.002, stop_wait: float = 0.25):
+        self._merged = merged
+        self._merged_write_frames = getattr(merged, 'write_frames', None)
+        self._batch_bytes = batch_bytes
+        self._max_latency = max_latency
+        self._select_timeout = select_timeout
+        self._min_interval = min_interval
+        self._tlast = 0.0
+        self._stop_wait = stop_wait
+
+        self._selector = selectors.DefaultSelector()
+        self._links = {}
+        self._stop = threading.Event()
+
+        self.nselects = 0
+        self.nreads = 0
+        self.tstart = None
+        self.tstop = None
+
+    @property
+    def wubctls(self) -> list:
+        return [link.wubctl for link in self._links.values()]
+
+    def add(self, wubctl, datafile=None):
+        '''Serve a BINARY link; its records go to datafile (unless the engine writes a merged file).'''
+        if wubctl.isascii:
+            raise ValueError(f"Base {wubctl.basenumber}: the readout engine needs a BINARY link.")
+        link = _wubReadoutLink(wubctl, datafile)
+        self._selector.register(link.fd, selectors.EVENT_READ, link)
+        self._links[link.fd] = link
+
+    def start_batches(self, ntosend: int = -1, modenostop: bool = True):
+        '''Send SEND_BATCH to every base.'''
+        for link in self._links.values():
+            wubctl = link.wubctl
+            wubctl.prepare_batch()
+            resp = wubctl.cmd_send_batch(ntosend, 1 if modenostop else 0)['response']
+            if resp['CMD_RC'] != wubCMD_RC.CMD_RC_OK:
+                logger.warning(f"Base {wubctl.basenumber}: SEND_BATCH answered {resp['CMD_RC']}.")
+
+    def stop(self):
+        '''Make run() return; safe to call from another thread.'''
+        self._stop.set()
+
+    def _read(self, link: _wubReadoutLink, now: float):
+        try:
+            data = os.read(link.fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        if len(data) == 0:
+            return
+
+        metrics = link.wubctl.metrics
+        metrics.nreads += 1
+        metrics.bytes_recv += len(data)
+        link.wubctl.nbytes_recv += len(data)
+        self.nreads += 1
+
+        if link.npending == 0:
+            link.tfirst = now
+        link.chunks.append(data)
+        link.npending += len(data)
+
+    def _process(self, link: _wubReadoutLink):
+        '''Decode a base's pending data and hand the frames on.'''
+        data = link.chunks[0] if len(link.chunks) == 1 else b"".join(link.chunks)
+        link.chunks = []
+        link.npending = 0
+
+        wubctl = link.wubctl
+        frames = link.decoder.feed(data)
+        decoder = link.decoder
+        if decoder.nresyncs != link.nresyncs:
+            wubctl.metrics.resyncs += decoder.nresyncs - link.nresyncs
+            link.nresyncs = decoder.nresyncs
+
+        nframes = len(frames)
+        if nframes == 0:
+            return
+        tarrival = time.time()
+        wubctl.nframes_binary += nframes
+        wubctl.metrics.frames += nframes
+
+        if self._merged is not None or link.datafile is not None:
+            packed = records.pack_records(frames, wubctl.basenumber, tarrival)
+            if self._merged is not None:
+                if self._merged_write_frames is not None:
+                    self._merged_write_frames(packed, nframes, tarrival)
+                else:
+                    self._merged.write(packed)
+            elif link.write_frames is not None:
+                link.write_frames(packed, nframes, tarrival)
+            else:
+                link.datafile.write(packed)
+
+        for fn in wubctl._frame_listeners:
+            fn(frames, wubctl.basenumber, tarrival)
+
+    def _serve(self, timeout: float):
+        wait = self._tlast + self._min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        events = self._selector.select(timeout)
+        self.nselects += 1
+        now = self._tlast = time.monotonic()
+        for key, _ in events:
+            self._read(key.data, now)
+
+        for link in self._links.values():
+            if link.npending >= self._batch_bytes or \
+                    (link.npending > 0 and now - link.tfirst >= self._max_latency):
+                self._process(link)
+
+    def run(self, duration: float = None) -> dict:
+        '''Serve all links until stop() is called or `duration` seconds have passed, then stop the batches.
+
+        Returns:
+            dict: Per base, bytes and frames received and decoder resyncs.
+        '''
+        self._stop.clear()
+        self.tstart = time.time()
+        deadline = None if duration is None or duration <= 0 else time.monotonic() + duration
+        while not self._stop.is_set():
+            timeout = self._select_timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                timeout = min(timeout, remaining)
+            self._serve(timeout)
+
+        self.stop_batches()
+        self.tstop = time.time()
+        return self.summary()
+
+    def stop_batches(self):
+        '''Stop every base at once, keep what is already in flight, then check each link answers.'''
+        ok = wubCMD_catalog.ok.build('b')
+        for link in self._links.values():
+            link.wubctl.send(ok)
+
+        # Frames sent before the stop are still kept; the trailing bytes are discarded.
+        deadline = time.monotonic() + self._stop_wait
+        while time.monotonic() < deadline:
+            self._serve(min(self._select_timeout, max(0.0, deadline - time.monotonic())))
+        for link in self._links.values():
+            if link.npending > 0:
+                self._process(link)
+            if link.decoder.pending > 0:
+                logger.debug(f"Base {link.wubctl.basenumber}: {link.decoder.pending} bytes after the last frame discarded.")
+            link.decoder.reset()
+            link.wubctl._s.reset_input_buffer()
+
+        for link in self._links.values():
+            wubctl = link.wubctl
+            resp = wubctl.cmd_ok()['response']
+            if resp['CMD_RC'] != wubCMD_RC.CMD_RC_OK:
+                logger.warning(f"Base {wubctl.basenumber}: no clean answer after the stop ({resp}).")
+            wubctl._batch_finished()
+
+    def summary(self) -> dict:
+        return {link.wubctl.basenumber: dict(nbytes=link.wubctl.nbytes_recv, frames=link.wubctl.nframes_binary,
+                                             resyncs=link.decoder.nresyncs)
+                for link in self._links.values()}
+
+    def close(self):
+        self._selector.close()
+        self._links = {}
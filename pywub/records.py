@@ -0,0 +1,147 @@
+'''
+Self-framed record files written by the 'frame' and 'ring' store modes.
+
+Each record is a fixed 16 byte header followed by `length` bytes of frame data
+(the wire frame without its start byte, i.e. what parser.unpack_header expects):
+
+    magic      2s   b"WB"
+    rec_type   B    RECORD_TYPE_*
+    base       B    wuBase number
+    timestamp  d    host arrival time (seconds since the epoch)
+    length     I    number of frame bytes that follow
+
+All fields are little-endian. Because every record carries its own length and
+timestamp, files can be indexed with a single pass over the headers and several
+bases' files can be merged by timestamp without decoding the frames.
+'''
+
+from __future__ import annotations
+
+import heapq
+import struct
+from typing import BinaryIO, Iterator
+from dataclasses import dataclass
+
+
+RECORD_MAGIC = b"WB"
+
+RECORD_TYPE_HIT = 1
+
+RECORD_HEADER = struct.Struct("<2sBBdI")
+RECORD_HEADER_SIZE = RECORD_HEADER.size
+
+# Preallocated space not yet written (an unclosed segment, see pywub.segments)
+# reads as zeros; a zero header marks the end of the data.
+_ZERO_HEADER = bytes(RECORD_HEADER_SIZE)
+
+
+@dataclass
+class wubRecord:
+    rec_type: int
+    base: int
+    timestamp: float
+    data: bytes
+    offset: int = None
+
+
+def pack_record(data: bytes, base: int, timestamp: float, rec_type: int = RECORD_TYPE_HIT) -> bytes:
+    return RECORD_HEADER.pack(RECORD_MAGIC, rec_type, base, timestamp, len(data)) + data
+
+
+def pack_records(frames: list[bytes], base: int, timestamp: float, rec_type: int = RECORD_TYPE_HIT) -> bytes:
+    '''Pack a batch of frames that arrived together into one buffer for a single write.'''
+    pack = RECORD_HEADER.pack
+    parts = []
+    for frame in frames:
+        parts.append(pack(RECORD_MAGIC, rec_type, base, timestamp, len(frame)))
+        parts.append(frame)
+    return b"".join(parts)
+
+
+def pack_records_into(out: bytearray, frames: list, base: int, timestamp: float,
+                      rec_type: int = RECORD_TYPE_HIT) -> int:
+    '''Like pack_records, but into a reusable buffer, which is grown when too small.
+
+    Returns:
+        int: Number of bytes of `out` used.
+    '''
+    size = RECORD_HEADER_SIZE * len(frames) + sum(map(len, frames))
+    if len(out) < size:
+        out.extend(bytes(size - len(out)))
+
+    pack_into = RECORD_HEADER.pack_into
+    pos = 0
+    # Copying into a memoryview is much faster than bytearray slice assignment.
+    with memoryview(out) as view:
+        for frame in frames:
+            n = len(frame)
+            pack_into(view, pos, RECORD_MAGIC, rec_type, base, timestamp, n)
+            pos += RECORD_HEADER_SIZE
+            view[pos:pos + n] = frame
+            pos += n
+    return pos
+
+
+def iter_records(f: BinaryIO) -> Iterator[wubRecord]:
+    '''Yield the records in an open file, stopping at EOF, at a truncated record or at zero padding.'''
+    offset = f.tell()
+    while True:
+        hdr = f.read(RECORD_HEADER_SIZE)
+        if len(hdr) < RECORD_HEADER_SIZE or hdr == _ZERO_HEADER:
+            return
+
+        magic, rec_type, base, timestamp, length = RECORD_HEADER.unpack(hdr)
+        if magic != RECORD_MAGIC:
+            raise ValueError(f"Bad record magic at offset {offset}: {magic}")
+
+        data = f.read(length)
+        if len(data) < length:
+            return
+
+        yield wubRecord(rec_type, base, timestamp, data, offset)
+        offset += RECORD_HEADER_SIZE + length
+
+
+def build_index(f: BinaryIO) -> list[tuple[int, float, int]]:
+    '''Return (offset, timestamp, length) for every record, reading only the headers.
+
+    Stops at EOF or at zero padding like iter_records(); a record cut short at
+    the end of the file is included.
+    '''
+    index = []
+    offset = f.tell()
+    while True:
+        hdr = f.read(RECORD_HEADER_SIZE)
+        if len(hdr) < RECORD_HEADER_SIZE or hdr == _ZERO_HEADER:
+            break
+
+        magic, rec_type, base, timestamp, length = RECORD_HEADER.unpack(hdr)
+        if magic != RECORD_MAGIC:
+            raise ValueError(f"Bad record magic at offset {offset}: {magic}")
+
+        index.append((offset, timestamp, length))
+        offset += RECORD_HEADER_SIZE + length
+        f.seek(offset)
+
+    return index
+
+
+def read_record(f: BinaryIO, offset: int) -> wubRecord:
+    f.seek(offset)
+    return next(iter_records(f))
+
+
+def merge_records(files: list[BinaryIO], out: BinaryIO) -> int:
+    '''Merge several record files into one, ordered by host timestamp.
+
+    Each input is assumed to be time ordered already, as written by a receiver.
+
+    Returns:
+        int: Number of records written.
+    '''
+    nrecords = 0
+    streams = [iter_records(f) for f in files]
+    for rec in heapq.merge(*streams, key=lambda r: r.timestamp):
+        out.write(pack_record(rec.data, rec.base, rec.timestamp, rec.rec_type))
+        nrecords += 1
+    return nrecords
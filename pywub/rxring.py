@@ -0,0 +1,163 @@
+'''
+Preallocated receive buffer for the 'ring' store mode.
+
+wubRxRing owns one bytearray, allocated once. Serial data are read straight
+into its free space (os.readv on the port's file descriptor, i.e. readinto),
+split into frames in place, and each frame is handed out as a memoryview slice
+of the buffer: no bytes objects are created per read or per frame.
+
+Frames never straddle the end of the buffer. When the free space at the end
+gets shorter than the largest possible frame, the incomplete frame at the
+read position (if any) is moved to the front and reading continues there.
+
+Release contract: the memoryviews returned by frames() stay valid only until
+release() is called. The receive loop calls release() once it has written the
+frames and run the frame listeners, so listeners that want to keep a frame
+must copy it (bytes(frame)). The buffer is only reused after release().
+'''
+
+from __future__ import annotations
+
+import os
+
+from . import parser
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_RX_RING_SIZE = 1 << 20
+
+
+class wubRxRing():
+    '''
+    Args:
+        capacity (int): Buffer size in bytes; at least two of the largest frames.
+        max_nsamples (int): Frames claiming more samples are treated as corrupt, as in FrameDecoder.
+    '''
+
+    def __init__(self, capacity: int = DEFAULT_RX_RING_SIZE, max_nsamples: int = parser.MAX_NSAMPLES):
+        self._max_nsamples = max_nsamples
+        self._max_frame = parser.START_BYTE_WIDTH + parser.calc_frame_size(max_nsamples)
+        if capacity < 2 * self._max_frame:
+            raise ValueError(f"A {capacity} byte ring cannot hold two {self._max_frame} byte frames.")
+
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._capacity = capacity
+        self._read = 0
+        self._write = 0
+        self._outstanding = False
+
+        self.nframes = 0
+        self.nresyncs = 0
+        self.nbytes_skipped = 0
+        self.nbytes = 0
+        self.nwraps = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def pending(self) -> int:
+        '''Bytes received but not yet returned as a frame.'''
+        return self._write - self._read
+
+    def reset(self):
+        self._read = 0
+        self._write = 0
+        self._outstanding = False
+
+    def _wrap(self):
+        '''Move the incomplete frame to the front of the buffer.'''
+        tail = self._write - self._read
+        if tail > 0:
+            if self._read >= tail:
+                self._view[0:tail] = self._view[self._read:self._write]
+            else:
+                self._buf[0:tail] = bytes(self._view[self._read:self._write])
+        self._read = 0
+        self._write = tail
+        self.nwraps += 1
+
+    def writable(self) -> memoryview:
+        '''The free space to read into; empty while frames are handed out and the ring must wrap.'''
+        if not self._outstanding:
+            if self._read == self._write:
+                self._read = self._write = 0
+            elif self._capacity - self._write < self._max_frame:
+                self._wrap()
+        elif self._capacity - self._write < self._max_frame:
+            return self._view[0:0]
+        return self._view[self._write:]
+
+    def commit(self, n: int):
+        '''Account for n bytes written into writable().'''
+        self._write += n
+        self.nbytes += n
+
+    def readinto_fd(self, fd: int) -> int:
+        '''Read what the (non-blocking) file descriptor has into the free space.
+
+        Returns:
+            int: Number of bytes read; 0 if there was nothing to read or no space.
+        '''
+        space = self.writable()
+        if len(space) == 0:
+            return 0
+        try:
+            n = os.readv(fd, (space,))
+        except BlockingIOError:
+            return 0
+        self.commit(n)
+        return n
+
+    def frames(self) -> list[memoryview]:
+        '''Split off every complete frame (without its start byte); valid until release().'''
+        buf = self._buf
+        view = self._view
+        pos = self._read
+        end = self._write
+        skip = parser.START_BYTE_WIDTH
+        header_end = skip + parser.NSAMPLES_WIDTH
+        start_byte = parser.START_BYTE
+        max_nsamples = self._max_nsamples
+        wide = parser.NSAMPLES_WIDTH == 2
+        # calc_frame_size is linear in nsamples; inlined.
+        fixed = parser.START_BYTE_WIDTH + parser.calc_frame_size(0)
+        per_sample = parser.calc_frame_size(1) - parser.calc_frame_size(0)
+
+        frames = []
+        while end - pos >= header_end:
+            if buf[pos] != start_byte:
+                nxt = buf.find(start_byte, pos + 1, end)
+                skip_to = end if nxt < 0 else nxt
+                self.nbytes_skipped += skip_to - pos
+                self.nresyncs += 1
+                pos = skip_to
+                continue
+
+            # Indexing the bytearray avoids the tuple struct.unpack_from would create.
+            nsamples = buf[pos + 1] | (buf[pos + 2] << 8) if wide else buf[pos + 1]
+            if nsamples > max_nsamples:
+                self.nbytes_skipped += 1
+                self.nresyncs += 1
+                pos += 1
+                continue
+
+            frame_end = pos + fixed + per_sample * nsamples
+            if frame_end > end:
+                break
+            frames.append(view[pos + skip:frame_end])
+            pos = frame_end
+
+        self._read = pos
+        if len(frames) > 0:
+            self._outstanding = True
+            self.nframes += len(frames)
+        return frames
+
+    def release(self):
+        '''Allow the space of the frames handed out so far to be reused.'''
+        self._outstanding = False
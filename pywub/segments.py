@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+from dataclasses import dataclass, asdict
+
+from . import records
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Writes to disk are issued in multiples of this many bytes.
+WRITE_ALIGNMENT = 4096
+
+
+@dataclass
+class wubSegment:
+    index: int
+    filename: str
+    nbytes: int = 0
+    nframes: int = 0
+    first_frame: int = None
+    last_frame: int = None
+    tstart: float = None
+    tstop: float = None
+
+
+def _write_manifest(filename: str, manifest: dict):
+    # Replaced atomically, so a reader never sees a partial manifest.
+    tmp = f"{filename}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, filename)
+
+
+def load_manifest(filename: str) -> list[wubSegment]:
+    with open(filename, 'r') as f:
+        manifest = json.load(f)
+    return [wubSegment(**seg) for seg in manifest['segments']]
+
+
+def recover_segment(path: str) -> int:
+    '''Truncate a record segment left preallocated by a crash to its last complete record.
+
+    Segments are only truncated when closed, so after a crash the last one ends
+    in zero padding. The record written last may have been cut short at a
+    WRITE_ALIGNMENT block, with its tail read back as zeros. Raw stream
+    segments ('bulk' store mode) cannot be told from their padding and are
+    left alone.
+
+    Returns:
+        int: The size of the segment after recovery.
+    '''
+    with open(path, "r+b") as f:
+        head = f.read(len(records.RECORD_MAGIC))
+        f.seek(0)
+        if head != records.RECORD_MAGIC and head != bytes(len(head)):
+            logger.warning(f"{path} is not a record file; not truncated.")
+            return os.fstat(f.fileno()).st_size
+        end = 0
+        for rec in records.iter_records(f):
+            end = rec.offset + records.RECORD_HEADER_SIZE + len(rec.data)
+        f.truncate(end)
+    return end
+
+
+def recover_manifest(manifest_filename: str) -> list[wubSegment]:
+    '''recover_segment() every segment of a manifest and record their sizes in it.
+
+    The frame and time ranges of a segment that was not closed are not known;
+    they are left as the manifest has them.
+    '''
+    with open(manifest_filename, 'r') as f:
+        manifest = json.load(f)
+    segments = [wubSegment(**seg) for seg in manifest['segments']]
+    directory = os.path.dirname(manifest_filename)
+    for seg in segments:
+        path = os.path.join(directory, seg.filename)
+        if os.path.exists(path):
+            seg.nbytes = recover_segment(path)
+    manifest['segments'] = [asdict(seg) for seg in segments]
+    _write_manifest(manifest_filename, manifest)
+    return segments
+
+
+class wubSegmentedWriter():
+    '''
+    File-like writer that splits a long acquisition into numbered segments.
+
+    "run.dat" becomes run.0000.dat, run.0001.dat, ... plus run.dat.manifest.json,
+    which lists each segment with its size, frame range and time range. A new
+    segment is started before a write() that would take the current one past
+    max_bytes, or once it is older than max_seconds, so each write() goes 
+    entirely into one segment. The 'frame' store mode writes whole records per
+    call (through write_frames()), which keeps segment boundaries frame aligned.
+
+    Data are collected in a buffer and written in multiples of WRITE_ALIGNMENT
+    bytes. Segments are preallocated with posix_fallocate when max_bytes is
+    known and truncated to their real size when closed. The manifest is
+    rewritten whenever a segment is opened or closed, so it lists every segment
+    on disk even after a crash; recover_manifest() then trims the padding of
+    the segment that was being written.
+
+    Args:
+        filename (str): Base output filename.
+        max_bytes (int): Rotate once a segment reaches this size (None for no limit).
+        max_seconds (float): Rotate once a segment is this old (None for no limit).
+        buffer_size (int): Bytes to collect before writing; rounded up to WRITE_ALIGNMENT.
+        fsync_interval (float): Seconds between fsyncs; 0 fsyncs after every write to
+            disk, None leaves flushing to the OS.
+        preallocate (bool): Reserve max_bytes on disk for each new segment.
+    '''
+
+    def __init__(self, filename: str, max_bytes: int = None, max_seconds: float = None,
+                 buffer_size: int = 1 << 20, fsync_interval: float = None, preallocate: bool = True):
+        self._filename = filename
+        self._stem, self._ext = os.path.splitext(filename)
+        self._manifest_filename = f"{filename}.manifest.json"
+
+        self._max_bytes = max_bytes if max_bytes is not None and max_bytes > 0 else None
+        self._max_seconds = max_seconds if max_seconds is not None and max_seconds > 0 else None
+        self._buffer_size = max(WRITE_ALIGNMENT, -(-buffer_size // WRITE_ALIGNMENT) * WRITE_ALIGNMENT)
+        self._fsync_interval = fsync_interval
+        self._preallocate = preallocate and self._max_bytes is not None and hasattr(os, "posix_fallocate")
+
+        self._buf = bytearray()
+        self._fd = None
+        self._segment = None
+        self._segment_opened = None
+        self._last_fsync = time.monotonic()
+        self._nframes_total = 0
+
+        self.segments = []
+        self.closed = False
+
+        self._open_segment()
+
+    def segment_filename(self, index: int) -> str:
+        return f"{self._stem}.{index:04d}{self._ext}"
+
+    @property
+    def current_segment(self) -> wubSegment:
+        return self._segment
+
+    def _open_segment(self):
+        index = len(self.segments)
+        path = self.segment_filename(index)
+        # The manifest sits next to the segments, so it records bare filenames.
+        seg = wubSegment(index=index, filename=os.path.basename(path))
+
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        if self._preallocate:
+            try:
+                os.posix_fallocate(self._fd, 0, self._max_bytes)
+            except OSError as e:
+                logger.warning(f"posix_fallocate failed for {path}: {e}; continuing without preallocation.")
+                self._preallocate = False
+
+        self._segment = seg
+        self._segment_opened = time.monotonic()
+        self.segments.append(seg)
+        self.write_manifest()
+        logger.info(f"Opened output segment {path}")
+
+    def _close_segment(self):
+        self._flush_buffer(everything=True)
+        if self._preallocate:
+            os.ftruncate(self._fd, self._segment.nbytes)
+        if self._fsync_interval is not None:
+            os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        self.write_manifest()
+
+    def _needs_rotation(self, nincoming: int) -> bool:
+        seg = self._segment
+        if seg.nbytes == 0:
+            return False
+        if self._max_bytes is not None and seg.nbytes + nincoming > self._max_bytes:
+            return True
+        if self._max_seconds is not None and time.monotonic() - self._segment_opened >= self._max_seconds:
+            return True
+        return False
+
+    def rotate(self):
+        self._close_segment()
+        self._open_segment()
+
+    def _flush_buffer(self, everything: bool = False):
+        buf = self._buf
+        n = len(buf) if everything else (len(buf) // WRITE_ALIGNMENT) * WRITE_ALIGNMENT
+        if n == 0:
+            return
+
+        view = memoryview(buf)
+        written = 0
+        while written < n:
+            written += os.write(self._fd, view[written:n])
+        view.release()
+        del buf[:n]
+
+        if self._fsync_interval is not None:
+            now = time.monotonic()
+            if now - self._last_fsync >= self._fsync_interval:
+                os.fsync(self._fd)
+                self._last_fsync = now
+
+    def write(self, data: bytes) -> int:
+        return self.write_frames(data, 0, None)
+
+    def write_frames(self, data: bytes, nframes: int, timestamp: float = None) -> int:
+        '''Write data holding nframes complete frames that arrived at timestamp.'''
+        if self._needs_rotation(len(data)):
+            self.rotate()
+
+        seg = self._segment
+        timestamp = time.time() if timestamp is None else timestamp
+        if seg.tstart is None:
+            seg.tstart = timestamp
+        seg.tstop = timestamp
+
+        if nframes > 0:
+            if seg.first_frame is None:
+                seg.first_frame = self._nframes_total
+            self._nframes_total += nframes
+            seg.last_frame = self._nframes_total - 1
+            seg.nframes += nframes
+
+        seg.nbytes += len(data)
+        self._buf += data
+        if len(self._buf) >= self._buffer_size:
+            self._flush_buffer()
+
+        return len(data)
+
+    def flush(self):
+        '''Hand buffered data to the OS. Only whole WRITE_ALIGNMENT blocks are written.'''
+        self._flush_buffer()
+
+    def write_manifest(self):
+        manifest = dict(filename=self._filename,
+                        max_bytes=self._max_bytes, max_seconds=self._max_seconds,
+                        segments=[asdict(seg) for seg in self.segments])
+        _write_manifest(self._manifest_filename, manifest)
+
+    def close(self):
+        if self.closed:
+            return
+        self._close_segment()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
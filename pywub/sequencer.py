@@ -0,0 +1,225 @@
+'''
+Setup sequencing without fixed sleeps.
+
+Most setup commands take effect by the time the device answers them, so the
+sequencer moves straight on. The few that need time to settle have a
+wubSettlePolicy describing how to tell that the device is ready: which readback
+to poll and when its answer means "settled". Polls start quickly and back off
+exponentially up to a deadline. Rejected commands are retried with jittered
+exponential backoff. Every step is timed, so the report shows which commands
+dominate the setup time (the critical path).
+'''
+
+from __future__ import annotations
+
+import time
+import random
+from dataclasses import dataclass, field
+from typing import Callable
+
+from .catalog import ctlg as wubCMD_catalog
+from .catalog import wubCMD_entry, parse_setup_config, mask_to_base_numbers
+from .control import parse_response
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class wubSettlePolicy:
+    '''How to wait for a command to take effect.
+
+    The probe commands are polled until ready(values, args) returns True for
+    nconsecutive polls in a row or timeout seconds have passed; values are the
+    retargs of all probes concatenated. min_delay is waited before the first poll.
+    '''
+    probes: list[wubCMD_entry]
+    ready: Callable[[list, list], bool]
+    timeout: float = 5.0
+    min_delay: float = 0.0
+    nconsecutive: int = 1
+
+
+def _responsive(values: list, args: list) -> bool:
+    return True
+
+
+def hv_settled(tolerance: float = 0.02, absolute: float = 0.0) -> Callable[[list, list], bool]:
+    '''Ready once the feedback loop's measured value (GET_FB_MEASURED) is within 
+    tolerance (relative) or absolute of its target (GET_FB_TARGET).'''
+    def ready(values: list, args: list) -> bool:
+        if len(values) < 2 or not all(isinstance(v, float) for v in values[0:2]):
+            return False
+        target, measured = values[0:2]
+        return abs(measured - target) <= max(tolerance * abs(target), absolute)
+    return ready
+
+
+# FPGALOAD and ADCCONFIG keep the MCU busy until the FPGA/ADC are configured;
+# the next command is only accepted once it is done. HV changes ramp, so the
+# feedback loop's measured value is followed until it reaches the target.
+_HV_PROBES = [wubCMD_catalog.get_fb_target, wubCMD_catalog.get_fb_measured]
+
+SETTLE_POLICIES = {
+    "FPGALOAD": wubSettlePolicy([wubCMD_catalog.ok], _responsive, timeout=5.0),
+    "ADCCONFIG": wubSettlePolicy([wubCMD_catalog.ok], _responsive, timeout=5.0),
+    "VOLTAGE": wubSettlePolicy(_HV_PROBES, hv_settled(), timeout=30.0, nconsecutive=2),
+    "FRACTION": wubSettlePolicy(_HV_PROBES, hv_settled(), timeout=30.0, nconsecutive=2),
+    "PWMSTART": wubSettlePolicy(_HV_PROBES, hv_settled(), timeout=30.0, nconsecutive=2),
+}
+
+
+@dataclass
+class wubSetupStep:
+    name: str
+    args: list
+    attempts: int = 0
+    ok: bool = False
+    settled: bool = None        # None when the command needs no settling
+    npolls: int = 0
+    t_command: float = 0.0
+    t_settle: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return self.t_command + self.t_settle
+
+
+@dataclass
+class wubSetupReport:
+    base: int
+    steps: list = field(default_factory=list)
+    tstart: float = None
+    tstop: float = None
+
+    @property
+    def duration(self) -> float:
+        return 0.0 if self.tstart is None or self.tstop is None else self.tstop - self.tstart
+
+    @property
+    def ok(self) -> bool:
+        return all(step.ok and step.settled is not False for step in self.steps)
+
+    def critical_path(self, n: int = 5) -> list[wubSetupStep]:
+        '''The n steps that took longest.'''
+        return sorted(self.steps, key=lambda s: s.duration, reverse=True)[0:n]
+
+    def format(self, n: int = 5) -> str:
+        lines = [f"Base {self.base}: setup took {self.duration:.3f} s over {len(self.steps)} commands."]
+        total = self.duration if self.duration > 0 else 1.0
+        for step in self.critical_path(n):
+            settle = "" if step.settled is None else f", settle {step.t_settle*1e3:7.1f} ms ({step.npolls} polls)"
+            lines += [f"  {step.name:20s} {step.duration*1e3:8.1f} ms ({100*step.duration/total:5.1f}%)"
+                      f" -- command {step.t_command*1e3:7.1f} ms x{step.attempts}{settle}"]
+        return "\n".join(lines)
+
+
+class wubSetupSequencer():
+    '''
+    Args:
+        wubctl (wubCTL): Link to run the setup on.
+        policies (dict): Settle policy per command name (defaults to SETTLE_POLICIES).
+        max_retries (int): Resends of a rejected command.
+        retry_base (float): Backoff before the first retry; doubles per retry, with full jitter.
+        retry_max (float): Longest wait between retries.
+        poll_initial (float): First interval between readiness polls.
+        poll_max (float): Longest interval between readiness polls.
+    '''
+
+    def __init__(self, wubctl, policies: dict = None, max_retries: int = 10,
+                 retry_base: float = 0.02, retry_max: float = 1.0,
+                 poll_initial: float = 0.005, poll_max: float = 0.5):
+        self._wubctl = wubctl
+        self._policies = SETTLE_POLICIES if policies is None else policies
+        self._max_retries = max_retries
+        self._retry_base = retry_base
+        self._retry_max = retry_max
+        self._poll_initial = poll_initial
+        self._poll_max = poll_max
+
+    def _retry_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self._retry_max, self._retry_base * (2 ** attempt)))
+
+    def _settle(self, step: wubSetupStep, policy: wubSettlePolicy, timeout: float):
+        tstart = time.perf_counter()
+        deadline = tstart + timeout
+        interval = self._poll_initial
+        nready = 0
+
+        if policy.min_delay > 0:
+            time.sleep(policy.min_delay)
+
+        while True:
+            step.npolls += 1
+            ok, values = True, []
+            for probe in policy.probes:
+                probe_ok, probe_values = parse_response(probe, self._wubctl.send_recv(probe, fresh=True))
+                ok = ok and probe_ok
+                values += probe_values
+            if ok and policy.ready(values, step.args):
+                nready += 1
+                if nready >= policy.nconsecutive:
+                    step.settled = True
+                    break
+            else:
+                nready = 0
+
+            now = time.perf_counter()
+            if now >= deadline:
+                step.settled = False
+                logger.warning(f"{step.name} did not settle within {timeout:.1f} s.")
+                break
+            time.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, self._poll_max)
+
+        step.t_settle = time.perf_counter() - tstart
+
+    def run_step(self, name: str, args: list = None, timeout: float = None) -> wubSetupStep:
+        '''Send one command, retrying if rejected, and wait for it to settle if it needs to.
+
+        Args:
+            timeout (float): Longest settle time; defaults to the policy's timeout.
+        '''
+        name = name.upper()
+        args = list(args) if args is not None else []
+        command = wubCMD_catalog.get_command(name)
+        step = wubSetupStep(name, args)
+
+        tstart = time.perf_counter()
+        while True:
+            step.attempts += 1
+            step.ok, _ = parse_response(command, self._wubctl.send_recv(command, *args))
+            if step.ok or step.attempts > self._max_retries:
+                break
+            delay = self._retry_delay(step.attempts - 1)
+            logger.warning(f"{name} {args} was rejected; retrying in {delay*1e3:.0f} ms "
+                           f"({step.attempts}/{self._max_retries}).")
+            time.sleep(delay)
+        step.t_command = time.perf_counter() - tstart
+
+        if not step.ok:
+            logger.error(f"{name} {args} still rejected after {self._max_retries} retries.")
+            return step
+
+        policy = self._policies.get(name)
+        if policy is not None:
+            self._settle(step, policy, policy.timeout if timeout is None else timeout)
+        return step
+
+    def run(self, setup: list[dict], stop_on_error: bool = True) -> wubSetupReport:
+        '''Run parse_setup_config() entries; the config sleeptimes are not used.'''
+        report = wubSetupReport(self._wubctl.basenumber)
+        report.tstart = time.perf_counter()
+        for line in setup:
+            if line.get('mask') is not None and self._wubctl.basenumber not in mask_to_base_numbers(line['mask']):
+                continue
+            step = self.run_step(line['name'], line['args'])
+            report.steps += [step]
+            logger.info(f"{step.name} {step.args}: {'OK' if step.ok else 'FAILED'} in {step.duration*1e3:.1f} ms")
+            if stop_on_error and not step.ok:
+                break
+        report.tstop = time.perf_counter()
+        return report
+
+    def run_config(self, filename: str = None, config: list[str] = None, stop_on_error: bool = True) -> wubSetupReport:
+        return self.run(parse_setup_config(filename, config)['setup'], stop_on_error)
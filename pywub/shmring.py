@@ -0,0 +1,255 @@
+'''
+Single-producer, multi-consumer ring buffer in POSIX shared memory.
+
+The producer (the DAQ receive thread) never waits for consumers: it keeps
+writing and advances a 64-bit byte counter, committing it after each message.
+Each consumer process attaches by name, keeps its own read position and reads
+at its own pace. Since the message being written can be up to half the ring
+long, a consumer more than half a ring behind may be reading data that is
+being overwritten; it counts the lost bytes and jumps forward to the live
+position. Slow or stalled consumers therefore never slow down the acquisition,
+and attaching more of them costs the producer nothing.
+
+Layout of the shared memory block:
+
+    [control: CONTROL_SIZE bytes][data: capacity bytes]
+
+    control = magic (8s), capacity (Q), write_pos (Q), nmessages (Q)
+
+Messages are 8-byte aligned and never straddle the end of the data area; when
+one does not fit, a WRAP_MARKER length is written and the message starts again
+at offset 0:
+
+    length (I), base (H), rec_type (H), timestamp (d), payload (length bytes)
+'''
+
+from __future__ import annotations
+
+import sys
+import time
+import struct
+from multiprocessing import shared_memory
+from dataclasses import dataclass
+
+from . import records
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+SHM_MAGIC = b"WUBRING1"
+
+CONTROL = struct.Struct("<8sQQQ")
+CONTROL_SIZE = 64
+WRITE_POS_OFFSET = 16
+NMESSAGES_OFFSET = 24
+
+MESSAGE_HEADER = struct.Struct("<IHHd")
+WRAP_MARKER = 0xFFFFFFFF
+
+_U64 = struct.Struct("<Q")
+_ALIGN = 8
+
+
+def _aligned(n: int) -> int:
+    return (n + _ALIGN - 1) & ~(_ALIGN - 1)
+
+
+@dataclass
+class wubShmMessage:
+    base: int
+    rec_type: int
+    timestamp: float
+    data: bytes
+
+
+class wubShmRingProducer():
+    '''
+    Publishing side of the ring. Create it in the DAQ process and attach it with
+    wubCTL.add_frame_listener(producer.publish_frames).
+
+    Args:
+        name (str): Shared memory name consumers attach to (None picks a random one).
+        capacity (int): Size of the data area in bytes (rounded to a multiple of 8).
+    '''
+
+    def __init__(self, name: str = None, capacity: int = 64 << 20):
+        capacity = _aligned(capacity)
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=CONTROL_SIZE + capacity)
+        self._buf = self._shm.buf
+        self._capacity = capacity
+
+        self._write_pos = 0
+        self._nmessages = 0
+        CONTROL.pack_into(self._buf, 0, SHM_MAGIC, capacity, 0, 0)
+
+        logger.info(f"Created shared memory ring '{self.name}' with {capacity} bytes.")
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def write_pos(self) -> int:
+        return self._write_pos
+
+    def _write(self, data, base: int, rec_type: int, timestamp: float):
+        size = _aligned(MESSAGE_HEADER.size + len(data))
+        if size > self._capacity // 2:
+            raise ValueError(f"Message of {len(data)} bytes is too large for a {self._capacity} byte ring.")
+
+        pos = self._write_pos
+        offset = pos % self._capacity
+        if offset + size > self._capacity:
+            # Mark the tail as unused and start again at the beginning.
+            struct.pack_into("<I", self._buf, CONTROL_SIZE + offset, WRAP_MARKER)
+            pos += self._capacity - offset
+            offset = 0
+
+        start = CONTROL_SIZE + offset
+        MESSAGE_HEADER.pack_into(self._buf, start, len(data), base, rec_type, timestamp)
+        start += MESSAGE_HEADER.size
+        self._buf[start:start + len(data)] = data
+
+        self._write_pos = pos + size
+        self._nmessages += 1
+
+    def _commit(self):
+        # Publish the new write position only after the payloads are in place.
+        _U64.pack_into(self._buf, WRITE_POS_OFFSET, self._write_pos)
+        _U64.pack_into(self._buf, NMESSAGES_OFFSET, self._nmessages)
+
+    def publish(self, data: bytes, base: int = 0, rec_type: int = records.RECORD_TYPE_HIT,
+                timestamp: float = None):
+        self._write(data, base, rec_type, time.time() if timestamp is None else timestamp)
+        self._commit()
+
+    def publish_frames(self, frames: list[bytes], base: int, timestamp: float):
+        '''Frame listener signature used by wubCTL.'''
+        for frame in frames:
+            self._write(frame, base, records.RECORD_TYPE_HIT, timestamp)
+            self._commit()
+
+    def close(self, unlink: bool = True):
+        self._buf = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class wubShmRingConsumer():
+    '''
+    Reading side of the ring; one per consumer process.
+
+    Consumers start at the live position. read() returns the next message, or
+    None if nothing new arrived before the timeout. If this consumer falls more
+    than half a ring behind, the skipped bytes are added to `nbytes_lost`,
+    `noverruns` is incremented and reading resumes at the live position.
+
+    Args:
+        name (str): Shared memory name given by the producer.
+        poll_interval (float): Sleep between checks while blocking in read().
+    '''
+
+    def __init__(self, name: str, poll_interval: float = 1e-3):
+        if sys.version_info >= (3, 13):
+            self._shm = shared_memory.SharedMemory(name=name, create=False, track=False)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name, create=False)
+            self._untrack()
+
+        self._buf = self._shm.buf
+        magic, capacity, write_pos, nmessages = CONTROL.unpack_from(self._buf, 0)
+        if magic != SHM_MAGIC:
+            raise ValueError(f"Shared memory '{name}' is not a wuBase ring.")
+
+        self._capacity = capacity
+        self._max_lag = capacity // 2
+        self._read_pos = write_pos
+        self._poll_interval = poll_interval
+
+        self.nmessages = 0
+        self.nbytes_lost = 0
+        self.noverruns = 0
+
+    def _untrack(self):
+        # Before Python 3.13 attaching registers the block with this process's
+        # resource tracker, which would unlink it (under the producer) at exit.
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        except Exception:
+            pass
+
+    def _write_pos(self) -> int:
+        return _U64.unpack_from(self._buf, WRITE_POS_OFFSET)[0]
+
+    @property
+    def lag(self) -> int:
+        '''Bytes published but not yet read by this consumer.'''
+        return self._write_pos() - self._read_pos
+
+    def _skip_to_live(self, write_pos: int):
+        self.nbytes_lost += write_pos - self._read_pos
+        self.noverruns += 1
+        self._read_pos = write_pos
+
+    def _try_read(self) -> wubShmMessage:
+        while True:
+            write_pos = self._write_pos()
+            if write_pos == self._read_pos:
+                return None
+            if write_pos - self._read_pos > self._max_lag:
+                self._skip_to_live(write_pos)
+                return None
+
+            offset = self._read_pos % self._capacity
+            start = CONTROL_SIZE + offset
+            length = struct.unpack_from("<I", self._buf, start)[0]
+            if length == WRAP_MARKER:
+                self._read_pos += self._capacity - offset
+                continue
+
+            length, base, rec_type, timestamp = MESSAGE_HEADER.unpack_from(self._buf, start)
+            begin = start + MESSAGE_HEADER.size
+            data = bytes(self._buf[begin:begin + length])
+
+            # The producer may have overwritten the message while it was copied.
+            write_pos = self._write_pos()
+            if write_pos - self._read_pos > self._max_lag:
+                self._skip_to_live(write_pos)
+                return None
+
+            self._read_pos += _aligned(MESSAGE_HEADER.size + length)
+            self.nmessages += 1
+            return wubShmMessage(base, rec_type, timestamp, data)
+
+    def read(self, block: bool = True, timeout: float = None) -> wubShmMessage:
+        msg = self._try_read()
+        if msg is not None or not block:
+            return msg
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while msg is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(self._poll_interval)
+            msg = self._try_read()
+        return msg
+
+    def read_all(self) -> list[wubShmMessage]:
+        '''Everything available right now, without blocking.'''
+        messages = []
+        msg = self._try_read()
+        while msg is not None:
+            messages.append(msg)
+            msg = self._try_read()
+        return messages
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
@@ -0,0 +1,802 @@
+'''
+Virtual wuBase on a pseudo-terminal, for testing without hardware.
+
+wubSimulator opens a pty pair and answers on the master side as a wuBase
+would. The slave side (wubSimulator.port) is an ordinary tty path, so wubCTL,
+run_wub_daq.py and the other scripts talk to it unchanged:
+
+    sim = wubSimulator(rate=2000, nsamples=(16, 64))
+    sim.start()
+    wubctl = wubCTL(sim.port, ...)
+
+The device boots in ASCII autobaud mode and implements the catalog commands in
+ASCII and COBS binary framing with the wubCMD_RC codes and retargs packing of
+the firmware. Commands without a model of their own are accepted, remembered
+in `settings`, and answer zeros for their retargs. SEND_BATCH streams frames
+(START_BYTE, packed header, two interleaved ADC channels) for hits generated at
+`rate` per second; TESTPACKETS switches the stream to the test pattern of
+test_frame(). The stream is limited to the wire rate of the current baud
+rate unless throttling is turned off.
+
+Faults can be injected into the frame stream (corrupt_rate: bit flips per
+byte, drop_rate: dropped spans per byte) and into the link itself
+(clock_error: relative error of the device UART clock). A fixed baud rate the
+host does not match to within uart_tolerance garbles everything in both
+directions, as a real mismatch would.
+'''
+
+from __future__ import annotations
+
+import os
+import re
+import sys
+import tty
+import math
+import time
+import array
+import random
+import select
+import struct
+import termios
+import threading
+
+from cobs import cobs
+
+from . import parser
+from .linktest import test_frame
+from .catalog import ctlg as wubCMD_catalog
+from .catalog import wubCMD_entry, wubCMD_RC
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# UART input clock of the MCU; CHECK_PROPOSED_BAUD reports the nearest rate it can divide down to.
+SIM_UART_CLOCK = 13000000
+SIM_MAX_BAUD = 3000000
+# FPGA timestamp clock.
+SIM_FPGA_CLOCK = 60000000
+SIM_ADC_BASELINE = 1800
+SIM_ADC_MAX = 4095
+
+# Frames are queued only while less than this much wire time (or, unthrottled,
+# this many bytes) is waiting to go out, so a stop request takes effect after
+# about the frame in flight.
+_TX_QUEUE_TIME = 0.005
+_TX_LOW_WATER = 4096
+# Incomplete binary commands are discarded after this long without new bytes.
+_RX_STALE_TIMEOUT = 0.2
+
+_COMMAND_PREFIX = cobs.encode(b"\x00\x00\x30")[0:2]
+_MAX_COMMAND_SIZE = max(len(cobs.encode(c.header + bytes(c.args_struct.size)))
+                        for c in wubCMD_catalog.name_dict.values())
+
+# Linux termios2 access, to read the (possibly non-standard) rate the host set.
+_TCGETS2 = 0x802C542A
+_BOTHER = 0o010000
+_STANDARD_SPEEDS = {getattr(termios, f"B{rate}"): rate
+                    for rate in [9600, 19200, 38400, 57600, 115200, 230400, 460800, 500000, 576000,
+                                 921600, 1000000, 1152000, 1500000, 2000000, 2500000, 3000000]
+                    if hasattr(termios, f"B{rate}")}
+
+
+def _format_items(fmt: str) -> list[str]:
+    '''Split a struct format into one code per value ("30sb" -> ["30s", "b"]).'''
+    items = []
+    for count, code in re.findall(r"(\d*)([a-zA-Z?])", fmt):
+        if code in "sp":
+            items += [f"{count}{code}"]
+        else:
+            items += [code] * (int(count) if count else 1)
+    return items
+
+
+def achievable_baud(rate: int, clock: int = SIM_UART_CLOCK) -> int:
+    '''The rate the UART actually runs at when asked for `rate`.'''
+    if rate <= 0:
+        return 0
+    return int(round(clock / max(1, round(clock / rate))))
+
+
+def pack_frame(nsamples: int, hit_number: int, timestamp: int, tdc: int, payload: bytes) -> bytes:
+    '''START_BYTE followed by the close-packed header (48-bit timestamp) and the payload.'''
+    header = struct.pack("<HHQQ", nsamples, hit_number & 0xFFFF, timestamp & 0xFFFFFFFFFFFF, tdc)
+    return bytes([parser.START_BYTE]) + header[0:parser.FPGA_TS_OFFSET + parser.FPGA_TS_WIDTH] + header[12:] + payload
+
+
+class wubSimulator():
+    '''
+    Args:
+        basenumber (int): Base number; also goes into the default UID.
+        rate (float): Hits generated per second.
+        nsamples: Samples per hit: an int, a (min, max) range or a callable taking a random.Random.
+        memory_hits (int): Hits the device buffers before dropping new ones.
+        throttle (bool): Limit the stream to the wire rate of the baud rate (10 bits per byte).
+        corrupt_rate (float): Probability per streamed byte of a bit flip.
+        drop_rate (float): Probability per streamed byte that a span of bytes is dropped.
+        drop_length (int): Longest dropped span.
+        clock_error (float): Relative error of the device UART clock (e.g. 0.05).
+        uart_tolerance (float): Largest rate error the UARTs tolerate.
+        hv_tau (float): Time constant of the HV feedback loop in seconds.
+        scan_time (float): Seconds a scan or CAL10 takes.
+        delays (dict): Seconds the device blocks before answering, per command name.
+        seed (int): Random seed, for reproducible streams.
+    '''
+
+    def __init__(self, basenumber: int = 0, rate: float = 1000.0, nsamples=(8, 64),
+                 memory_hits: int = 4096, throttle: bool = True,
+                 corrupt_rate: float = 0.0, drop_rate: float = 0.0, drop_length: int = 16,
+                 clock_error: float = 0.0, uart_tolerance: float = 0.035,
+                 hv_tau: float = 0.2, scan_time: float = 2.0, delays: dict = None, seed: int = None):
+        self.basenumber = basenumber
+        self.rate = rate
+        self.nsamples = nsamples
+        self.memory_hits = memory_hits
+        self.throttle = throttle
+        self.corrupt_rate = corrupt_rate
+        self.drop_rate = drop_rate
+        self.drop_length = drop_length
+        self.clock_error = clock_error
+        self.uart_tolerance = uart_tolerance
+        self.hv_tau = hv_tau
+        self.scan_time = scan_time
+        self.delays = {} if delays is None else {name.upper(): delay for name, delay in delays.items()}
+        self.uid = (0x57554200 | (basenumber & 0xFF), 0x51A7 + basenumber, 0xC0FFEE)
+
+        self._rng = random.Random(seed)
+        self._waveforms = {}
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+
+        self.reset()
+        self.reset_counters()
+
+    # ---- State ----
+
+    def reset(self):
+        '''Power-on state: ASCII, autobaud, nothing configured, no hits buffered.'''
+        self.comms_mode = "ASCII"
+        self.autobaud = True
+        self.baud = None
+        self.verbose = 0
+        self.settings = {}
+
+        self._inbuf = bytearray()
+        self._outbuf = bytearray()
+        self._tlast_rx = time.monotonic()
+
+        self._tboot = time.monotonic()
+        self._tlast_hits = self._tboot
+        self._hit_credit = 0.0
+        self.nhits_buffered = 0
+        self._hit_number = 0
+        self._test_nsamples = None
+        self._test_index = 0
+        self._batch = None
+
+        self._hv_target = 0.0
+        self._hv_measured = 0.0
+        self._tlast_hv = self._tboot
+        self._scan_done = None
+        self._cal10_done = None
+
+        self._twire = self._tboot
+        self._wire_credit = 0.0
+        self._next_corrupt = self._countdown(self.corrupt_rate)
+        self._next_drop = self._countdown(self.drop_rate)
+
+    def reset_counters(self):
+        self.uart_log = dict(nbytes_rx=0, ncmds_rx=0, framing=0, overrun=0, parity=0, cobs=0, invalid=0)
+        self.nechoes = 0
+        self.nhits_sent = 0
+        self.nbytes_sent = 0
+        self.nhits_overflow = 0
+        self.nbits_corrupted = 0
+        self.nbytes_dropped = 0
+        self.ncommands = {}
+
+    def stats(self) -> dict:
+        return dict(port=self.port, comms_mode=self.comms_mode, autobaud=self.autobaud, baud=self.baud,
+                    hits_sent=self.nhits_sent, bytes_sent=self.nbytes_sent, hits_buffered=self.nhits_buffered,
+                    hits_overflow=self.nhits_overflow, bits_corrupted=self.nbits_corrupted,
+                    bytes_dropped=self.nbytes_dropped, uart_log=dict(self.uart_log))
+
+    def _countdown(self, rate: float) -> float:
+        return self._rng.expovariate(rate) if rate > 0 else math.inf
+
+    # ---- Link ----
+
+    def host_baud(self) -> int:
+        '''The baud rate the host has set on its end of the pty, or None if it can't be read.'''
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            import fcntl
+            buf = array.array('i', [0] * 64)
+            fcntl.ioctl(self._slave, _TCGETS2, buf)
+            if buf[2] & termios.CBAUD == _BOTHER:
+                return buf[10]
+            return _STANDARD_SPEEDS.get(termios.tcgetattr(self._slave)[5])
+        except (OSError, ImportError):
+            return None
+
+    def device_baud(self) -> float:
+        '''The rate the device UART actually runs at, or None in autobaud (it follows the host).'''
+        if self.autobaud or self.baud is None:
+            return None
+        return achievable_baud(self.baud) * (1 + self.clock_error)
+
+    def mismatched(self) -> bool:
+        device, host = self.device_baud(), self.host_baud()
+        if device is None or not host:
+            return False
+        return abs(device / host - 1) > self.uart_tolerance
+
+    def _garble(self, data: bytes) -> bytes:
+        return bytes(self._rng.getrandbits(8) for _ in range(len(data)))
+
+    def _emit(self, data: bytes):
+        '''Queue bytes for the host, garbled if the baud rates don't match.'''
+        if self.mismatched():
+            data = self._garble(data)
+        self._outbuf += data
+
+    def _wire_rate(self) -> float:
+        '''Bytes per second the link carries (8N1), or None if unknown.'''
+        rate = self.host_baud() if self.autobaud else self.device_baud()
+        return rate / 10 if rate else None
+
+    # ---- Commands ----
+
+    def _receive(self, data: bytes):
+        self.uart_log['nbytes_rx'] += len(data)
+        if self.mismatched():
+            self.uart_log['framing'] += len(data)
+            data = self._garble(data)
+        self._inbuf += data
+        self._tlast_rx = time.monotonic()
+        if self.comms_mode == "ASCII":
+            self._receive_ascii()
+        else:
+            self._receive_binary()
+
+    def _receive_ascii(self):
+        while True:
+            end = self._inbuf.find(b"\n")
+            if end < 0:
+                return
+            line = bytes(self._inbuf[0:end]).strip(b"\r")
+            del self._inbuf[0:end + 1]
+            if self.autobaud:
+                # Autobaud measures the rate on a leading 'U'.
+                if not line.startswith(b"U"):
+                    self._emit(b"?\n")
+                    continue
+                line = line[1:]
+            try:
+                tokens = line.decode().split()
+            except UnicodeDecodeError:
+                tokens = []
+            if len(tokens) == 0:
+                self.uart_log['invalid'] += 1
+                self._emit(b"?\n")
+                continue
+            self._execute_ascii(tokens[0].upper(), tokens[1:])
+
+    def _decode_command(self, start: int):
+        '''Decode a command starting at inbuf[start]; returns (command, args, length) or None.
+
+        There is no delimiter: prefixes are decoded until one gives a known command
+        with the number of argument bytes it expects.
+        '''
+        for n in range(2, min(len(self._inbuf) - start, _MAX_COMMAND_SIZE) + 1):
+            try:
+                decoded = cobs.decode(bytes(self._inbuf[start:start + n]))
+            except cobs.DecodeError:
+                continue
+            if len(decoded) < 4 or decoded[0:2] != b"\x00\x00":
+                continue
+            command = wubCMD_catalog.id_dict.get(struct.unpack("!H", decoded[2:4])[0])
+            if command is not None and len(decoded) == 4 + command.args_struct.size:
+                return command, decoded[4:], n
+        return None
+
+    def _receive_binary(self):
+        while len(self._inbuf) > 0:
+            if self.autobaud and self._inbuf[0] == ord('U'):
+                del self._inbuf[0]
+                continue
+
+            # Commands start with the encoded zero service bytes (0x01 0x01);
+            # anything before the first decodable command is line noise.
+            start = self._inbuf.find(_COMMAND_PREFIX)
+            while start >= 0:
+                found = self._decode_command(start)
+                if found is not None:
+                    break
+                start = self._inbuf.find(_COMMAND_PREFIX, start + 1)
+            if start < 0:
+                if len(self._inbuf) >= _MAX_COMMAND_SIZE:
+                    self.uart_log['cobs'] += 1
+                    del self._inbuf[0:len(self._inbuf) - _MAX_COMMAND_SIZE + 1]
+                return
+
+            command, packed_args, n = found
+            if start > 0:
+                self.uart_log['cobs'] += 1
+            del self._inbuf[0:start + n]
+            self._execute_binary(command, packed_args)
+
+    def _execute_ascii(self, name: str, tokens: list[str]):
+        command = wubCMD_catalog.name_dict.get(name)
+        if command is None:
+            self.uart_log['invalid'] += 1
+            self._reject(f"unknown command {name}")
+            return
+
+        items = _format_items(command.args)
+        if len(tokens) != len(items):
+            self._reject(wubCMD_RC.CMD_RC_INVALID_ARGUMENT_COUNT.name)
+            return
+        args = []
+        try:
+            for code, token in zip(items, tokens):
+                if code[-1] in "efd":
+                    args += [float(token)]
+                elif code[-1] in "sp":
+                    args += [token.encode()]
+                else:
+                    value = float(token) if re.fullmatch(r"[-+]?[0-9.]+([eE][-+]?\d+)?", token) else int(token, 0)
+                    if value != int(value):
+                        raise ValueError(token)
+                    args += [int(value)]
+            struct.pack(f"!{command.args}", *args)
+        except ValueError:
+            self._reject(wubCMD_RC.CMD_RC_INVALID_NUMBER.name)
+            return
+        except struct.error:
+            self._reject(wubCMD_RC.CMD_RC_OUT_OF_RANGE.name)
+            return
+
+        rc, values = self._execute(command, args)
+        if rc != wubCMD_RC.CMD_RC_OK:
+            self._reject(wubCMD_RC(rc).name)
+        else:
+            if len(values) > 0:
+                self._emit((" ".join(self._format_value(v) for v in values) + "\n").encode())
+            # SEND_BATCH ends its own response once the batch is done.
+            if command != wubCMD_catalog.send_batch:
+                self._emit(b"OK\n")
+        self._after(command, args, rc)
+
+    def _reject(self, reason: str):
+        logger.debug(f"Rejected: {reason}")
+        self._emit(b"?\n")
+
+    @staticmethod
+    def _format_value(value) -> str:
+        if isinstance(value, bytes):
+            return value.rstrip(b"\x00").decode(errors='replace').replace(" ", "_") or "-"
+        if isinstance(value, float):
+            return f"{value:.6f}"
+        return f"{value}"
+
+    def _execute_binary(self, command: wubCMD_entry, packed_args: bytes):
+        args = list(command.args_struct.unpack(packed_args))
+        rc, values = self._execute(command, args)
+        retargs = b""
+        if command.retargs_size > 0:
+            if rc != wubCMD_RC.CMD_RC_OK:
+                values = self._zeros(command)
+            retargs = command.retargs_struct.pack(*values)
+        if self.verbose > 0:
+            self._emit(f"{command.name} {' '.join(str(a) for a in args)}\n".encode())
+        self._emit(retargs + bytes([rc]))
+        self._after(command, args, rc)
+
+    @staticmethod
+    def _zeros(command: wubCMD_entry) -> list:
+        return [b"" if code[-1] in "sp" else 0.0 if code[-1] in "efd" else 0
+                for code in _format_items(command.retargs)]
+
+    def _execute(self, command: wubCMD_entry, args: list) -> tuple[int, list]:
+        '''Run a command; returns (CMD_RC, retargs).'''
+        self.uart_log['ncmds_rx'] += 1
+        self.ncommands[command.name] = self.ncommands.get(command.name, 0) + 1
+
+        # Any command ends a running batch.
+        if self._batch is not None and command != wubCMD_catalog.send_batch:
+            self._end_batch(terminate=False)
+
+        if command.name in self.delays:
+            # The MCU is busy; nothing else is served meanwhile.
+            time.sleep(self.delays[command.name])
+
+        handler = getattr(self, f"_cmd_{command.name.lower()}", None)
+        if handler is not None:
+            result = handler(*args)
+            rc, values = (result, []) if isinstance(result, int) else result
+        else:
+            rc, values = wubCMD_RC.CMD_RC_OK, self._zeros(command)
+        if rc == wubCMD_RC.CMD_RC_OK and len(command.args) > 0 and command.retargs_size == 0:
+            self.settings[command.name] = list(args)
+        logger.debug(f"{command.name} {args} -> {wubCMD_RC(rc).name} {values}")
+        return rc, values
+
+    def _after(self, command: wubCMD_entry, args: list, rc: int):
+        '''Link changes take effect after the response went out in the old framing and rate.'''
+        if rc != wubCMD_RC.CMD_RC_OK:
+            return
+        if command == wubCMD_catalog.asciimode:
+            self.comms_mode = "ASCII"
+            self._inbuf.clear()
+        elif command == wubCMD_catalog.binarymode:
+            self.comms_mode = "BINARY"
+            self._inbuf.clear()
+        elif command == wubCMD_catalog.baud:
+            if args[0] == -1:
+                self.autobaud, self.baud = True, None
+            else:
+                self.autobaud, self.baud = False, args[0]
+        elif command == wubCMD_catalog.reset_mcu:
+            outbuf = self._outbuf
+            self.reset()
+            self._outbuf = outbuf
+
+    # Command models. Each returns a CMD_RC, or (CMD_RC, retargs).
+
+    def _cmd_baud(self, rate):
+        if rate == -1 or 0 < rate <= SIM_MAX_BAUD:
+            return wubCMD_RC.CMD_RC_OK
+        return wubCMD_RC.CMD_RC_OUT_OF_RANGE
+
+    def _cmd_check_proposed_baud(self, rate):
+        if not 0 < rate <= SIM_MAX_BAUD:
+            return wubCMD_RC.CMD_RC_OUT_OF_RANGE, [0]
+        return wubCMD_RC.CMD_RC_OK, [achievable_baud(rate)]
+
+    def _cmd_verbose(self, level):
+        self.verbose = level
+        return wubCMD_RC.CMD_RC_OK
+
+    def _cmd_get_uid(self):
+        return wubCMD_RC.CMD_RC_OK, list(self.uid)
+
+    def _cmd_version(self):
+        return wubCMD_RC.CMD_RC_OK, [b"wubsim", 1, b"pywub", 0]
+
+    def _cmd_status(self):
+        return wubCMD_RC.CMD_RC_OK, [int(time.monotonic() - self._tboot),
+                                     int(self._hv_target > 0), 0, 0, 0, 0, 0, 0, int(self.verbose)]
+
+    def _cmd_echo_packet(self, value):
+        self.nechoes += 1
+        return wubCMD_RC.CMD_RC_OK, [value, self.nechoes & 0xFFFF, 0, 0]
+
+    def _cmd_echo_packet_reset(self):
+        self.nechoes = 0
+        return wubCMD_RC.CMD_RC_OK
+
+    def _cmd_get_uart_log(self):
+        log = self.uart_log
+        return wubCMD_RC.CMD_RC_OK, [log['nbytes_rx'] & 0xFFFFFFFF, log['ncmds_rx'] & 0xFFFFFFFF] + \
+            [min(log[key], 0xFFFF) for key in ['framing', 'overrun', 'parity', 'cobs', 'invalid']]
+
+    def _cmd_uart_log_reset(self):
+        for key in self.uart_log:
+            self.uart_log[key] = 0
+        return wubCMD_RC.CMD_RC_OK
+
+    _cmd_comms_err_ct_reset = _cmd_uart_log_reset
+
+    def _cmd_uart_ncmd_rx(self):
+        return wubCMD_RC.CMD_RC_OK, [self.uart_log['ncmds_rx'] & 0xFFFFFFFF]
+
+    def _cmd_binary_stats(self):
+        return wubCMD_RC.CMD_RC_OK, [self.nhits_sent & 0xFFFFFFFF, self.nbytes_sent & 0xFFFFFFFF]
+
+    # HV feedback loop: the measured value relaxes to the target.
+
+    def _update_hv(self):
+        now = time.monotonic()
+        dt, self._tlast_hv = now - self._tlast_hv, now
+        weight = math.exp(-dt / self.hv_tau) if self.hv_tau > 0 else 0.0
+        self._hv_measured = self._hv_target + (self._hv_measured - self._hv_target) * weight
+
+    def _set_hv(self, target: float):
+        self._update_hv()
+        self._hv_target = target
+        return wubCMD_RC.CMD_RC_OK
+
+    def _cmd_voltage(self, voltage):
+        if not 0 <= voltage <= 1500:
+            return wubCMD_RC.CMD_RC_OUT_OF_RANGE
+        return self._set_hv(voltage)
+
+    def _cmd_fraction(self, fraction):
+        if not 0 <= fraction <= 1:
+            return wubCMD_RC.CMD_RC_OUT_OF_RANGE
+        return self._set_hv(1500 * fraction)
+
+    def _cmd_pwmstop(self):
+        return self._set_hv(0.0)
+
+    def _cmd_get_fb_target(self):
+        return wubCMD_RC.CMD_RC_OK, [self._hv_target]
+
+    def _cmd_get_fb_measured(self):
+        self._update_hv()
+        return wubCMD_RC.CMD_RC_OK, [self._hv_measured + self._rng.gauss(0, 0.05)]
+
+    def _cmd_get_avg_v10(self):
+        self._update_hv()
+        return wubCMD_RC.CMD_RC_OK, [self._hv_measured / 1000]
+
+    def _cmd_get_avg_temp(self):
+        return wubCMD_RC.CMD_RC_OK, [21.0 + self._rng.gauss(0, 0.1)]
+
+    def _cmd_get_avg_vsup(self):
+        return wubCMD_RC.CMD_RC_OK, [5.0 + self._rng.gauss(0, 0.01)]
+
+    def _cmd_monstatus(self):
+        self._update_hv()
+        return wubCMD_RC.CMD_RC_OK, [self._hv_measured / 1000, 0.0, 0.01, 5.0, 1]
+
+    # Scans and CAL10 run for scan_time seconds; their status is 1 while running.
+
+    def _running(self, done: float) -> bool:
+        return done is not None and time.monotonic() < done
+
+    def _start_scan(self, *args):
+        if self._running(self._scan_done):
+            return wubCMD_RC.CMD_RC_BUSY
+        self._scan_done = time.monotonic() + self.scan_time
+        return wubCMD_RC.CMD_RC_OK
+
+    _cmd_scan = _cmd_quickscan = _cmd_quickscanup = _cmd_quickscanrange = _start_scan
+
+    def _cmd_scanabort(self):
+        self._scan_done = None
+        return wubCMD_RC.CMD_RC_OK
+
+    def _cmd_scanstatus(self):
+        return wubCMD_RC.CMD_RC_OK, [int(self._running(self._scan_done))]
+
+    def _cmd_cal10(self, *args):
+        if self._running(self._cal10_done):
+            return wubCMD_RC.CMD_RC_BUSY
+        self._cal10_done = time.monotonic() + self.scan_time
+        return wubCMD_RC.CMD_RC_OK
+
+    def _cmd_cal10abort(self):
+        self._cal10_done = None
+        return wubCMD_RC.CMD_RC_OK
+
+    def _cmd_cal10status(self):
+        return wubCMD_RC.CMD_RC_OK, [int(self._running(self._cal10_done))]
+
+    # Hit buffer and batches.
+
+    def _update_hits(self):
+        now = time.monotonic()
+        self._hit_credit += self.rate * (now - self._tlast_hits)
+        self._tlast_hits = now
+        nnew = int(self._hit_credit)
+        self._hit_credit -= nnew
+        space = self.memory_hits - self.nhits_buffered
+        self.nhits_overflow += max(0, nnew - space)
+        self.nhits_buffered += min(nnew, space)
+
+    def _cmd_flush_events(self):
+        self._update_hits()
+        self.nhits_buffered = 0
+        return wubCMD_RC.CMD_RC_OK
+
+    def _cmd_testpackets(self, enable, nsamples):
+        self._test_nsamples = nsamples if enable else None
+        self._test_index = 0
+        return wubCMD_RC.CMD_RC_OK
+
+    def _cmd_send_batch(self, ntosend, modenostop):
+        self._update_hits()
+        self._batch = dict(remaining=ntosend, nostop=bool(modenostop), ascii=self.comms_mode == "ASCII")
+        return wubCMD_RC.CMD_RC_OK
+
+    def _end_batch(self, terminate: bool = True):
+        '''Stop streaming; an ASCII batch that ran out ends with OK.'''
+        batch, self._batch = self._batch, None
+        if terminate and batch['ascii']:
+            self._emit(b"OK\n")
+
+    def _draw_nsamples(self) -> int:
+        spec = self.nsamples
+        if callable(spec):
+            return int(spec(self._rng))
+        if isinstance(spec, (tuple, list)):
+            return self._rng.randint(spec[0], spec[1])
+        return int(spec)
+
+    def _waveform(self, nsamples: int) -> bytes:
+        '''A payload from a small bank of pulses per nsamples, generated on first use.'''
+        bank = self._waveforms.get(nsamples)
+        if bank is None:
+            bank = []
+            for _ in range(16):
+                amplitude = self._rng.expovariate(1 / 400)
+                t0 = max(1, nsamples // 4)
+                samples = []
+                for i in range(nsamples):
+                    pulse = amplitude * math.exp(-(i - t0) / 3.0) if i >= t0 else 0.0
+                    for gain in (1.0, 0.125):
+                        value = SIM_ADC_BASELINE + gain * pulse + self._rng.gauss(0, 2)
+                        samples += [min(SIM_ADC_MAX, max(0, int(value)))]
+                bank += [struct.pack(f"<{2*nsamples}H", *samples)]
+            self._waveforms[nsamples] = bank
+        return bank[self._rng.randrange(len(bank))]
+
+    def _next_frame(self) -> bytes:
+        '''The next frame to stream, or None if there is no hit to send.'''
+        if self._test_nsamples is not None:
+            frame = test_frame(self._test_index, self._test_nsamples)
+            self._test_index += 1
+            return frame
+
+        self._update_hits()
+        if self.nhits_buffered == 0:
+            return None
+        self.nhits_buffered -= 1
+        nsamples = self._draw_nsamples()
+        timestamp = int((time.monotonic() - self._tboot) * SIM_FPGA_CLOCK)
+        frame = pack_frame(nsamples, self._hit_number, timestamp, self._rng.getrandbits(64),
+                           self._waveform(nsamples))
+        self._hit_number += 1
+        return frame
+
+    @staticmethod
+    def _ascii_frame(frame: bytes) -> bytes:
+        nsamples, hit, timestamp, tdc = parser.unpack_header(frame[1:1 + parser.HEADER_SIZE])
+        samples = parser.unpack_payload(frame[1 + parser.HEADER_SIZE:])
+        return (f"{nsamples:X} {hit:X} {timestamp:X} {tdc:X} " +
+                " ".join(f"{s:X}" for s in samples) + "\n").encode()
+
+    def _inject(self, frame: bytes) -> bytes:
+        '''Apply the injected bit flips and dropped spans to a streamed frame.'''
+        if self._next_corrupt >= len(frame) and self._next_drop >= len(frame):
+            self._next_corrupt -= len(frame)
+            self._next_drop -= len(frame)
+            return frame
+
+        data = bytearray(frame)
+        pos = self._next_corrupt
+        while pos < len(data):
+            data[int(pos)] ^= 1 << self._rng.randrange(8)
+            self.nbits_corrupted += 1
+            pos += self._countdown(self.corrupt_rate)
+        self._next_corrupt = pos - len(data)
+
+        pos = self._next_drop
+        drops = []
+        while pos < len(data):
+            drops += [(int(pos), self._rng.randint(1, self.drop_length))]
+            pos += self._countdown(self.drop_rate)
+        self._next_drop = pos - len(data)
+        for start, length in reversed(drops):
+            length = min(length, len(data) - start)
+            del data[start:start + length]
+            self.nbytes_dropped += length
+        return bytes(data)
+
+    def _stream(self):
+        batch = self._batch
+        wire_rate = self._wire_rate() if self.throttle else None
+        low_water = _TX_LOW_WATER if wire_rate is None else max(1, wire_rate * _TX_QUEUE_TIME)
+        while self._batch is batch and len(self._outbuf) < low_water:
+            if batch['remaining'] == 0:
+                self._end_batch()
+                return
+            frame = self._next_frame()
+            if frame is None:
+                if not batch['nostop']:
+                    self._end_batch()
+                return
+            if batch['ascii']:
+                frame = self._ascii_frame(frame)
+            self.nhits_sent += 1
+            self.nbytes_sent += len(frame)
+            if batch['remaining'] > 0:
+                batch['remaining'] -= 1
+            self._emit(self._inject(frame))
+
+    # ---- I/O loop ----
+
+    def _transmit(self) -> float:
+        '''Write what the link allows; returns how long to wait before trying again.'''
+        now = time.monotonic()
+        wire_rate = self._wire_rate() if self.throttle else None
+        if wire_rate is None:
+            nbytes = len(self._outbuf)
+        else:
+            # Allow bursts of a few ms of wire time so the pacing stays smooth.
+            burst = max(256, wire_rate * _TX_QUEUE_TIME)
+            self._wire_credit = min(self._wire_credit + wire_rate * (now - self._twire), burst)
+            nbytes = min(len(self._outbuf), int(self._wire_credit))
+        self._twire = now
+
+        if nbytes > 0:
+            try:
+                nwritten = os.write(self._master, self._outbuf[0:nbytes])
+            except BlockingIOError:
+                nwritten = 0
+            del self._outbuf[0:nwritten]
+            if wire_rate is not None:
+                self._wire_credit -= nwritten
+            if nwritten < nbytes:
+                return 0.001
+        if len(self._outbuf) > 0 and wire_rate is not None:
+            needed = min(len(self._outbuf), burst) - self._wire_credit
+            return max(0.0002, min(0.01, needed / wire_rate))
+        return 0.05
+
+    def _loop(self):
+        while self._running:
+            with self._lock:
+                if self._batch is not None:
+                    self._stream()
+                wait = self._transmit() if len(self._outbuf) > 0 else 0.05
+                if self._batch is not None and len(self._outbuf) == 0:
+                    # Waiting for hits to be generated.
+                    wait = min(wait, 0.001 if self.rate <= 0 else max(0.0005, min(0.01, 1 / self.rate)))
+
+            readable, _, _ = select.select([self._master], [], [], wait)
+            if not readable:
+                if len(self._inbuf) > 0 and time.monotonic() - self._tlast_rx > _RX_STALE_TIMEOUT:
+                    with self._lock:
+                        if self.comms_mode == "BINARY":
+                            self.uart_log['cobs'] += 1
+                            self._inbuf.clear()
+                continue
+            try:
+                data = os.read(self._master, 65536)
+            except BlockingIOError:
+                continue
+            except OSError:
+                break
+            with self._lock:
+                self._receive(data)
+
+    def start(self) -> str:
+        '''Start answering on the pty; returns the port path.'''
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._loop, name=f"wubSimulator-{self.basenumber}", daemon=True)
+            self._thread.start()
+            logger.info(f"Simulated wuBase {self.basenumber} on {self.port}.")
+        return self.port
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
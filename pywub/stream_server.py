@@ -0,0 +1,277 @@
+'''
+Local streaming of live frames over a UNIX-domain socket.
+
+A subscriber connects and sends one JSON line describing what it wants:
+
+    {"bases": [0, 3], "types": [1]}
+
+An empty object (or missing keys) subscribes to everything. The server then
+sends batches, each one a little-endian uint32 length followed by that many
+bytes of records in the pywub.records format (one batch per receive chunk and
+base). Each subscriber has its own bounded queue drained by its own thread;
+when a subscriber cannot keep up, its oldest batches are dropped, so no
+subscriber can back-pressure the serial reader.
+'''
+
+from __future__ import annotations
+
+import io
+import os
+import json
+import time
+import socket
+import struct
+import threading
+from collections import deque
+from typing import Iterator
+
+from . import records
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+BATCH_HEADER = struct.Struct("<I")
+
+# Seconds a new connection has to send its subscription request.
+HANDSHAKE_TIMEOUT = 5.0
+
+
+class _subscriber():
+
+    def __init__(self, sock: socket.socket, bases: set = None, types: set = None, max_bytes: int = 8 << 20):
+        self.sock = sock
+        self.bases = bases
+        self.types = types
+        self.max_bytes = max_bytes
+
+        self.queue = deque()
+        self.nbytes_queued = 0
+        self.nbatches_sent = 0
+        self.nbatches_dropped = 0
+
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def wants(self, base: int, rec_type: int) -> bool:
+        return ((self.bases is None or base in self.bases) and
+                (self.types is None or rec_type in self.types))
+
+    def push(self, batch: bytes):
+        with self.cond:
+            self.queue.append(batch)
+            self.nbytes_queued += len(batch)
+            while self.nbytes_queued > self.max_bytes and len(self.queue) > 1:
+                self.nbytes_queued -= len(self.queue.popleft())
+                self.nbatches_dropped += 1
+            self.cond.notify()
+
+    def run(self):
+        try:
+            while True:
+                with self.cond:
+                    while len(self.queue) == 0 and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    batch = self.queue.popleft()
+                    self.nbytes_queued -= len(batch)
+
+                self.sock.sendall(batch)
+                self.nbatches_sent += 1
+        except OSError as e:
+            logger.info(f"Subscriber disconnected: {e}")
+        finally:
+            self.close()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class wubFrameStreamServer():
+    '''
+    Streams decoded frames to local subscribers.
+
+    Attach it to a receiver with wubCTL.add_frame_listener(server.publish_frames);
+    publish_frames() only packs the batch once and appends it to the matching
+    subscribers' queues.
+
+    Args:
+        path (str): Filesystem path of the UNIX-domain socket.
+        max_queue_bytes (int): Per-subscriber queue limit before old batches are dropped.
+        handshake_timeout (float): Seconds a new connection has to send its subscription request.
+    '''
+
+    def __init__(self, path: str, max_queue_bytes: int = 8 << 20, handshake_timeout: float = HANDSHAKE_TIMEOUT):
+        self._path = path
+        self._max_queue_bytes = max_queue_bytes
+        self._handshake_timeout = handshake_timeout
+
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+        self._sock = None
+        self._accept_thread = None
+        self._running = False
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def nsubscribers(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def nbatches_dropped(self) -> int:
+        return sum(sub.nbatches_dropped for sub in self._subscribers)
+
+    def start(self):
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self._path)
+        self._sock.listen()
+        self._running = True
+
+        self._accept_thread = threading.Thread(target=self._accept, name="wubFrameStreamServer", daemon=True)
+        self._accept_thread.start()
+        logger.info(f"Frame stream server listening on {self._path}")
+
+    def _accept(self):
+        while self._running:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break
+            # The handshake runs on the connection's own thread, so a silent
+            # client cannot hold up other subscribers.
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _handshake(self, conn: socket.socket) -> _subscriber:
+        conn.settimeout(self._handshake_timeout)
+        request = b""
+        while not request.endswith(b"\n"):
+            chunk = conn.recv(4096)
+            if len(chunk) == 0:
+                raise ValueError("connection closed before subscription request")
+            request += chunk
+            if len(request) > 65536:
+                raise ValueError("subscription request too long")
+
+        request = json.loads(request.decode()) if request.strip() else {}
+        if not isinstance(request, dict):
+            raise ValueError("subscription request is not a JSON object")
+        for key in ('bases', 'types'):
+            values = request.get(key)
+            if values is not None and not (isinstance(values, list) and all(isinstance(v, int) for v in values)):
+                raise ValueError(f"'{key}' must be a list of integers")
+        bases = set(request['bases']) if request.get('bases') else None
+        types = set(request['types']) if request.get('types') else None
+
+        conn.shutdown(socket.SHUT_RD)
+        conn.settimeout(None)
+        return _subscriber(conn, bases, types, self._max_queue_bytes)
+
+    def _serve(self, conn: socket.socket):
+        try:
+            sub = self._handshake(conn)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"Rejected subscriber: {e}")
+            conn.close()
+            return
+
+        with self._lock:
+            if not self._running:
+                sub.close()
+                return
+            self._subscribers.append(sub)
+        logger.info(f"New subscriber (bases: {sub.bases}, types: {sub.types}); {self.nsubscribers} connected.")
+
+        sub.run()
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    def publish(self, data: bytes, base: int = 0, rec_type: int = records.RECORD_TYPE_HIT,
+                timestamp: float = None):
+        self.publish_frames([data], base, time.time() if timestamp is None else timestamp, rec_type)
+
+    def publish_frames(self, frames: list[bytes], base: int, timestamp: float,
+                       rec_type: int = records.RECORD_TYPE_HIT):
+        '''Frame listener signature used by wubCTL.'''
+        subscribers = [sub for sub in self._subscribers if sub.wants(base, rec_type)]
+        if len(subscribers) == 0:
+            return
+
+        payload = records.pack_records(frames, base, timestamp, rec_type)
+        batch = BATCH_HEADER.pack(len(payload)) + payload
+        for sub in subscribers:
+            sub.push(batch)
+
+    def stop(self):
+        self._running = False
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.close()
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+
+class wubFrameStreamClient():
+    '''
+    Reference client for wubFrameStreamServer.
+
+    Args:
+        path (str): Socket path of the server.
+        bases (list): Only receive frames from these bases (None for all).
+        types (list): Only receive these record types (None for all).
+    '''
+
+    def __init__(self, path: str, bases: list[int] = None, types: list[int] = None):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+
+        request = {}
+        if bases is not None:
+            request['bases'] = list(bases)
+        if types is not None:
+            request['types'] = list(types)
+        self._sock.sendall((json.dumps(request) + "\n").encode())
+
+        self._rfile = self._sock.makefile('rb')
+
+    def read_batch(self) -> list[records.wubRecord]:
+        '''Block for the next batch; returns None once the server goes away.'''
+        hdr = self._rfile.read(BATCH_HEADER.size)
+        if len(hdr) < BATCH_HEADER.size:
+            return None
+
+        length = BATCH_HEADER.unpack(hdr)[0]
+        payload = self._rfile.read(length)
+        if len(payload) < length:
+            return None
+
+        return list(records.iter_records(io.BytesIO(payload)))
+
+    def __iter__(self) -> Iterator[list[records.wubRecord]]:
+        while True:
+            batch = self.read_batch()
+            if batch is None:
+                return
+            yield batch
+
+    def close(self):
+        self._rfile.close()
+        self._sock.close()
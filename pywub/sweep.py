@@ -0,0 +1,299 @@
+'''
+Parameter sweeps (DAC, TRIGGER_THRESHOLDS, ...) on an open link.
+
+wubSweepRunner steps through a list of settings without tearing the link down:
+for each point it sends the setting commands (through wubSetupSequencer, so
+settle policies and retries apply), flushes the hits buffered under the
+previous setting, and acquires for `dwell` seconds with scheduled batches
+(wubCTL.scheduled_batchmode_recv), which stop on a frame boundary. The hits of a
+point are kept in memory, or written to one record file per point. Each point
+is analyzed by a worker while the next one is acquiring:
+
+    points = sweep_points([("DAC", [[1, v] for v in range(1000, 3001, 500)])])
+    runner = wubSweepRunner(wubctl, points, dwell=2.0)
+    results = runner.run()
+    print(format_summary(results))
+
+The analysis (analyze_frames) gives per point the hit rate, the mean and spread
+of the ADC channel 0 amplitude (maximum minus the baseline of the first
+samples) and the noise, the RMS of those baseline samples. Pulser setup and
+other one-off commands are run before the sweep, e.g. from a setup config.
+'''
+
+from __future__ import annotations
+
+import os
+import math
+import time
+import itertools
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+
+from . import parser
+from . import records
+from .batching import wubBatchScheduler
+from .hitview import hit_views
+from .sequencer import wubSetupSequencer
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+BASELINE_SAMPLES = 4
+
+
+@dataclass
+class wubSweepPoint:
+    index: int
+    settings: list          # (command name, args) pairs, sent in order
+
+    @property
+    def label(self) -> str:
+        return ", ".join(f"{name} {' '.join(str(a) for a in args)}" for name, args in self.settings)
+
+
+@dataclass
+class wubSweepResult:
+    point: wubSweepPoint
+    ok: bool = True
+    nhits: int = 0
+    live_time: float = 0.0
+    amplitude_mean: float = None
+    amplitude_std: float = None
+    noise: float = None
+    t_setup: float = 0.0
+    t_acquire: float = 0.0
+    t_analysis: float = 0.0
+    file: str = None
+    scheduler: dict = field(default_factory=dict)
+
+    @property
+    def rate(self) -> float:
+        return self.nhits / self.live_time if self.live_time > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return dict(index=self.point.index, settings=[[name, list(args)] for name, args in self.point.settings],
+                    ok=self.ok, nhits=self.nhits, live_time=self.live_time, rate=self.rate,
+                    amplitude_mean=self.amplitude_mean, amplitude_std=self.amplitude_std, noise=self.noise,
+                    t_setup=self.t_setup, t_acquire=self.t_acquire, t_analysis=self.t_analysis, file=self.file)
+
+
+def sweep_points(axes: list[tuple[str, list]]) -> list[wubSweepPoint]:
+    '''All combinations of the axes, each a (command name, list of args) pair; the last axis varies fastest.'''
+    names = [name.upper() for name, _ in axes]
+    combinations = itertools.product(*[values for _, values in axes])
+    return [wubSweepPoint(i, [(name, list(args)) for name, args in zip(names, combination)])
+            for i, combination in enumerate(combinations)]
+
+
+def _analyze_numpy(frames: list, baseline_samples: int) -> tuple:
+    n = 0
+    amp_sum = amp_sumsq = 0.0
+    noise_sumsq = 0.0
+    noise_dof = 0
+    with hit_views(frames) as hits:
+        for run in hits.runs:
+            adc0 = run['samples'][:, :, 0]
+            k = min(baseline_samples, adc0.shape[1])
+            if k == 0:
+                continue
+            pre = adc0[:, :k].astype(np.float64)
+            baseline = pre.mean(axis=1)
+            amplitude = adc0.max(axis=1) - baseline
+            n += len(amplitude)
+            amp_sum += float(amplitude.sum())
+            amp_sumsq += float(np.square(amplitude).sum())
+            noise_sumsq += float(np.square(pre - baseline[:, None]).sum())
+            noise_dof += len(amplitude) * (k - 1)
+    return n, amp_sum, amp_sumsq, noise_sumsq, noise_dof
+
+
+def _analyze_python(frames: list, baseline_samples: int) -> tuple:
+    n = 0
+    amp_sum = amp_sumsq = 0.0
+    noise_sumsq = 0.0
+    noise_dof = 0
+    for frame in frames:
+        adc0 = parser.unpack_payload(frame[parser.HEADER_SIZE:])[0::2]
+        k = min(baseline_samples, len(adc0))
+        if k == 0:
+            continue
+        baseline = sum(adc0[:k]) / k
+        amplitude = max(adc0) - baseline
+        n += 1
+        amp_sum += amplitude
+        amp_sumsq += amplitude * amplitude
+        noise_sumsq += sum((s - baseline) ** 2 for s in adc0[:k])
+        noise_dof += k - 1
+    return n, amp_sum, amp_sumsq, noise_sumsq, noise_dof
+
+
+def analyze_frames(frames: list, baseline_samples: int = BASELINE_SAMPLES) -> dict:
+    '''Amplitude and noise statistics of ADC channel 0 over a list of frames (without start byte).
+
+    Returns:
+        dict: nhits, amplitude_mean, amplitude_std, noise (None where there are too few hits).
+    '''
+    analyze = _analyze_numpy if np is not None else _analyze_python
+    n, amp_sum, amp_sumsq, noise_sumsq, noise_dof = analyze(frames, baseline_samples)
+    stats = dict(nhits=n, amplitude_mean=None, amplitude_std=None, noise=None)
+    if n > 0:
+        mean = amp_sum / n
+        stats['amplitude_mean'] = mean
+        stats['amplitude_std'] = math.sqrt(max(0.0, amp_sumsq / n - mean * mean))
+    if noise_dof > 0:
+        stats['noise'] = math.sqrt(noise_sumsq / noise_dof)
+    return stats
+
+
+def analyze_file(filename: str, baseline_samples: int = BASELINE_SAMPLES) -> dict:
+    '''analyze_frames() over the hits of a record file.'''
+    with open(filename, "rb") as f:
+        frames = [rec.data for rec in records.iter_records(f) if rec.rec_type == records.RECORD_TYPE_HIT]
+    return analyze_frames(frames, baseline_samples)
+
+
+def format_summary(results: list[wubSweepResult]) -> str:
+    def value(v, fmt):
+        return "-" if v is None else f"{v:{fmt}}"
+
+    lines = [f"{'point':>5s} {'hits':>8s} {'rate Hz':>10s} {'amplitude':>10s} {'amp std':>8s} {'noise':>7s} "
+             f"{'setup ms':>8s}  setting"]
+    for r in results:
+        flag = "" if r.ok else "  (FAILED)"
+        lines += [f"{r.point.index:5d} {r.nhits:8d} {r.rate:10.1f} {value(r.amplitude_mean, '10.1f')} "
+                  f"{value(r.amplitude_std, '8.1f')} {value(r.noise, '7.2f')} {1e3 * r.t_setup:8.1f}  "
+                  f"{r.point.label}{flag}"]
+    return "\n".join(lines)
+
+
+class wubSweepRunner():
+    '''
+    Args:
+        wubctl (wubCTL): BINARY link in 'frame' or 'ring' store mode, already set up.
+        points (list): wubSweepPoint list, e.g. from sweep_points().
+        dwell (float): Seconds of acquisition per point.
+        odir (str): Write the hits of each point to odir/point_NNN.dat instead of keeping them in memory.
+        flush (bool): Send FLUSH_EVENTS after each setting, so no hit of the previous setting is counted.
+        baseline_samples (int): Leading samples used for the baseline and the noise.
+        executor: concurrent.futures executor for the analysis; a single worker thread if None.
+        sequencer (wubSetupSequencer): Sends the setting commands; one on wubctl if None.
+    '''
+
+    def __init__(self, wubctl, points: list[wubSweepPoint], dwell: float = 1.0, odir: str = None,
+                 flush: bool = True, baseline_samples: int = BASELINE_SAMPLES, executor=None,
+                 sequencer: wubSetupSequencer = None):
+        self._wubctl = wubctl
+        self.points = points
+        self.dwell = dwell
+        self.odir = odir
+        self.flush = flush
+        self.baseline_samples = baseline_samples
+        self._executor = executor
+        self._sequencer = wubSetupSequencer(wubctl) if sequencer is None else sequencer
+        self._stop = threading.Event()
+        self.results = []
+
+    def stop(self):
+        '''End the current point early and skip the rest; safe to call from another thread.'''
+        self._stop.set()
+        self._wubctl.request_stop = True
+
+    def _apply(self, point: wubSweepPoint) -> bool:
+        for name, args in point.settings:
+            if not self._sequencer.run_step(name, args).ok:
+                logger.error(f"Point {point.index}: {name} {args} failed.")
+                return False
+        if self.flush:
+            return self._sequencer.run_step("FLUSH_EVENTS").ok
+        return True
+
+    def _acquire(self, point: wubSweepPoint, result: wubSweepResult) -> list:
+        '''Take data for one point; returns the frames, or None if they went to a file.'''
+        wubctl = self._wubctl
+        frames = None
+        datafile = None
+        if self.odir is not None:
+            result.file = os.path.join(self.odir, f"point_{point.index:03d}.dat")
+            datafile = open(result.file, "wb")
+        else:
+            frames = []
+            append = frames.extend
+
+            # Ring store mode frames are only valid during the call.
+            def listener(batch, base, timestamp):
+                append([bytes(f) for f in batch])
+            wubctl.add_frame_listener(listener)
+
+        scheduler = wubBatchScheduler()
+        wubctl.prepare_batch()
+        rx_thread = threading.Thread(target=wubctl.scheduled_batchmode_recv,
+                                     kwargs=dict(datafile=datafile, scheduler=scheduler))
+        tstart = time.perf_counter()
+        rx_thread.start()
+        self._stop.wait(self.dwell)
+        wubctl.request_stop = True
+        rx_thread.join()
+        result.live_time = result.t_acquire = time.perf_counter() - tstart
+        result.scheduler = scheduler.summary()
+
+        if datafile is not None:
+            datafile.close()
+        else:
+            wubctl.remove_frame_listener(listener)
+        return frames
+
+    def _analyze(self, frames: list, filename: str) -> tuple[dict, float]:
+        tstart = time.perf_counter()
+        if frames is not None:
+            stats = analyze_frames(frames, self.baseline_samples)
+        else:
+            stats = analyze_file(filename, self.baseline_samples)
+        return stats, time.perf_counter() - tstart
+
+    def run(self) -> list[wubSweepResult]:
+        '''Acquire every point; each is analyzed while the next one is acquired.
+
+        Returns:
+            list: A wubSweepResult per point reached, in order.
+        '''
+        if self.odir is not None:
+            os.makedirs(self.odir, exist_ok=True)
+        executor = ThreadPoolExecutor(max_workers=1) if self._executor is None else self._executor
+        self._stop.clear()
+        self.results = []
+        pending = []
+        try:
+            for point in self.points:
+                if self._stop.is_set():
+                    break
+                result = wubSweepResult(point)
+                self.results.append(result)
+
+                tstart = time.perf_counter()
+                result.ok = self._apply(point)
+                result.t_setup = time.perf_counter() - tstart
+                if not result.ok:
+                    continue
+
+                frames = self._acquire(point, result)
+                pending.append((result, executor.submit(self._analyze, frames, result.file)))
+                logger.info(f"Point {point.index} ({point.label}): {result.scheduler.get('nframes', 0)} hits "
+                            f"in {result.live_time:.2f} s.")
+
+            for result, future in pending:
+                stats, result.t_analysis = future.result()
+                result.nhits = stats['nhits']
+                result.amplitude_mean = stats['amplitude_mean']
+                result.amplitude_std = stats['amplitude_std']
+                result.noise = stats['noise']
+        finally:
+            if self._executor is None:
+                executor.shutdown()
+        return self.results
@@ -1,3 +1,11 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+
+from .catalog import ctlg as wubCMD_catalog
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -35,6 +43,18 @@ WUBASE_DEFAULT_BAUD = 9600
 
 
 class wuBase():
+    '''
+    Host-side record of a wuBase's link state: power, autobaud, baud rate and
+    comms mode.
+
+    wubCTL feeds it every command it sends together with whether the device
+    accepted it (update()), so it always holds the state the device was last
+    put in. `known` is False until the state has been established, either by
+    probing the device or by loading a state file saved by a previous session
+    (save()/load()), which lets back-to-back runs skip transitions the device
+    has already made.
+    '''
+
     def __init__(self, basenumber, baud=WUBASE_DEFAULT_BAUD):
         #Base info
         self._basenumber = basenumber
@@ -42,11 +62,15 @@ class wuBase():
         
         #UART mode
         self._autobaud = True
-        self._commsbaud = baud
+        self._baud = baud
         
         #ASCII or Binary
         self._comms_mode = "ASCII"
 
+        #Whether the state above is believed to match the device.
+        self._known = False
+        self._verified = None
+
     @property
     def basenumber(self) -> int:
         return self._basenumber
@@ -68,12 +92,12 @@ class wuBase():
         self._autobaud = state
     
     @property
-    def baud(self) -> bool:
+    def baud(self) -> int:
         return self._baud
     
     def setbaud(self, baud: int):
         if baud < 0:
-            self.baud = WUBASE_DEFAULT_BAUD
+            self._baud = WUBASE_DEFAULT_BAUD
             self.setautobaud(True)
         else:
             self._baud = baud
@@ -95,4 +119,81 @@ class wuBase():
         if (mode.upper())[0] == 'A':
             self._comms_mode = 'ASCII'
         else:
-            self._comms_mode = 'BINARY'
\ No newline at end of file
+            self._comms_mode = 'BINARY'
+
+    @property
+    def known(self) -> bool:
+        return self._known
+
+    @property
+    def verified(self) -> float:
+        '''Time the state was last confirmed on the device (None if never).'''
+        return self._verified
+
+    def mark_verified(self):
+        self._known = True
+        self._verified = time.time()
+
+    def forget(self):
+        '''The device may no longer be in the recorded state; it has to be probed again.'''
+        self._known = False
+        self._verified = None
+
+    def reset(self):
+        '''Boot state of the MCU: ASCII at autobaud.'''
+        self._autobaud = True
+        self._baud = WUBASE_DEFAULT_BAUD
+        self._comms_mode = "ASCII"
+
+    def update(self, command, args: tuple, ok: bool):
+        '''Apply the effect of a command the device answered (ok) or rejected.'''
+        if command == wubCMD_catalog.baud:
+            if ok:
+                self.setbaud(args[0])
+            else:
+                # BAUD is only rejected once the device has left autobaud, and it
+                # leaves us not knowing which fixed rate it is at.
+                self.setautobaud(False)
+                self.forget()
+        elif not ok:
+            return
+        elif command == wubCMD_catalog.binarymode:
+            self.set_comms_mode("BINARY")
+        elif command == wubCMD_catalog.asciimode:
+            self.set_comms_mode("ASCII")
+        elif command == wubCMD_catalog.reset_mcu:
+            self.reset()
+
+    def transitions(self, mode: str, baud: int) -> list[str]:
+        '''Commands still needed to reach a fixed baud and comms mode, in order.'''
+        needed = []
+        if self._autobaud or self._baud != baud:
+            needed += ["BAUD"]
+        if self.isascii != ((mode.upper())[0] == 'A'):
+            needed += ["ASCIIMODE" if (mode.upper())[0] == 'A' else "BINARYMODE"]
+        return needed
+
+    def to_dict(self) -> dict:
+        return dict(basenumber=self._basenumber, autobaud=self._autobaud, baud=self._baud,
+                    comms_mode=self._comms_mode, verified=self._verified)
+
+    def save(self, filename: str):
+        tmp = f"{filename}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename: str, basenumber: int = None) -> wuBase:
+        '''State saved by a previous session; it still has to be verified on the device.'''
+        with open(filename, 'r') as f:
+            d = json.load(f)
+        base = cls(d['basenumber'] if basenumber is None else basenumber, baud=d['baud'])
+        base._autobaud = d['autobaud']
+        base._comms_mode = d['comms_mode']
+        base._known = True
+        return base
+
+    def __repr__(self):
+        return (f"wuBase({self._basenumber}: {self._comms_mode}, "
+                f"{'autobaud' if self._autobaud else self._baud}{'' if self._known else ', unverified'})")
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+
+from pywub.parser import HEADER_SIZE, unpack_header
+from pywub.control import wubCTL
+from pywub.batching import wubBatchScheduler
+from pywub.simulator import SIM_FPGA_CLOCK
+
+import logging
+
+
+logger = logging.getLogger()
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "standalone", "wub_simulator.py")
+
+
+def percentile(values: list, q: float) -> float:
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_case(case: dict, port: str, duration: float) -> dict:
+    '''Receive with one open-ended batch ('stream') or scheduled bounded batches; runs in a worker process.'''
+    wubctl = wubCTL(port, baud=1181818, mode='binary', store_mode='ring', timeout=0.5, revert_on_close=False)
+    wubctl.ensure_link()
+
+    # Delay of each frame after its FPGA timestamp, up to the unknown clock offset
+    # (removed below by taking the smallest delay as zero).
+    delays = []
+
+    def listener(frames, base, timestamp):
+        now = time.monotonic()
+        for frame in frames:
+            delays.append(now - unpack_header(frame[:HEADER_SIZE])[2] / SIM_FPGA_CLOCK)
+    wubctl.add_frame_listener(listener)
+
+    wubctl.prepare_batch()
+    scheduler = wubBatchScheduler()
+    if case['method'] == 'scheduled':
+        rx_thread = threading.Thread(target=wubctl.scheduled_batchmode_recv, kwargs=dict(scheduler=scheduler))
+    else:
+        rx_thread = threading.Thread(target=wubctl.batchmode_recv, args=(-1, 1), kwargs=dict(datafile=None))
+
+    cpu_start = time.process_time()
+    tstart = time.perf_counter()
+    rx_thread.start()
+    time.sleep(duration)
+    wubctl.request_stop = True
+    tstop = time.perf_counter()
+    rx_thread.join(10)
+    tstop_done = time.perf_counter()
+    cpu = time.process_time() - cpu_start
+
+    time.sleep(0.2)
+    wubctl.drain()
+    nhits_tx = int(wubctl.cmd_binary_stats()['response']['retargs'][0])
+    frames = wubctl.metrics.frames
+    nbytes = wubctl.nbytes_recv
+    wubctl.close()
+
+    elapsed = tstop - tstart
+    offset = min(delays) if len(delays) > 0 else 0.0
+    latency = [d - offset for d in delays]
+    mb = nbytes / 1e6
+    return dict(case, frames=frames, frames_sent=nhits_tx, lost_at_stop=nhits_tx - frames,
+                frames_per_s=frames / elapsed, mb_per_s=mb / elapsed,
+                cpu_s_per_mb=cpu / mb if mb > 0 else None,
+                latency_p50_ms=1e3 * percentile(latency, 0.5) if len(latency) > 0 else None,
+                latency_p99_ms=1e3 * percentile(latency, 0.99) if len(latency) > 0 else None,
+                stop_s=tstop_done - tstop, batches=scheduler.nbatches if case['method'] == 'scheduled' else 1)
+
+
+def spawn_case(case: dict, cli_args) -> dict:
+    sim = subprocess.Popen([sys.executable, "-u", SIMULATOR, "--rate", f"{case['rate']}", "--nsamples", f"{case['nsamples']}",
+                            "--memory_hits", "100000", "--seed", "1", "--report_interval", "3600", "--loglevel", "WARNING"],
+                           stdout=subprocess.PIPE, text=True)
+    try:
+        port = sim.stdout.readline().strip()
+        worker = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(case),
+                                 "--port", port, "--duration", f"{cli_args.duration}", "--loglevel", "ERROR"],
+                                stdout=subprocess.PIPE, text=True, timeout=cli_args.duration + 60)
+    finally:
+        sim.terminate()
+        sim.wait()
+
+    lines = worker.stdout.strip().splitlines()
+    if worker.returncode != 0 or len(lines) == 0:
+        logger.error(f"Case {case} failed (exit code {worker.returncode}).")
+        return dict(case, error=f"exit code {worker.returncode}")
+    return json.loads(lines[-1])
+
+
+def format_value(value, fmt: str) -> str:
+    return "-" if value is None else f"{value:{fmt}}"
+
+
+def main(cli_args):
+
+    if cli_args.worker is not None:
+        print(json.dumps(run_case(json.loads(cli_args.worker), cli_args.port, cli_args.duration)))
+        return 0
+
+    results = []
+    for rate in cli_args.rates:
+        for method in cli_args.methods:
+            case = dict(method=method, rate=rate, nsamples=cli_args.nsamples)
+            logger.info(f"Case {case}")
+            results += [spawn_case(case, cli_args)]
+
+    print(f"{'rate':>8s} {'method':10s} {'frames/s':>9s} {'CPU s/MB':>9s} {'p50 ms':>7s} {'p99 ms':>7s} "
+          f"{'batches':>7s} {'stop s':>6s} {'lost':>5s}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['rate']:8.0f} {r['method']:10s} -- {r['error']}")
+            continue
+        print(f"{r['rate']:8.0f} {r['method']:10s} {r['frames_per_s']:9.0f} {format_value(r['cpu_s_per_mb'], '9.3f')} "
+              f"{format_value(r['latency_p50_ms'], '7.1f')} {format_value(r['latency_p99_ms'], '7.1f')} "
+              f"{r['batches']:7d} {r['stop_s']:6.2f} {r['lost_at_stop']:5d}")
+
+    if cli_args.ofile is not None:
+        with open(cli_args.ofile, "w") as f:
+            json.dump(dict(meta=dict(timestamp=time.time(), duration=cli_args.duration), results=results), f, indent=1)
+        logger.info(f"Results written to {cli_args.ofile}.")
+    return 0
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare one open-ended SEND_BATCH with scheduled bounded batches.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--methods", type=str, nargs='+', default=['stream', 'scheduled'],
+                        choices=['stream', 'scheduled'], help="Readout methods to compare.")
+    parser.add_argument("--rates", type=float, nargs='+', default=[50, 1000, 50000],
+                        help="Simulated hit rates (per second) to sweep; the highest fills the link.")
+    parser.add_argument("--nsamples", type=int, default=16,
+                        help="Samples per hit.")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="Seconds of data taking per case.")
+    parser.add_argument("--ofile", type=str, default=None,
+                        help="JSON results file.")
+    parser.add_argument("--loglevel", type=str, default="INFO",
+                        help="Logger level")
+
+    # Internal: run a single case in this process.
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=str, default=None, help=argparse.SUPPRESS)
+
+    cli_args = parser.parse_args()
+
+    logger.setLevel(cli_args.loglevel.upper())
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+                                      datefmt="%H:%M:%S"))
+    logger.addHandler(ch)
+
+    sys.exit(main(cli_args))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python 
+
+import os
+import sys
+import time
+import timeit
+import subprocess
+
+from pywub.catalog import ctlg as wubCMD_catalog
+
+
+def time_import(nrepeat: int) -> float:
+    '''Best-of-n wall time to import pywub.control in a fresh interpreter.'''
+    best = None
+    for i in range(nrepeat):
+        tstart = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import pywub.control"], check=True)
+        dt = time.perf_counter() - tstart
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def time_construct(nrepeat: int) -> float:
+    '''Best-of-n time to construct a wubCTL on a pseudo-terminal.'''
+    from pywub.control import wubCTL
+
+    master, slave = os.openpty()
+    port = os.ttyname(slave)
+
+    best = None
+    for i in range(nrepeat):
+        tstart = time.perf_counter()
+        wubctl = wubCTL(port, baud=115200)
+        dt = time.perf_counter() - tstart
+        # Do not revert the mode; nothing is listening on the pty.
+        wubctl.close(revert=False)
+        best = dt if best is None else min(best, dt)
+
+    os.close(master)
+    os.close(slave)
+    return best
+
+
+def main(cli_args):
+
+    print(f"import pywub.control:   {time_import(cli_args.nimport)*1e3:8.2f} ms")
+    print(f"wubCTL() construction:  {time_construct(cli_args.nconstruct)*1e6:8.2f} us")
+
+    cases = [("status", ()), 
+             ("pulser_setup", (0, 20000, 0.3)), 
+             ("trigger_thresholds", (0.1, 0.2, 0.3, 0.4)), 
+             ("send_batch", (-1, 1))]
+
+    print(f"{'command':22s} {'ascii build':>12s} {'binary build':>13s} {'unpack':>10s}")
+    for name, args in cases:
+        cmd = wubCMD_catalog.get_command(name)
+        readback = bytes(cmd.retargs_size) + b"a"
+
+        t_a = timeit.timeit(lambda: cmd.build('a', *args), number=cli_args.n) / cli_args.n
+        t_b = timeit.timeit(lambda: cmd.build('b', *args), number=cli_args.n) / cli_args.n
+        t_u = timeit.timeit(lambda: cmd.unpack(readback), number=cli_args.n) / cli_args.n
+
+        print(f"{name:22s} {t_a*1e9:9.0f} ns {t_b*1e9:10.0f} ns {t_u*1e9:7.0f} ns")
+
+
+if __name__ == "__main__": 
+    
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark catalog import, wubCTL construction and command encode/decode.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, 
+                        help="Iterations per encode/decode measurement.")
+    parser.add_argument("--nimport", type=int, default=5, 
+                        help="Fresh-interpreter imports to time.")
+    parser.add_argument("--nconstruct", type=int, default=20, 
+                        help="wubCTL constructions to time.")
+
+    cli_args = parser.parse_args()  
+
+    main(cli_args)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+import random
+import tracemalloc
+
+from pywub import parser as wub_parser
+from pywub.hit import MPEHit
+from pywub.rxring import wubRxRing
+from pywub.hitview import hit_views, fpga_ts
+from pywub.simulator import pack_frame
+
+import logging
+
+
+logger = logging.getLogger()
+
+BASELINE_SAMPLES = 4
+
+
+def fill_ring(ring: wubRxRing, nframes: int, nsamples: int, seed: int = 1) -> list:
+    '''Write nframes hits into the ring as the serial port would; returns the frames.'''
+    rng = random.Random(seed)
+    payloads = [bytes(rng.getrandbits(8) for _ in range(wub_parser.calc_payload_size(nsamples))) for _ in range(16)]
+    data = b"".join(pack_frame(nsamples, i, rng.getrandbits(48), rng.getrandbits(64), payloads[i % 16])
+                    for i in range(nframes))
+    ring.reset()
+    space = ring.writable()
+    space[:len(data)] = data
+    ring.commit(len(data))
+    return ring.frames()
+
+
+def analyze_hits(frames: list) -> float:
+    '''Per-frame decode into MPEHit objects, then the amplitude of channel 0 in Python.'''
+    total = 0.0
+    for frame in frames:
+        nsamples, hit_number, ts, tdc = wub_parser.unpack_header(frame[:wub_parser.HEADER_SIZE])
+        samples = wub_parser.unpack_payload(frame[wub_parser.HEADER_SIZE:])
+        hit = MPEHit(hit_number, ts, tdc, nsamples, list(samples[0::2]), list(samples[1::2]))
+        baseline = sum(hit.adc0_data[:BASELINE_SAMPLES]) / BASELINE_SAMPLES
+        total += max(hit.adc0_data) - baseline
+    return total
+
+
+def analyze_views(frames: list) -> float:
+    '''The same amplitudes, vectorized over hit views.'''
+    total = 0.0
+    with hit_views(frames) as hits:
+        for run in hits.runs:
+            adc0 = run['samples'][:, :, 0]
+            baseline = adc0[:, :BASELINE_SAMPLES].mean(axis=1)
+            total += float((adc0.max(axis=1) - baseline).sum())
+            fpga_ts(run)
+    return total
+
+
+def measure(fn, frames: list, repeat: int) -> dict:
+    fn(frames)
+    tstart = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(frames)
+    elapsed = time.perf_counter() - tstart
+
+    tracemalloc.start()
+    fn(frames)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(us_per_hit=1e6 * elapsed / (repeat * len(frames)), peak_bytes_per_hit=peak / len(frames),
+                result=result)
+
+
+def main(cli_args):
+    ring = wubRxRing(capacity=1 << 24)
+    results = []
+    for nsamples in cli_args.nsamples:
+        frames = fill_ring(ring, cli_args.nframes, nsamples)
+        copies = [bytes(f) for f in frames]
+        cases = [('MPEHit', analyze_hits, frames), ('views copy', analyze_views, copies),
+                 ('views ring', analyze_views, frames)]
+        for name, fn, data in cases:
+            r = dict(method=name, nsamples=nsamples, **measure(fn, data, cli_args.repeat))
+            results += [r]
+        ring.release()
+
+        expected = results[-3]['result']
+        for r in results[-2:]:
+            if abs(r['result'] - expected) > 1e-6 * abs(expected):
+                logger.error(f"{r['method']} disagrees with MPEHit: {r['result']} vs {expected}")
+
+    print(f"{'method':11s} {'nsamples':>8s} {'us/hit':>8s} {'peak B/hit':>10s}")
+    for r in results:
+        print(f"{r['method']:11s} {r['nsamples']:8d} {r['us_per_hit']:8.3f} {r['peak_bytes_per_hit']:10.1f}")
+
+    if cli_args.ofile is not None:
+        with open(cli_args.ofile, "w") as f:
+            json.dump(dict(meta=dict(timestamp=time.time(), nframes=cli_args.nframes), results=results), f, indent=1)
+        logger.info(f"Results written to {cli_args.ofile}.")
+    return 0
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare per-frame MPEHit decoding with numpy hit views over the receive ring.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--nsamples", type=int, nargs='+', default=[16, 256],
+                        help="Samples per hit to sweep.")
+    parser.add_argument("--nframes", type=int, default=2000,
+                        help="Hits per batch.")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="Batches analyzed per measurement.")
+    parser.add_argument("--ofile", type=str, default=None,
+                        help="JSON results file.")
+    parser.add_argument("--loglevel", type=str, default="INFO",
+                        help="Logger level")
+
+    cli_args = parser.parse_args()
+
+    logger.setLevel(cli_args.loglevel.upper())
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+                                      datefmt="%H:%M:%S"))
+    logger.addHandler(ch)
+
+    sys.exit(main(cli_args))
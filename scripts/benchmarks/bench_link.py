@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import resource
+import tempfile
+import itertools
+import threading
+import subprocess
+
+from pywub.control import wubCTL, parse_response
+from pywub.catalog import ctlg as wubCMD_catalog
+
+import logging
+
+
+logger = logging.getLogger()
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "standalone", "wub_simulator.py")
+
+# Fields that identify a case when comparing result sets.
+CASE_KEYS = ("commsmode", "store_mode", "baud", "rate", "nsamples", "output")
+
+# (field, True if higher is better) for the comparison mode.
+COMPARED = (("mb_per_s", True), ("frames_per_s", True), ("cpu_s_per_mb", False),
+            ("frames_lost", False), ("peak_rss_mb", False))
+
+
+class CountingSink():
+    '''Batch receiver datafile that counts bytes, and lines if count_lines, optionally passing them on to a file.
+
+    Writes may be any buffer: the 'ring' store mode writes memoryviews.
+    '''
+
+    def __init__(self, f=None, count_lines: bool = False):
+        self._f = f
+        self._count_lines = count_lines
+        self.nbytes = 0
+        self.nlines = 0
+
+    def write(self, data: bytes) -> int:
+        self.nbytes += len(data)
+        if self._count_lines:
+            self.nlines += bytes(data).count(b"\n")
+        if self._f is not None:
+            self._f.write(data)
+        return len(data)
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+
+
+def device_counters(wubctl: wubCTL) -> tuple[int, int]:
+    '''(hits, bytes) the device reports having transmitted (BINARY_STATS).'''
+    ok, values = parse_response(wubCMD_catalog.binary_stats, wubctl.cmd_binary_stats())
+    return (int(values[0]), int(values[1])) if ok and len(values) >= 2 else (0, 0)
+
+
+def settle_link(wubctl: wubCTL, quiet: float = 0.2, timeout: float = 10.0) -> bool:
+    '''Discard stream bytes still arriving after a stop, so the next response is read cleanly.
+
+    Returns:
+        bool: False if the link was still busy after timeout seconds (the device kept streaming).
+    '''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(quiet)
+        if wubctl.bytes_in_waiting == 0:
+            return True
+        wubctl.drain()
+    return False
+
+
+def run_case(case: dict, port: str, duration: float, tmpdir: str) -> dict:
+    '''Receive from a simulated base for `duration` seconds; runs in a worker process.'''
+    # Unthrottled cases still need a rate the simulated UART clock can produce.
+    baud = case['baud'] if case['baud'] > 0 else 1181818
+    wubctl = wubCTL(port, baud=baud, mode=case['commsmode'], store_mode=case['store_mode'], timeout=0.5)
+    wubctl.ensure_link()
+    wubctl.cmd_flush_events()
+    hits0, bytes0 = device_counters(wubctl)
+
+    ofile = None
+    if case['output'] == 'file':
+        ofile = os.path.join(tmpdir, f"bench_link_{os.getpid()}.dat")
+    # Lines are only counted for ASCII, where each one is a hit.
+    sink = CountingSink(open(ofile, "wb") if ofile is not None else None, count_lines=wubctl.isascii)
+
+    wubctl.prepare_batch()
+    rx_errors = []
+
+    def receive():
+        try:
+            wubctl.batchmode_recv(-1, 1, datafile=sink)
+        except Exception as e:
+            rx_errors.append(f"{type(e).__name__}: {e}")
+            raise
+    # A daemon thread, so a hung receiver cannot keep the worker alive.
+    rx_thread = threading.Thread(target=receive, daemon=True)
+
+    cpu_start = time.process_time()
+    tstart = time.perf_counter()
+    rx_thread.start()
+    time.sleep(duration)
+    wubctl.request_stop = True
+    rx_thread.join(10)
+    elapsed = time.perf_counter() - tstart
+    cpu = time.process_time() - cpu_start
+
+    sink.flush()
+    sink.close()
+    if ofile is not None:
+        os.unlink(ofile)
+
+    # A receiver that died or hung leaves the device streaming; report it rather than wait.
+    if len(rx_errors) > 0 or rx_thread.is_alive():
+        error = rx_errors[0] if len(rx_errors) > 0 else "receiver did not stop"
+        logger.error(f"Case {case}: {error}")
+        if not rx_thread.is_alive() and not wubctl.isascii:
+            wubctl.binary_stop_batch()
+            settle_link(wubctl)
+        return dict(case, error=error)
+    if not settle_link(wubctl):
+        return dict(case, error="link did not settle after the stop")
+    if not wubctl.isascii:
+        wubctl.cmd_ok()
+    hits1, bytes1 = device_counters(wubctl)
+    frames_sent, bytes_sent = hits1 - hits0, bytes1 - bytes0
+
+    if wubctl.isascii:
+        # One line per hit, plus the response to the stop command.
+        frames_recv = max(0, sink.nlines - 1)
+    elif case['store_mode'] == 'bulk':
+        frames_recv = None
+    else:
+        frames_recv = wubctl.nframes_binary
+
+    nbytes = wubctl.nbytes_recv
+    mb = nbytes / 1e6
+    return dict(case, duration=elapsed, complete=not rx_thread.is_alive(),
+                bytes_recv=nbytes, bytes_sent=bytes_sent,
+                frames_recv=frames_recv, frames_sent=frames_sent,
+                frames_lost=None if frames_recv is None else frames_sent - frames_recv,
+                bytes_lost=bytes_sent - nbytes, resyncs=wubctl.metrics.resyncs,
+                mb_per_s=mb / elapsed,
+                frames_per_s=None if frames_recv is None else frames_recv / elapsed,
+                cpu_s=cpu, cpu_s_per_mb=cpu / mb if mb > 0 else None,
+                peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def spawn_case(case: dict, cli_args) -> dict:
+    '''Run one case: a simulator process and a receiver process, so neither skews the other's CPU and memory.'''
+    sim_cmd = [sys.executable, "-u", SIMULATOR, "--rate", f"{case['rate']}",
+               "--nsamples", *[f"{n}" for n in case['nsamples']],
+               "--seed", "1", "--report_interval", "3600", "--loglevel", "WARNING"]
+    if case['baud'] <= 0:
+        sim_cmd += ["--no_throttle"]
+
+    sim = subprocess.Popen(sim_cmd, stdout=subprocess.PIPE, text=True)
+    try:
+        port = sim.stdout.readline().strip()
+        worker = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(case),
+                                 "--port", port, "--duration", f"{cli_args.duration}",
+                                 "--tmpdir", cli_args.tmpdir, "--loglevel", "ERROR"],
+                                stdout=subprocess.PIPE, text=True, timeout=cli_args.duration + 60)
+    except subprocess.TimeoutExpired:
+        logger.error(f"Case {case} timed out.")
+        return dict(case, error="timeout")
+    finally:
+        sim.terminate()
+        sim.wait()
+
+    lines = worker.stdout.strip().splitlines()
+    if worker.returncode != 0 or len(lines) == 0:
+        logger.error(f"Case {case} failed (exit code {worker.returncode}).")
+        return dict(case, error=f"exit code {worker.returncode}")
+    return json.loads(lines[-1])
+
+
+def case_key(result: dict) -> tuple:
+    return tuple(json.dumps(result.get(k)) for k in CASE_KEYS)
+
+
+def format_value(value, fmt: str) -> str:
+    return "-" if value is None else f"{value:{fmt}}"
+
+
+def print_results(results: list[dict]):
+    print(f"{'comms':6s} {'store':6s} {'baud':>8s} {'rate':>7s} {'nsamples':>9s} {'output':6s} "
+          f"{'MB/s':>8s} {'frames/s':>9s} {'CPU s/MB':>9s} {'lost':>6s} {'resyncs':>7s} {'RSS MB':>7s}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['commsmode']:6s} {r['store_mode']:6s} -- {r['error']}")
+            continue
+        baud = "max" if r['baud'] <= 0 else f"{r['baud']}"
+        nsamples = "-".join(f"{n}" for n in r['nsamples'])
+        print(f"{r['commsmode']:6s} {r['store_mode']:6s} {baud:>8s} {r['rate']:7.0f} {nsamples:>9s} {r['output']:6s} "
+              f"{format_value(r['mb_per_s'], '8.3f')} {format_value(r['frames_per_s'], '9.0f')} "
+              f"{format_value(r['cpu_s_per_mb'], '9.3f')} {format_value(r['frames_lost'], '6d')} "
+              f"{r['resyncs']:7d} {r['peak_rss_mb']:7.1f}")
+
+
+def compare(baseline_file: str, current_file: str, threshold: float) -> int:
+    '''Flag cases where current is worse than baseline by more than threshold (relative).
+
+    A baseline case that is missing from the current file, or failed there, counts
+    as a regression.
+
+    Returns:
+        int: Number of regressions.
+    '''
+    with open(baseline_file) as f:
+        baseline = [r for r in json.load(f)['results'] if 'error' not in r]
+    with open(current_file) as f:
+        current = {case_key(r): r for r in json.load(f)['results']}
+
+    nregressions = 0
+    for old in baseline:
+        label = " ".join(f"{k}={old[k]}" for k in CASE_KEYS)
+        r = current.get(case_key(old))
+        if r is None:
+            nregressions += 1
+            print(f"REGRESSION {label}: missing from {current_file}")
+            continue
+        if 'error' in r:
+            nregressions += 1
+            print(f"REGRESSION {label}: {r['error']}")
+            continue
+        for name, higher_is_better in COMPARED:
+            a, b = old.get(name), r.get(name)
+            if a is None or b is None:
+                continue
+            if name == 'frames_lost':
+                worse = b > a
+            elif a == 0:
+                worse = False
+            else:
+                change = (b - a) / abs(a)
+                worse = change < -threshold if higher_is_better else change > threshold
+            if worse:
+                nregressions += 1
+                print(f"REGRESSION {label}: {name} {a:.4g} -> {b:.4g}")
+
+    print(f"{nregressions} regression(s) over {len(baseline)} baseline case(s).")
+    return nregressions
+
+
+def main(cli_args):
+
+    if cli_args.worker is not None:
+        result = run_case(json.loads(cli_args.worker), cli_args.port, cli_args.duration, cli_args.tmpdir)
+        print(json.dumps(result))
+        return 0
+
+    if cli_args.compare is not None:
+        return 1 if compare(cli_args.compare[0], cli_args.compare[1], cli_args.threshold) > 0 else 0
+
+    nsamples = [[int(n) for n in spec.split("-")] for spec in cli_args.nsamples]
+    cases = []
+    for commsmode, store_mode, baud, rate, ns, output in itertools.product(
+            cli_args.commsmodes, cli_args.store_modes, cli_args.bauds, cli_args.rates, nsamples, cli_args.outputs):
+        if commsmode == 'ascii' and store_mode != cli_args.store_modes[0]:
+            # The ASCII receiver has no store modes.
+            continue
+        cases += [dict(commsmode=commsmode, store_mode=store_mode if commsmode == 'binary' else '-',
+                       baud=baud, rate=rate, nsamples=ns, output=output)]
+
+    results = []
+    for index, case in enumerate(cases):
+        logger.info(f"Case {index + 1}/{len(cases)}: {case}")
+        results += [spawn_case(case, cli_args)]
+
+    print_results(results)
+
+    if cli_args.ofile is not None:
+        meta = dict(timestamp=time.time(), host=socket.gethostname(), python=platform.python_version(),
+                    platform=platform.platform(), duration=cli_args.duration)
+        with open(cli_args.ofile, "w") as f:
+            json.dump(dict(meta=meta, results=results), f, indent=1)
+        logger.info(f"Results written to {cli_args.ofile}.")
+
+        if cli_args.baseline is not None:
+            return 1 if compare(cli_args.baseline, cli_args.ofile, cli_args.threshold) > 0 else 0
+    return 0
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark wubCTL batch receive throughput against simulated wuBases.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--commsmodes", type=str, nargs='+', default=['binary', 'ascii'],
+                        help="Comms modes to sweep.")
+    parser.add_argument("--store_modes", type=str, nargs='+', default=['bulk', 'sb', 'frame', 'ring'],
+                        help="BINARY store modes to sweep.")
+    parser.add_argument("--bauds", type=int, nargs='+', default=[1181818, 0],
+                        help="Baud rates to sweep; 0 streams as fast as the pty allows.")
+    parser.add_argument("--rates", type=float, nargs='+', default=[1000, 100000],
+                        help="Simulated hit rates (per second) to sweep.")
+    parser.add_argument("--nsamples", type=str, nargs='+', default=['16', '8-64'],
+                        help="Samples per hit to sweep: a number or a min-max range.")
+    parser.add_argument("--outputs", type=str, nargs='+', default=['none', 'file'], choices=['none', 'file'],
+                        help="Discard the data or write them to a file.")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="Seconds of data taking per case.")
+    parser.add_argument("--tmpdir", type=str, default=tempfile.gettempdir(),
+                        help="Directory for the output files of the 'file' cases.")
+    parser.add_argument("--ofile", type=str, default=None,
+                        help="JSON results file.")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Compare the new results against this results file.")
+    parser.add_argument("--compare", type=str, nargs=2, default=None, metavar=("BASELINE", "CURRENT"),
+                        help="Only compare two existing results files.")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative change counted as a regression.")
+    parser.add_argument("--loglevel", type=str, default="INFO",
+                        help="Logger level")
+
+    # Internal: run a single case in this process.
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=str, default=None, help=argparse.SUPPRESS)
+
+    cli_args = parser.parse_args()
+
+    logger.setLevel(cli_args.loglevel.upper())
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+                                      datefmt="%H:%M:%S"))
+    logger.addHandler(ch)
+
+    sys.exit(main(cli_args))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import resource
+import threading
+import subprocess
+
+from pywub.control import wubCTL
+from pywub.readout import wubReadoutEngine
+
+import logging
+
+
+logger = logging.getLogger()
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "standalone", "wub_simulator.py")
+
+
+def open_links(ports: list[str], baud: int) -> list[wubCTL]:
+    wubctls = []
+    for base, port in enumerate(ports):
+        wubctl = wubCTL(port, baud=baud, mode='binary', store_mode='frame', timeout=0.5,
+                        basenumber=base, revert_on_close=False)
+        wubctl.ensure_link()
+        wubctls += [wubctl]
+    return wubctls
+
+
+def read_threads(wubctls: list[wubCTL], duration: float) -> bool:
+    '''One batchmode_recv thread per base, as run_wub_daq.py and the daemon do.'''
+    threads = []
+    for wubctl in wubctls:
+        wubctl.prepare_batch()
+        threads += [threading.Thread(target=wubctl.batchmode_recv, args=(-1, 1), kwargs=dict(datafile=None))]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    for wubctl in wubctls:
+        wubctl.request_stop = True
+    for thread in threads:
+        thread.join(10)
+    return all(not thread.is_alive() for thread in threads)
+
+
+def read_engine(wubctls: list[wubCTL], duration: float) -> bool:
+    engine = wubReadoutEngine()
+    for wubctl in wubctls:
+        engine.add(wubctl)
+    engine.start_batches()
+    engine.run(duration=duration)
+    engine.close()
+    return True
+
+
+def run_case(case: dict, ports: list[str], duration: float) -> dict:
+    '''Receive from all simulated bases for `duration` seconds; runs in a worker process.'''
+    wubctls = open_links(ports, case['baud'])
+
+    cpu_start = time.process_time()
+    tstart = time.perf_counter()
+    complete = (read_engine if case['engine'] == 'select' else read_threads)(wubctls, duration)
+    elapsed = time.perf_counter() - tstart
+    cpu = time.process_time() - cpu_start
+
+    nbytes = sum(w.nbytes_recv for w in wubctls)
+    frames = sum(w.metrics.frames for w in wubctls)
+    resyncs = sum(w.metrics.resyncs for w in wubctls)
+    for wubctl in wubctls:
+        wubctl.close()
+
+    mb = nbytes / 1e6
+    return dict(case, duration=elapsed, complete=complete, bytes_recv=nbytes, frames_recv=frames,
+                resyncs=resyncs, mb_per_s=mb / elapsed, frames_per_s=frames / elapsed,
+                cpu_s=cpu, cpu_fraction=cpu / elapsed, cpu_s_per_mb=cpu / mb if mb > 0 else None,
+                peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def spawn_case(case: dict, cli_args) -> dict:
+    '''Run one case: simulator processes for the bases and a receiver process.'''
+    sims, ports = [], []
+    try:
+        remaining = case['nbases']
+        while remaining > 0:
+            nbases = min(remaining, cli_args.bases_per_simulator)
+            remaining -= nbases
+            sim = subprocess.Popen([sys.executable, "-u", SIMULATOR, "--nbases", f"{nbases}",
+                                    "--rate", f"{case['rate']}", "--nsamples", f"{case['nsamples']}",
+                                    "--seed", "1", "--report_interval", "3600", "--loglevel", "WARNING"],
+                                   stdout=subprocess.PIPE, text=True)
+            sims += [sim]
+            ports += [sim.stdout.readline().strip() for _ in range(nbases)]
+
+        worker = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(case),
+                                 "--ports", *ports, "--duration", f"{cli_args.duration}", "--loglevel", "ERROR"],
+                                stdout=subprocess.PIPE, text=True, timeout=cli_args.duration + 60 + 5 * case['nbases'])
+    finally:
+        for sim in sims:
+            sim.terminate()
+            sim.wait()
+
+    lines = worker.stdout.strip().splitlines()
+    if worker.returncode != 0 or len(lines) == 0:
+        logger.error(f"Case {case} failed (exit code {worker.returncode}).")
+        return dict(case, error=f"exit code {worker.returncode}")
+    return json.loads(lines[-1])
+
+
+def format_value(value, fmt: str) -> str:
+    return "-" if value is None else f"{value:{fmt}}"
+
+
+def print_results(results: list[dict]):
+    print(f"{'bases':>5s} {'engine':8s} {'MB/s':>8s} {'frames/s':>9s} {'CPU %':>6s} {'CPU s/MB':>9s} "
+          f"{'resyncs':>7s} {'RSS MB':>7s}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['nbases']:5d} {r['engine']:8s} -- {r['error']}")
+            continue
+        print(f"{r['nbases']:5d} {r['engine']:8s} {r['mb_per_s']:8.3f} {r['frames_per_s']:9.0f} "
+              f"{100 * r['cpu_fraction']:6.1f} {format_value(r['cpu_s_per_mb'], '9.3f')} "
+              f"{r['resyncs']:7d} {r['peak_rss_mb']:7.1f}")
+
+
+def main(cli_args):
+
+    if cli_args.worker is not None:
+        result = run_case(json.loads(cli_args.worker), cli_args.ports, cli_args.duration)
+        print(json.dumps(result))
+        return 0
+
+    cases = [dict(nbases=nbases, engine=engine, baud=cli_args.baud, rate=cli_args.rate, nsamples=cli_args.nsamples)
+             for nbases in cli_args.nbases for engine in cli_args.engines]
+
+    results = []
+    for index, case in enumerate(cases):
+        logger.info(f"Case {index + 1}/{len(cases)}: {case}")
+        results += [spawn_case(case, cli_args)]
+
+    print_results(results)
+
+    if cli_args.ofile is not None:
+        meta = dict(timestamp=time.time(), host=socket.gethostname(), python=platform.python_version(),
+                    platform=platform.platform(), ncpus=os.cpu_count(), duration=cli_args.duration)
+        with open(cli_args.ofile, "w") as f:
+            json.dump(dict(meta=meta, results=results), f, indent=1)
+        logger.info(f"Results written to {cli_args.ofile}.")
+    return 0
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare per-base receive threads with the single-thread readout engine "
+                                                 "on many simulated wuBases.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--nbases", type=int, nargs='+', default=[1, 6, 18],
+                        help="Numbers of bases to sweep.")
+    parser.add_argument("--engines", type=str, nargs='+', default=['threads', 'select'], choices=['threads', 'select'],
+                        help="Readout methods to compare.")
+    parser.add_argument("--baud", type=int, default=1181818,
+                        help="Baud rate of every link.")
+    parser.add_argument("--rate", type=float, default=20000,
+                        help="Simulated hit rate per base (per second); high rates fill the link.")
+    parser.add_argument("--nsamples", type=int, default=16,
+                        help="Samples per hit.")
+    parser.add_argument("--bases_per_simulator", type=int, default=3,
+                        help="Simulated bases per simulator process.")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="Seconds of data taking per case.")
+    parser.add_argument("--ofile", type=str, default=None,
+                        help="JSON results file.")
+    parser.add_argument("--loglevel", type=str, default="INFO",
+                        help="Logger level")
+
+    # Internal: run a single case in this process.
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--ports", type=str, nargs='+', default=None, help=argparse.SUPPRESS)
+
+    cli_args = parser.parse_args()
+
+    logger.setLevel(cli_args.loglevel.upper())
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+                                      datefmt="%H:%M:%S"))
+    logger.addHandler(ch)
+
+    sys.exit(main(cli_args))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+import subprocess
+
+from pywub.control import wubCTL
+
+import logging
+
+
+logger = logging.getLogger()
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "standalone", "wub_simulator.py")
+
+
+def run_case(case: dict, port: str, warmup: float, duration: float) -> dict:
+    '''Receive in `store_mode`, then measure the same with tracemalloc on; runs in a worker process.'''
+    wubctl = wubCTL(port, baud=1181818, mode='binary', store_mode=case['store_mode'], timeout=0.5,
+                    revert_on_close=False)
+    wubctl.ensure_link()
+    nlistened = [0]
+
+    def listener(frames, base, timestamp):
+        nlistened[0] += len(frames)
+    wubctl.add_frame_listener(listener)
+
+    sink = open(os.devnull, "wb")
+    wubctl.prepare_batch()
+    rx_thread = threading.Thread(target=wubctl.batchmode_recv, args=(-1, 1), kwargs=dict(datafile=sink))
+
+    rx_thread.start()
+    time.sleep(warmup)
+
+    # Throughput and CPU first, without the overhead of tracing.
+    frames0, bytes0 = wubctl.metrics.frames, wubctl.nbytes_recv
+    cpu_start = time.process_time()
+    tstart = time.perf_counter()
+    time.sleep(duration)
+    frames = wubctl.metrics.frames - frames0
+    nbytes = wubctl.nbytes_recv - bytes0
+    elapsed = time.perf_counter() - tstart
+    cpu = time.process_time() - cpu_start
+
+    # Then allocations in steady state: only what the receive loop allocates is seen.
+    tracemalloc.start()
+    time.sleep(0.1)
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    blocks0 = sys.getallocatedblocks()
+    traced0 = wubctl.metrics.frames
+    time.sleep(duration)
+    current, peak = tracemalloc.get_traced_memory()
+    blocks1 = sys.getallocatedblocks()
+    traced = wubctl.metrics.frames - traced0
+    tracemalloc.stop()
+
+    wubctl.request_stop = True
+    rx_thread.join(10)
+    sink.close()
+    wubctl.close()
+
+    mb = nbytes / 1e6
+    return dict(case, frames=frames, mb_per_s=mb / elapsed, frames_per_s=frames / elapsed,
+                cpu_s_per_mb=cpu / mb if mb > 0 else None,
+                peak_kb=(peak - baseline) / 1e3, growth_kb=(current - baseline) / 1e3,
+                peak_bytes_per_frame=(peak - baseline) / traced if traced > 0 else None,
+                block_growth=blocks1 - blocks0, listened=nlistened[0])
+
+
+def spawn_case(case: dict, cli_args) -> dict:
+    sim_cmd = [sys.executable, "-u", SIMULATOR, "--rate", f"{case['rate']}", "--nsamples", f"{case['nsamples']}",
+               "--memory_hits", "100000", "--seed", "1", "--report_interval", "3600", "--loglevel", "WARNING"]
+    if cli_args.no_throttle:
+        sim_cmd += ["--no_throttle"]
+    sim = subprocess.Popen(sim_cmd, stdout=subprocess.PIPE, text=True)
+    try:
+        port = sim.stdout.readline().strip()
+        worker = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(case),
+                                 "--port", port, "--warmup", f"{cli_args.warmup}",
+                                 "--duration", f"{cli_args.duration}", "--loglevel", "ERROR"],
+                                stdout=subprocess.PIPE, text=True, timeout=cli_args.warmup + 2 * cli_args.duration + 60)
+    finally:
+        sim.terminate()
+        sim.wait()
+
+    lines = worker.stdout.strip().splitlines()
+    if worker.returncode != 0 or len(lines) == 0:
+        logger.error(f"Case {case} failed (exit code {worker.returncode}).")
+        return dict(case, error=f"exit code {worker.returncode}")
+    return json.loads(lines[-1])
+
+
+def main(cli_args):
+
+    if cli_args.worker is not None:
+        print(json.dumps(run_case(json.loads(cli_args.worker), cli_args.port, cli_args.warmup, cli_args.duration)))
+        return 0
+
+    results = []
+    for nsamples in cli_args.nsamples:
+        for store_mode in cli_args.store_modes:
+            case = dict(store_mode=store_mode, rate=cli_args.rate, nsamples=nsamples)
+            logger.info(f"Case {case}")
+            results += [spawn_case(case, cli_args)]
+
+    print(f"{'store':6s} {'nsamples':>8s} {'MB/s':>8s} {'frames/s':>9s} {'CPU s/MB':>9s} "
+          f"{'peak kB':>8s} {'peak B/frame':>12s} {'growth kB':>9s} {'blocks':>7s}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['store_mode']:6s} {r['nsamples']:8d} -- {r['error']}")
+            continue
+        print(f"{r['store_mode']:6s} {r['nsamples']:8d} {r['mb_per_s']:8.3f} {r['frames_per_s']:9.0f} "
+              f"{r['cpu_s_per_mb']:9.3f} {r['peak_kb']:8.1f} {r['peak_bytes_per_frame']:12.3f} "
+              f"{r['growth_kb']:9.1f} {r['block_growth']:7d}")
+
+    if cli_args.ofile is not None:
+        with open(cli_args.ofile, "w") as f:
+            json.dump(dict(meta=dict(timestamp=time.time(), duration=cli_args.duration), results=results), f, indent=1)
+        logger.info(f"Results written to {cli_args.ofile}.")
+    return 0
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Measure what the BINARY receive path allocates per frame with tracemalloc.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--store_modes", type=str, nargs='+', default=['frame', 'ring'],
+                        help="Store modes to compare.")
+    parser.add_argument("--rate", type=float, default=50000,
+                        help="Simulated hit rate (per second).")
+    parser.add_argument("--nsamples", type=int, nargs='+', default=[16, 256],
+                        help="Samples per hit to sweep.")
+    parser.add_argument("--no_throttle", action='store_true',
+                        help="Stream as fast as the pty allows instead of at the baud rate.")
+    parser.add_argument("--warmup", type=float, default=1.0,
+                        help="Seconds to run before measuring.")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="Seconds measured per case.")
+    parser.add_argument("--ofile", type=str, default=None,
+                        help="JSON results file.")
+    parser.add_argument("--loglevel", type=str, default="INFO",
+                        help="Logger level")
+
+    # Internal: run a single case in this process.
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=str, default=None, help=argparse.SUPPRESS)
+
+    cli_args = parser.parse_args()
+
+    logger.setLevel(cli_args.loglevel.upper())
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+                                      datefmt="%H:%M:%S"))
+    logger.addHandler(ch)
+
+    sys.exit(main(cli_args))
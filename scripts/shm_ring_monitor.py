@@ -0,0 +1,46 @@
+#!/usr/bin/env python 
+
+import time
+
+from pywub.shmring import wubShmRingConsumer
+
+    
+def main(name, interval):
+
+    consumer = wubShmRingConsumer(name)
+    print(f"Attached to shared memory ring '{name}'.")
+
+    nframes = {}
+    tlast = time.time()
+    try:
+        while True:
+            msg = consumer.read(timeout=interval)
+            if msg is not None:
+                nframes[msg.base] = nframes.get(msg.base, 0) + 1
+
+            tnow = time.time()
+            if tnow - tlast >= interval:
+                rates = " ".join([f"base {base}: {n/(tnow - tlast):8.1f} Hz" for base, n in sorted(nframes.items())])
+                print(f"{time.ctime(tnow)}  {rates}  (lag: {consumer.lag} bytes, lost: {consumer.nbytes_lost} bytes)")
+                nframes = {}
+                tlast = tnow
+
+    except KeyboardInterrupt:
+        pass
+
+    consumer.close()
+
+
+if __name__ == "__main__": 
+    
+    import argparse
+    parser = argparse.ArgumentParser(description="Print per-base frame rates from a live shared memory ring.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--name", type=str, required=True, 
+                        help="Shared memory ring name given to run_wub_daq.py --shm_ring")
+    parser.add_argument("--interval", type=float, default=1.0, 
+                        help="Seconds between rate printouts.")
+
+    cli_args = parser.parse_args()  
+
+    main(cli_args.name, cli_args.interval)
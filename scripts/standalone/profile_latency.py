@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import sys
+import json
+
+from pywub.control import wubCTL as wubCTL
+from pywub.control import parse_response
+from pywub.catalog import ctlg as wubCMD_catalog
+from pywub.latency import wubLatencyProfiler, format_report, diff_reports, DEFAULT_COMMANDS
+
+import logging
+
+
+logger = logging.getLogger()
+
+
+def parse_command(spec: str) -> tuple:
+    '''"DAC 1 2000" -> ("DAC", [1, 2000])'''
+    name, *args = spec.split()
+    return name.upper(), [int(a) if a.lstrip('-').isdigit() else float(a) for a in args]
+
+
+def firmware_version(wubctl: wubCTL) -> str:
+    ok, values = parse_response(wubCMD_catalog.version, wubctl.cmd_version())
+    if not ok:
+        return None
+    # Binary responses carry the version strings NUL-padded.
+    return " ".join(v.rstrip(b"\x00").decode(errors='replace') if isinstance(v, bytes) else f"{v}" for v in values)
+
+
+def main(cli_args):
+
+    if cli_args.diff is not None:
+        with open(cli_args.diff[0]) as f:
+            baseline = json.load(f)
+        with open(cli_args.diff[1]) as f:
+            current = json.load(f)
+        lines = diff_reports(baseline, current, cli_args.threshold)
+        print("\n".join(lines) if len(lines) > 0 else "No significant changes.")
+        sys.exit(0)
+
+    wubctl = wubCTL(cli_args.port, baud=cli_args.baud, mode=cli_args.commsmode, timeout=cli_args.timeout)
+    wubctl.ensure_link()
+
+    meta = dict(version=firmware_version(wubctl), uid=wubctl.device_uid(), n=cli_args.n)
+
+    commands = DEFAULT_COMMANDS if cli_args.commands is None else [parse_command(c) for c in cli_args.commands]
+    profiler = wubLatencyProfiler(wubctl, commands, timeout=cli_args.timeout,
+                                  block_factor=cli_args.block_factor, block_margin=cli_args.block_margin * 1e-3)
+
+    logger.info(f"Profiling {len(profiler.stats)} commands x {cli_args.n} on {cli_args.port}...")
+    profiler.run(cli_args.n, warmup=cli_args.warmup)
+    report = profiler.report(meta)
+    print(format_report(report))
+
+    if cli_args.ofile is not None:
+        with open(cli_args.ofile, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        logger.info(f"Report written to {cli_args.ofile}.")
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Profile slow-control round-trip latency with ECHO_PACKET and other commands.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--port", type=str, default=None,
+                        help="UART port of wuBase")
+
+    parser.add_argument("--baud", type=int, default=1181818,
+                        help="Baudrate.")
+
+    parser.add_argument("--commsmode", type=str, default='binary',
+                        help="Comms mode (ascii or binary)")
+
+    parser.add_argument("--timeout", type=float, default=1.0,
+                        help="Seconds to wait for a response.")
+
+    parser.add_argument("--n", type=int, default=1000,
+                        help="Round trips per command.")
+
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="Untimed round trips per command first.")
+
+    parser.add_argument("--commands", type=str, nargs='+', default=None,
+                        help="Commands to profile with their arguments, e.g. \"GET_UID\" \"DAC 1 2000\" "
+                             "(default: a set of read-only commands). ECHO_PACKET is always included.")
+
+    parser.add_argument("--block_factor", type=float, default=4.0,
+                        help="Flag commands whose turnaround exceeds ECHO_PACKET's (median) or their own median (p99) by this factor.")
+
+    parser.add_argument("--block_margin", type=float, default=0.5,
+                        help="Milliseconds added to the blocking thresholds.")
+
+    parser.add_argument("--ofile", type=str, default=None,
+                        help="JSON report file.")
+
+    parser.add_argument("--diff", type=str, nargs=2, default=None, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two JSON reports instead of profiling.")
+
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative latency change reported by --diff.")
+
+    parser.add_argument("--loglevel", type=str, default="INFO",
+                        help="Logger level")
+
+    cli_args = parser.parse_args()
+
+    if cli_args.diff is None and cli_args.port is None:
+        parser.error("--port is required unless --diff is given.")
+
+    logger.setLevel(cli_args.loglevel.upper())
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+                                      datefmt="%H:%M:%S"))
+    logger.addHandler(ch)
+
+    main(cli_args)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import sys
+
+from pywub.control import wubCTL as wubCTL
+from pywub.catalog import mask_to_base_numbers
+from pywub.calibration import wubCalibrationRunner, PROCEDURES
+
+import logging
+
+
+logger = logging.getLogger()
+
+
+def main(cli_args):
+
+    bases = cli_args.bases if cli_args.bases is not None else list(range(len(cli_args.ports)))
+    if len(bases) != len(cli_args.ports):
+        logger.error("--bases needs one base number per port.")
+        sys.exit(1)
+
+    selected = None if cli_args.mask is None else set(mask_to_base_numbers(int(cli_args.mask, 16)))
+
+    wubctls = []
+    for port, base in zip(cli_args.ports, bases):
+        if selected is not None and base not in selected:
+            continue
+        wubctls += [wubCTL(port, baud=cli_args.baud, mode='ascii',
+                           timeout=cli_args.timeout, basenumber=base)]
+
+    if len(wubctls) == 0:
+        logger.error("No bases selected.")
+        sys.exit(1)
+
+    logger.info(f"Running {cli_args.procedure} {cli_args.args} on bases {[w.basenumber for w in wubctls]}.")
+    runner = wubCalibrationRunner(wubctls, cli_args.procedure, cli_args.args,
+                                  poll_initial=cli_args.poll_initial,
+                                  poll_max=cli_args.poll_max,
+                                  timeout=cli_args.max_time)
+    results = runner.run()
+
+    for res in results:
+        duration = f"{res.duration:8.1f} s" if res.duration is not None else "       - "
+        logger.info(f"Base {res.base:2d}  {res.state:8s} {duration}  {res.result}")
+    logger.info(f"Wall-clock time: {runner.tstop - runner.tstart:.1f} s")
+
+    if cli_args.ofile is not None:
+        runner.write_results(cli_args.ofile)
+
+    sys.exit(0 if all(res.state == 'done' for res in results) else 1)
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Run an HV scan or calibration on several wuBases in parallel.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--ports", type=str, nargs='+', required=True,
+                        help="UART ports, one per wuBase.")
+
+    parser.add_argument("--bases", type=int, nargs='+', default=None,
+                        help="Base number of each port (default: 0, 1, ...).")
+
+    parser.add_argument("--mask", type=str, default=None,
+                        help="Hex mask of the base numbers to run on (default: all).")
+
+    parser.add_argument("--procedure", type=str, default='quickscan', choices=list(PROCEDURES),
+                        help="Procedure to run.")
+
+    parser.add_argument("--args", type=float, nargs='*', default=[],
+                        help="Arguments of the start command (e.g. the QUICKSCAN voltage).")
+
+    parser.add_argument("--baud", type=int, default=115200,
+                        help="Baudrate.")
+
+    parser.add_argument("--timeout", type=int, default=1,
+                        help="Socket-level timeout time to wait for a byte.")
+
+    parser.add_argument("--poll_initial", type=float, default=1.0,
+                        help="Seconds before the first status poll of each base.")
+
+    parser.add_argument("--poll_max", type=float, default=30.0,
+                        help="Longest interval between status polls.")
+
+    parser.add_argument("--max_time", type=float, default=None,
+                        help="Abort bases that are still running after this many seconds.")
+
+    parser.add_argument("--ofile", type=str, default=None,
+                        help="JSON results file.")
+
+    parser.add_argument("--loglevel", type=str, default="INFO",
+                        help="Logger level")
+
+    cli_args = parser.parse_args()
+
+    # The start commands take integer and floating point arguments; ASCII mode
+    # sends them as written, so keep whole numbers as ints.
+    cli_args.args = [int(a) if float(a).is_integer() else a for a in cli_args.args]
+
+    logger.setLevel(cli_args.loglevel.upper())
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+                                      datefmt="%H:%M:%S"))
+    logger.addHandler(ch)
+
+    main(cli_args)
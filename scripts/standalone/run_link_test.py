@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+import importlib
+import threading
+
+from pywub.control import wubCTL as wubCTL
+from pywub.linktest import wubLinkTestValidator, validate_file, format_report
+
+import logging
+
+
+logger = logging.getLogger()
+
+
+def settle_link(wubctl: wubCTL, quiet: float = 0.2):
+    '''Discard stream bytes still arriving after a stop.'''
+    while True:
+        time.sleep(quiet)
+        if wubctl.bytes_in_waiting == 0:
+            return
+        wubctl.drain()
+
+
+def load_pattern(spec: str):
+    '''"module:function" -> the frame function of a test pattern other than pywub.linktest.test_frame.'''
+    if spec is None:
+        return None
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def link_ok(report: dict, max_misaligned: float) -> bool:
+    '''Frames were checked, (nearly) all of them aligned, with no bit errors, losses or slips.'''
+    nseen = report['nframes'] + report['nframes_misaligned']
+    return (report['nframes'] > 0 and not report['pattern_mismatch']
+            and report['nframes_misaligned'] <= max_misaligned * nseen
+            and report['nbit_errors'] == 0 and report['nframes_lost'] == 0 and report['nslips'] == 0)
+
+
+def run_live(cli_args) -> dict:
+    wubctl = wubCTL(cli_args.port, baud=cli_args.baud, mode='binary', store_mode='frame',
+                    timeout=cli_args.timeout)
+    wubctl.ensure_link()
+
+    validator = wubLinkTestValidator(cli_args.nsamples, confidence=cli_args.confidence,
+                                     pattern=load_pattern(cli_args.pattern))
+    wubctl.add_frame_listener(validator.check_frames)
+    wubctl.cmd_testpackets(1, cli_args.nsamples)
+
+    wubctl.prepare_batch()
+    rx_thread = threading.Thread(target=wubctl.batchmode_recv, args=(-1, 1), kwargs=dict(datafile=None))
+
+    logger.info(f"Checking TESTPACKETS ({cli_args.nsamples} samples) on {cli_args.port} at {wubctl._s.baudrate} baud; "
+                f"Ctrl-C to stop.")
+    tstart = time.time()
+    rx_thread.start()
+    deadline = tstart + cli_args.duration if cli_args.duration > 0 else None
+    next_report = tstart + cli_args.report_interval
+    try:
+        while rx_thread.is_alive():
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                break
+            if validator.pattern_mismatch:
+                logger.error("Stopping: the stream does not match the test pattern (see --pattern).")
+                break
+            if now >= next_report:
+                logger.info(f"{now - tstart:.0f} s: " + format_report(validator.report()))
+                next_report += cli_args.report_interval
+            rx_thread.join(0.5)
+    except KeyboardInterrupt:
+        logger.info("KeyboardInterrupt detected. Stopping.")
+
+    wubctl.request_stop = True
+    rx_thread.join(10)
+    tstop = time.time()
+    wubctl.remove_frame_listener(validator.check_frames)
+    validator.add_resyncs(wubctl.metrics.resyncs)
+
+    settle_link(wubctl)
+    wubctl.cmd_testpackets(0, cli_args.nsamples)
+
+    report = validator.report()
+    report.update(port=cli_args.port, baud=wubctl._s.baudrate, tstart=tstart, tstop=tstop,
+                  nbytes_recv=wubctl.nbytes_recv)
+    return report
+
+
+def main(cli_args):
+
+    if cli_args.file is not None:
+        validator = validate_file(cli_args.file, cli_args.nsamples, confidence=cli_args.confidence,
+                                  pattern=load_pattern(cli_args.pattern))
+        report = validator.report()
+        report.update(file=cli_args.file)
+    else:
+        report = run_live(cli_args)
+
+    logger.info(format_report(report))
+
+    if cli_args.ofile is not None:
+        with open(cli_args.ofile, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        logger.info(f"Report written to {cli_args.ofile}.")
+
+    if report['nframes'] == 0:
+        logger.error("No frame matched the test pattern; nothing was checked.")
+    sys.exit(0 if link_ok(report, cli_args.max_misaligned) else 1)
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Bit-error test of the link: check the TESTPACKETS stream live or from a file. "
+                                                 "The stream is assumed to follow the simulator's test pattern "
+                                                 "(pywub.linktest.test_frame) unless --pattern is given.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--port", type=str, default=None,
+                        help="UART port of wuBase (live test of its TESTPACKETS stream).")
+
+    parser.add_argument("--file", type=str, default=None,
+                        help="Check a recorded TESTPACKETS file instead ('bulk' or 'frame' store mode).")
+
+    parser.add_argument("--pattern", type=str, default=None,
+                        help="Test pattern as MODULE:FUNCTION, a function (index, nsamples) -> frame bytes with "
+                             "START_BYTE; pywub.linktest:test_frame if not given.")
+
+    parser.add_argument("--max_misaligned", type=float, default=0.0,
+                        help="Fraction of misaligned frames tolerated before the test fails.")
+
+    parser.add_argument("--baud", type=int, default=1181818,
+                        help="Baudrate.")
+
+    parser.add_argument("--timeout", type=float, default=1.0,
+                        help="Serial timeout in seconds.")
+
+    parser.add_argument("--nsamples", type=int, default=16,
+                        help="Samples per test frame.")
+
+    parser.add_argument("--duration", type=float, default=0,
+                        help="Seconds to run the live test (0 runs until Ctrl-C).")
+
+    parser.add_argument("--report_interval", type=float, default=60.0,
+                        help="Seconds between progress reports.")
+
+    parser.add_argument("--confidence", type=float, default=0.95,
+                        help="Confidence level of the BER bounds.")
+
+    parser.add_argument("--ofile", type=str, default=None,
+                        help="JSON report file.")
+
+    parser.add_argument("--loglevel", type=str, default="INFO",
+                        help="Logger level")
+
+    cli_args = parser.parse_args()
+
+    if (cli_args.port is None) == (cli_args.file is None):
+        parser.error("Give either --port or --file.")
+
+    logger.setLevel(cli_args.loglevel.upper())
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+                                      datefmt="%H:%M:%S"))
+    logger.addHandler(ch)
+
+    main(cli_args)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+
+from pywub.control import wubCTL as wubCTL
+from pywub.sequencer import wubSetupSequencer
+from pywub.sweep import wubSweepRunner, sweep_points, format_summary
+
+import logging
+
+
+logger = logging.getLogger()
+
+
+def parse_values(text: str) -> list[int]:
+    '''"1000:3000:500" (inclusive) or "1000,1500,2500".'''
+    if ":" in text:
+        start, stop, step = (int(v) for v in text.split(":"))
+        return list(range(start, stop + (1 if step > 0 else -1), step))
+    return [int(v) for v in text.split(",")]
+
+
+def build_axes(cli_args) -> list:
+    axes = []
+    if cli_args.dac is not None:
+        axes += [("DAC", [[cli_args.dac_channel, v] for v in parse_values(cli_args.dac)])]
+    if cli_args.thresholds is not None:
+        axes += [("TRIGGER_THRESHOLDS", [[float(v) for v in t.split(",")] for t in cli_args.thresholds])]
+    return axes
+
+
+def main(cli_args):
+
+    axes = build_axes(cli_args)
+    points = sweep_points(axes)
+    logger.info(f"{len(points)} sweep points, {cli_args.dwell} s each.")
+
+    wubctl = wubCTL(cli_args.port, baud=cli_args.baud, mode='binary', timeout=cli_args.timeout,
+                    store_mode=cli_args.store_mode, basenumber=cli_args.base)
+    wubctl.ensure_link()
+
+    if cli_args.config is not None:
+        # One-off setup (FPGA, ADC, pulser) before the sweep.
+        report = wubSetupSequencer(wubctl).run_config(cli_args.config)
+        logger.info(report.format())
+        if not report.ok:
+            logger.error("Setup did not complete; not sweeping.")
+            return 1
+
+    runner = wubSweepRunner(wubctl, points, dwell=cli_args.dwell, odir=cli_args.odir,
+                            baseline_samples=cli_args.baseline_samples)
+    tstart = time.perf_counter()
+    try:
+        results = runner.run()
+    except KeyboardInterrupt:
+        logger.info("KeyboardInterrupt detected. Stopping the sweep.")
+        runner.stop()
+        results = runner.results
+    elapsed = time.perf_counter() - tstart
+
+    print(format_summary(results))
+    logger.info(f"Sweep of {len(results)} points took {elapsed:.1f} s "
+                f"({elapsed - sum(r.t_acquire for r in results):.2f} s outside acquisition).")
+
+    if cli_args.ofile is not None:
+        with open(cli_args.ofile, "w") as f:
+            json.dump(dict(meta=dict(timestamp=time.time(), port=cli_args.port, dwell=cli_args.dwell,
+                                     duration=elapsed),
+                           results=[r.to_dict() for r in results]), f, indent=1)
+        logger.info(f"Summary written to {cli_args.ofile}.")
+
+    return 0 if all(r.ok for r in results) else 1
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Sweep DAC values and trigger thresholds on an open link, "
+                                                 "analyzing each point while the next one is taken.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--port", type=str, required=True,
+                        help="UART port of wuBase")
+
+    parser.add_argument("--baud", type=int, default=1181818,
+                        help="Baudrate.")
+
+    parser.add_argument("--timeout", type=float, default=1.0,
+                        help="Serial timeout in seconds.")
+
+    parser.add_argument("--config", type=str, default=None,
+                        help="Setup commands run once before the sweep (e.g. FPGALOAD, ADCCONFIG, PULSER_SETUP, PULSER_START).")
+
+    parser.add_argument("--dac", type=str, default=None,
+                        help="DAC values to sweep: START:STOP:STEP or a comma-separated list.")
+
+    parser.add_argument("--dac_channel", type=int, default=1,
+                        help="DAC channel to sweep.")
+
+    parser.add_argument("--thresholds", type=str, nargs='+', default=None,
+                        help="TRIGGER_THRESHOLDS settings to sweep, each four comma-separated values.")
+
+    parser.add_argument("--dwell", type=float, default=2.0,
+                        help="Seconds of data taking per point.")
+
+    parser.add_argument("--odir", type=str, default=None,
+                        help="Write each point's hits to a record file in this directory instead of keeping them in memory.")
+
+    parser.add_argument("--store_mode", type=str, default='ring',
+                        help="Store mode of the receiver ('frame' or 'ring').")
+
+    parser.add_argument("--baseline_samples", type=int, default=4,
+                        help="Leading samples of each hit used for the baseline and the noise.")
+
+    parser.add_argument("--base", type=int, default=0,
+                        help="wuBase number recorded with each frame.")
+
+    parser.add_argument("--ofile", type=str, default=None,
+                        help="JSON summary file.")
+
+    parser.add_argument("--loglevel", type=str, default="INFO",
+                        help="Logger level")
+
+    cli_args = parser.parse_args()
+
+    if cli_args.dac is None and cli_args.thresholds is None:
+        parser.error("Give --dac and/or --thresholds.")
+    if cli_args.thresholds is not None and any(len(t.split(",")) != 4 for t in cli_args.thresholds):
+        parser.error("Each --thresholds setting needs four comma-separated values.")
+
+    logger.setLevel(cli_args.loglevel.upper())
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+                                      datefmt="%H:%M:%S"))
+    logger.addHandler(ch)
+
+    sys.exit(main(cli_args))
@@ -3,13 +3,18 @@
 import time
 import sys
 import threading
-from collections import deque 
 
 
 from pywub.control import wubCTL as wubCTL
 from pywub.catalog import parse_setup_config
-from pywub.catalog import ctlg as wubCMD_catalog
 from pywub.catalog import wubCMD_RC
+from pywub.metrics import wubMetricsExporter
+from pywub.monitor import wubRunMonitor
+from pywub.batching import wubBatchScheduler
+from pywub.segments import wubSegmentedWriter
+from pywub.shmring import wubShmRingProducer
+from pywub.stream_server import wubFrameStreamServer
+from pywub.sequencer import wubSetupSequencer
 
 import logging 
 
@@ -24,136 +29,114 @@ def main(cli_args):
                     mode=cli_args.commsmode, timeout=cli_args.timeout, 
                     verbosity=cli_args.verbose,
                     store_mode=cli_args.store_mode, 
-                    parity=cli_args.parity)
+                    parity=cli_args.parity,
+                    basenumber=cli_args.base,
+                    state_file=cli_args.state_file,
+                    revert_on_close=not cli_args.keep_link)
+
+    metrics_exporter = None
+    if cli_args.metrics_file is not None:
+        logger.info(f"Exporting link metrics to {cli_args.metrics_file} ({cli_args.metrics_format}).")
+        metrics_exporter = wubMetricsExporter(wubctl.metrics, cli_args.metrics_file, 
+                                              fmt=cli_args.metrics_format, 
+                                              interval=cli_args.metrics_interval)
+        metrics_exporter.start()
 
     config = parse_setup_config(cli_args.config)
     setup_commands = config['setup']
 
-    #The following two commands override send_recv because of the way commsmode is set up.
-    # The device boots in autobaud mode and this doesn't work at higher baudrates, so:
-    logger.info("Setting wuBase baud rate to fixed...")
-    resp = wubctl.send_recv_ascii(wubCMD_catalog.baud, cli_args.baud)
-    logger.debug(f"Response: {resp['response']}")
-    #Check if the device was already in autobaud mode: 
-    if resp['response'][0] == '?':
-        logger.warning("Invalid command response; possibly the device was already in fixed baud mode. ")
-    
-    # The device boots in asciimode, so ensure that it is operating in the right mode: 
-    if not wubctl.isascii:
-        logger.info("Sending BINARYMODE command to wuBase.")
-        resp = wubctl.send_recv_ascii(wubCMD_catalog.binarymode)
-        logger.debug(f"Response: {resp['response']}")
+    # The device boots in autobaud ASCII mode, which doesn't work at higher baudrates. 
+    # Only the transitions the device still needs are sent (see wubCTL.ensure_link).
+    if cli_args.negotiate_baud:
+        logger.info("Negotiating the fastest error-free baud rate...")
+        rate = wubctl.negotiate_baud(cache_file=cli_args.baud_cache)
+        if rate is None:
+            logger.error(f"Baud negotiation failed; continuing at {cli_args.baud} baud.")
+        else:
+            logger.info(f"Using {rate} baud.")
 
+    logger.info("Setting up the wuBase link...")
+    transitions = wubctl.ensure_link(mode=cli_args.commsmode)
+    logger.info(f"Link transitions sent: {transitions if len(transitions) > 0 else 'none'}")
 
-    retries = 0
-    error_detect = False
-    logger.info("Executing setup commands...")
-    for setup_cmd in setup_commands:
-        while True:
-            setup_cmd_name = str.upper(setup_cmd['name'])
-            setup_cmd_args = setup_cmd['args']
-            sleeptime = setup_cmd['sleeptime']
-            logger.info(f"COMMAND: {setup_cmd_name}\tArgs: {setup_cmd_args}")           
-
-            cmd = wubCMD_catalog.get_command(setup_cmd_name)
-            response = None
-
-            
-
-            if setup_cmd_args is not None:
-                response = wubctl.send_recv(cmd, *setup_cmd_args)
-            else:
-                response = wubctl.send_recv(cmd)
-           
-            if wubctl.isascii:
-                if response['response'][0] != '?':
-                    logger.info(f"Command response: {response['response']}")
-                    retries = 0
-                    break
-                else:
-                    logger.warning(f"Issue executing command. Retrying {retries+1}/10.")
-                    if retries > 10:
-                        logger.error(f"\tERROR: Number of retries exceeds threshold. Exiting...")
-                        error_detect = True
-                        break
-                    retries+=1
-            else:
-                response = response['response'] #Strip out this layer.
-                logger.info(f"CMD_RC: {wubCMD_RC(response['CMD_RC']).name}")
-
-                if response['CMD_RC'] == wubCMD_RC.CMD_RC_OK:
-                    logger.info(f"CMD_retargs: {response['retargs']}")       
-                    retries = 0 
-                    break
-                else:
-                    logger.warning(f"Issue executing command. Retrying {retries+1}/10.")
-                    if retries > 10:
-                        logger.error(f"\tERROR: Number of retries exceeds threshold. Exiting...")
-                        error_detect = True
-                        break
-                    retries+=1
-                
-            time.sleep(float(sleeptime))
 
-        
-        print("-----------------------------------------")    
+    # Commands are sent back to back; only those with a settle policy (FPGALOAD, 
+    # ADCCONFIG, HV changes) wait, by polling the device rather than sleeping.
+    logger.info("Executing setup commands...")
+    sequencer = wubSetupSequencer(wubctl)
+    setup_report = sequencer.run(setup_commands)
+    logger.info(setup_report.format())
+    if not setup_report.ok:
+        logger.error("Setup did not complete; see above.")
+    print("-----------------------------------------")    
 
     output_handler = None
     if cli_args.ofile is not None:
-        logger.info(f"Opening {cli_args.ofile} for data logging.")
-        if wubctl.isascii:
-            output_handler = open(cli_args.ofile, "w")
-        else: 
+        if cli_args.segment_size > 0 or cli_args.segment_time > 0:
+            logger.info(f"Writing segmented output based on {cli_args.ofile}.")
+            output_handler = wubSegmentedWriter(cli_args.ofile, 
+                                                max_bytes=int(cli_args.segment_size * 1e6),
+                                                max_seconds=cli_args.segment_time,
+                                                fsync_interval=cli_args.fsync_interval)
+        else:
+            logger.info(f"Opening {cli_args.ofile} for data logging.")
             output_handler = open(cli_args.ofile, "wb")
+    shm_ring = None
+    if cli_args.shm_ring is not None:
+        if cli_args.store_mode not in ('frame', 'ring'):
+            logger.warning("Live frames are only published in 'frame' and 'ring' store modes.")
+        shm_ring = wubShmRingProducer(cli_args.shm_ring, capacity=int(cli_args.shm_ring_size * 1e6))
+        wubctl.add_frame_listener(shm_ring.publish_frames)
+        logger.info(f"Publishing frames to shared memory ring '{shm_ring.name}'.")
+
+    stream_server = None
+    if cli_args.stream_socket is not None:
+        if cli_args.store_mode not in ('frame', 'ring'):
+            logger.warning("Live frames are only streamed in 'frame' and 'ring' store modes.")
+        stream_server = wubFrameStreamServer(cli_args.stream_socket)
+        stream_server.start()
+        wubctl.add_frame_listener(stream_server.publish_frames)
+
+    # Attach the monitor before the thread starts so it cannot miss the end of the batch.
+    monitor = wubRunMonitor(interval=1.0, maxruntime=cli_args.runtime, 
+                            stall_timeout=cli_args.stall_timeout, 
+                            expected_frames=cli_args.ntosend)
+    monitor.add_wubctl(wubctl)
+
     # Now start the batchmode recieve thread. 
-    rx_thread=threading.Thread(target=wubctl.batchmode_recv, args=(cli_args.ntosend, 1), kwargs=dict(datafile=output_handler))
+    if cli_args.scheduled_batches and not wubctl.isascii and cli_args.store_mode in ('frame', 'ring'):
+        logger.info("Draining the wuBase with scheduled bounded batches.")
+        rx_thread=threading.Thread(target=wubctl.scheduled_batchmode_recv, args=(cli_args.ntosend,),
+                                   kwargs=dict(datafile=output_handler, scheduler=wubBatchScheduler(quiet_time=cli_args.quiet_time)))
+    else:
+        if cli_args.scheduled_batches:
+            logger.warning("Scheduled batches need BINARY comms and 'frame' or 'ring' store mode; using one open-ended batch.")
+        rx_thread=threading.Thread(target=wubctl.batchmode_recv, args=(cli_args.ntosend, 1), kwargs=dict(datafile=output_handler))
 
     rx_thread.start()
 
-    bytes_tracker = deque(['0','0','0'], maxlen=3)
-    maxruntime = cli_args.runtime    
-    tlast = time.time()
-    tstart = time.time()
-    
-
     try:
-        while True:            
-            tnow = time.time()
-            if  tnow - tlast > 1: 
-                tlast = tnow
-                if not wubctl._batch_mode_running:
-                    logger.info("End of batch data readout. Exiting.")
-                    break
-
-                if wubctl.isascii:
-                    info_str = f"Progress: {wubctl.nbytes_recv:8.4e} bytes"
-                else:
-                    #{wubctl.nframes_binary} frames 
-                    info_str = f"Progress: {wubctl.nbytes_recv:8.4e} bytes -- bytes in_waiting: {wubctl.bytes_in_waiting}"
-
-                    
-                bytes_tracker.append(wubctl.nbytes_recv)
-                logger.info(info_str)
-                
-                if(len(set(bytes_tracker)) == 1):
-                    logger.warning("No new data in the last second.")
-
-            if maxruntime > 0 and tnow - tstart > maxruntime:
-                logger.info("DAQ runtime exceeded... Exiting.")
-                wubctl.request_stop = True          
-                break
+        reason = monitor.run()
+        if reason == 'done':
+            logger.info("End of batch data readout. Exiting.")
+        elif reason == 'runtime':
+            logger.info("DAQ runtime exceeded... Exiting.")
+            wubctl.request_stop = True          
 
     except KeyboardInterrupt: 
         wubctl.request_abort = True
         logger.info("KeyboardInterrupt detected. Exiting batch readout.")
-        
-    time.sleep(1)
 
     # make sure the reception thread is really gone
     rx_thread.join(5)
     if rx_thread.is_alive():
         logger.error(f"Rx thread failed to complete!")
 
+    if len(wubctl.overflow_events) > 0:
+        logger.warning(f"Host receive buffer came close to overflowing {len(wubctl.overflow_events)} time(s):")
+        for event in wubctl.overflow_events:
+            logger.warning(f"\t{time.ctime(event.timestamp)}: {event.in_waiting}/{event.capacity} bytes in waiting")
+
     if not wubctl.isascii:
         logger.info(wubctl.cmd_ok())
 
@@ -166,21 +149,38 @@ def main(cli_args):
         logger.info(f"Hits transmitted by wuBase:  {nhits_tx} (0x{nhits_tx:X})")
         logger.info(f"Bytes transmitted by wuBase: {nbytes_tx} (0x{nbytes_tx:X})")
 
-        logger.info("Sending ASCIIMODE command to wuBase.")        
-        #logger.debug(wubctl.cmd_ok())
-        resp = wubctl.cmd_asciimode()
-        rc = wubCMD_RC(resp['response']['CMD_RC']).name
-        logger.info(rc)
-        
-
-    logger.info("Re-enabling autobaud.")    
-    #logger.info(wubctl.send_recv_ascii(wubCMD_catalog.baud, -1)['response'])
-    resp = wubctl.set_autobaud()
-    logger.info(resp['response'])
+    if cli_args.keep_link:
+        logger.info(f"Leaving the link in {wubctl.device} for the next run.")
+        wubctl.save_state()
+    else:
+        if not wubctl.isascii:
+            logger.info("Sending ASCIIMODE command to wuBase.")        
+            #logger.debug(wubctl.cmd_ok())
+            resp = wubctl.cmd_asciimode()
+            rc = wubCMD_RC(resp['response']['CMD_RC']).name
+            logger.info(rc)
+
+        logger.info("Re-enabling autobaud.")    
+        #logger.info(wubctl.send_recv_ascii(wubCMD_catalog.baud, -1)['response'])
+        resp = wubctl.set_autobaud()
+        logger.info(resp['response'])
 
     if output_handler is not None: 
         output_handler.flush()
         output_handler.close()
+
+    if metrics_exporter is not None:
+        metrics_exporter.stop()
+
+    if shm_ring is not None:
+        wubctl.remove_frame_listener(shm_ring.publish_frames)
+        shm_ring.close()
+
+    if stream_server is not None:
+        wubctl.remove_frame_listener(stream_server.publish_frames)
+        if stream_server.nbatches_dropped > 0:
+            logger.warning(f"Slow stream subscribers dropped {stream_server.nbatches_dropped} batches.")
+        stream_server.stop()
     logger.info("Exiting....")    
 
     sys.exit(0)    
@@ -210,6 +210,36 @@ if __name__ == "__main__":
     parser.add_argument("--ofile", type=str, default=None, 
                         help="Output file for test data.")
 
+    parser.add_argument("--segment_size", type=float, default=0,
+                        help="Rotate the output file every this many MB (0 disables).")
+
+    parser.add_argument("--segment_time", type=float, default=0,
+                        help="Rotate the output file every this many seconds (0 disables).")
+
+    parser.add_argument("--fsync_interval", type=float, default=None,
+                        help="Seconds between fsyncs of segmented output (default: leave to the OS).")
+
+    parser.add_argument("--shm_ring", type=str, default=None,
+                        help="Publish live frames to a shared memory ring of this name ('frame' or 'ring' store mode).")
+
+    parser.add_argument("--shm_ring_size", type=float, default=64,
+                        help="Size of the shared memory ring in MB.")
+
+    parser.add_argument("--stream_socket", type=str, default=None,
+                        help="Stream live frames to subscribers on this UNIX socket path ('frame' or 'ring' store mode).")
+
+    parser.add_argument("--negotiate_baud", action='store_true',
+                        help="Find the fastest error-free baud rate instead of using --baud.")
+
+    parser.add_argument("--baud_cache", type=str, default=None,
+                        help="Per-device cache of negotiated baud rates.")
+
+    parser.add_argument("--state_file", type=str, default=None,
+                        help="File recording the device link state between runs.")
+
+    parser.add_argument("--keep_link", action='store_true',
+                        help="Leave the device at the fixed baud and comms mode after the run (use with --state_file).")
+
     parser.add_argument("--commsmode", type=str, default='ascii',
                         help="Comms mode (ascii or binary)")
     
@@ -228,8 +258,21 @@ if __name__ == "__main__":
     parser.add_argument("--ntosend", type=int, default=-1,
                         help="Number of hits to send in batchmode. Negative means send all available.")
     
+    parser.add_argument("--stall_timeout", type=float, default=3.0,
+                        help="Warn when no data arrive for this many seconds.")
+
     parser.add_argument("--store_mode", type=str, default='bulk', 
-                        help="Choose which method of recieving and processing hits.")
+                        help="Choose which method of recieving and processing hits (bulk, sb, frame, ring).")
+
+    parser.add_argument("--scheduled_batches", action='store_true',
+                        help="Drain with bounded SEND_BATCH requests that end on a frame boundary ('frame' or 'ring' store mode).")
+
+    parser.add_argument("--quiet_time", type=float, default=None,
+                        help="Seconds of silence that end a short scheduled batch; above the USB-serial latency timer, "
+                             "derived from the port if not given.")
+
+    parser.add_argument("--base", type=int, default=0,
+                        help="wuBase number recorded with each frame in 'frame' and 'ring' store modes.")
     
     parser.add_argument("--debug", action='store_true',
                         help="Override loglevel to debug")
@@ -237,6 +280,15 @@ if __name__ == "__main__":
     parser.add_argument("--parity", action='store_true',
                     help="Set serial interface to use positive parity bit")    
 
+    parser.add_argument("--metrics_file", type=str, default=None,
+                        help="Periodically export link metrics to this file.")
+
+    parser.add_argument("--metrics_format", type=str, default='jsonl',
+                        help="Metrics file format (jsonl or prom).")
+
+    parser.add_argument("--metrics_interval", type=float, default=1.0,
+                        help="Seconds between metrics exports.")
+
     
     LOGGING_STREAM_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s"
     
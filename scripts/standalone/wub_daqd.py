@@ -0,0 +1,67 @@
+#!/usr/bin/env python 
+
+from pywub.daemon import wubDaqDaemon
+
+import logging 
+
+
+logger = logging.getLogger()
+
+
+def main(cli_args):
+
+    bases = cli_args.bases if cli_args.bases is not None else list(range(len(cli_args.ports)))
+    if len(bases) != len(cli_args.ports):
+        raise ValueError("--bases needs one base number per port.")
+
+    daemon = wubDaqDaemon(dict(zip(bases, cli_args.ports)), cli_args.socket,
+                          baud=cli_args.baud, mode=cli_args.commsmode,
+                          store_mode=cli_args.store_mode, state_dir=cli_args.state_dir,
+                          timeout=cli_args.timeout)
+    daemon.serve_forever(revert_on_exit=cli_args.revert_on_exit)
+
+
+if __name__ == "__main__": 
+    
+    import argparse
+    parser = argparse.ArgumentParser(description="Keep wuBase links open and take runs on request.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--ports", type=str, nargs='+', required=True, 
+                        help="UART ports, one per wuBase.")
+
+    parser.add_argument("--bases", type=int, nargs='+', default=None,
+                        help="Base number of each port (default: 0, 1, ...).")
+
+    parser.add_argument("--socket", type=str, default="/tmp/wub_daqd.sock",
+                        help="Control socket path.")
+
+    parser.add_argument("--baud", type=int, default=1181818, 
+                        help="Baudrate kept on the links.")
+
+    parser.add_argument("--commsmode", type=str, default='binary',
+                        help="Comms mode kept on the links (ascii or binary).")
+
+    parser.add_argument("--store_mode", type=str, default='frame', 
+                        help="Choose which method of recieving and processing hits (bulk, sb, frame).")
+
+    parser.add_argument("--state_dir", type=str, default=None,
+                        help="Directory for per-base link state files, so a restarted daemon can skip link setup.")
+
+    parser.add_argument("--timeout", type=int, default=1, 
+                        help="Socket-level timeout time to wait for a byte.")      
+
+    parser.add_argument("--revert_on_exit", action='store_true',
+                        help="Return the devices to ASCII and autobaud when the daemon exits.")
+
+    parser.add_argument("--loglevel", type=str, default="INFO",
+                        help="Logger level")
+
+    cli_args = parser.parse_args()  
+
+    logger.setLevel(cli_args.loglevel.upper())
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+                                      datefmt="%H:%M:%S"))
+    logger.addHandler(ch)
+
+    main(cli_args)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import sys
+import time
+
+from pywub.simulator import wubSimulator
+
+import logging
+
+
+logger = logging.getLogger()
+
+
+def main(cli_args):
+
+    nsamples = cli_args.nsamples[0] if len(cli_args.nsamples) == 1 else tuple(cli_args.nsamples[0:2])
+
+    sims = []
+    for base in range(cli_args.nbases):
+        sim = wubSimulator(basenumber=base, rate=cli_args.rate, nsamples=nsamples,
+                           memory_hits=cli_args.memory_hits, throttle=not cli_args.no_throttle,
+                           corrupt_rate=cli_args.corrupt_rate, drop_rate=cli_args.drop_rate,
+                           clock_error=cli_args.clock_error,
+                           delays={name: float(delay) for name, delay in cli_args.delay},
+                           seed=None if cli_args.seed is None else cli_args.seed + base)
+        sim.start()
+        sims += [sim]
+        # The port paths go to stdout so scripts can pick them up.
+        print(sim.port, flush=True)
+
+    try:
+        while True:
+            time.sleep(cli_args.report_interval)
+            for sim in sims:
+                stats = sim.stats()
+                logger.info(f"Base {sim.basenumber} ({stats['comms_mode']}, "
+                            f"{'autobaud' if stats['autobaud'] else stats['baud']}): "
+                            f"{stats['hits_sent']} hits / {stats['bytes_sent']} bytes sent, "
+                            f"{stats['hits_overflow']} hits lost to overflow")
+    except KeyboardInterrupt:
+        logger.info("KeyboardInterrupt detected. Exiting.")
+    finally:
+        for sim in sims:
+            sim.close()
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Simulate wuBases on pseudo-terminals; prints one port path per base.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--nbases", type=int, default=1,
+                        help="Number of simulated wuBases.")
+
+    parser.add_argument("--rate", type=float, default=1000,
+                        help="Hits generated per second per base.")
+
+    parser.add_argument("--nsamples", type=int, nargs='+', default=[8, 64],
+                        help="Samples per hit: a fixed number or a min and max.")
+
+    parser.add_argument("--memory_hits", type=int, default=4096,
+                        help="Hits a base buffers before dropping new ones.")
+
+    parser.add_argument("--no_throttle", action='store_true',
+                        help="Stream as fast as the pty allows instead of at the baud rate.")
+
+    parser.add_argument("--corrupt_rate", type=float, default=0.0,
+                        help="Probability per streamed byte of a bit flip.")
+
+    parser.add_argument("--drop_rate", type=float, default=0.0,
+                        help="Probability per streamed byte that a span of bytes is dropped.")
+
+    parser.add_argument("--clock_error", type=float, default=0.0,
+                        help="Relative error of the simulated UART clock (baud mismatch).")
+
+    parser.add_argument("--delay", type=str, nargs=2, action='append', default=[], metavar=("COMMAND", "SECONDS"),
+                        help="Make the base block for SECONDS before answering COMMAND (repeatable).")
+
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Random seed.")
+
+    parser.add_argument("--report_interval", type=float, default=10.0,
+                        help="Seconds between status reports.")
+
+    parser.add_argument("--loglevel", type=str, default="INFO",
+                        help="Logger level")
+
+    cli_args = parser.parse_args()
+
+    logger.setLevel(cli_args.loglevel.upper())
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s",
+                                      datefmt="%H:%M:%S"))
+    logger.addHandler(ch)
+
+    main(cli_args)
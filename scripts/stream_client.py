@@ -0,0 +1,51 @@
+#!/usr/bin/env python 
+
+import time
+
+import pywub.parser as wuparser 
+from pywub.stream_server import wubFrameStreamClient
+
+    
+def main(path, bases, types, verbose):
+
+    client = wubFrameStreamClient(path, bases=bases, types=types)
+    print(f"Subscribed to {path} (bases: {bases}, types: {types}).")
+
+    nframes = 0
+    tlast = time.time()
+    try:
+        for batch in client:
+            for rec in batch:
+                nframes += 1
+                if verbose:
+                    nsamples, frame_id, fpga_ts, fpga_tdc = wuparser.unpack_header(rec.data[0:wuparser.HEADER_SIZE])
+                    print(f"base {rec.base:2d} t={rec.timestamp:.6f} nsamples: {nsamples} frame_id: 0x{frame_id:4X} fpga_ts: 0x{fpga_ts:12X}")
+
+            tnow = time.time()
+            if tnow - tlast >= 1:
+                print(f"{time.ctime(tnow)}  {nframes/(tnow - tlast):8.1f} frames/s")
+                nframes = 0
+                tlast = tnow
+    except KeyboardInterrupt:
+        pass
+
+    client.close()
+
+
+if __name__ == "__main__": 
+    
+    import argparse
+    parser = argparse.ArgumentParser(description="Reference client for the live frame stream server.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--path", type=str, required=True, 
+                        help="UNIX socket path given to run_wub_daq.py --stream_socket")
+    parser.add_argument("--bases", type=int, nargs='*', default=None, 
+                        help="Only receive frames from these bases.")
+    parser.add_argument("--types", type=int, nargs='*', default=None, 
+                        help="Only receive these record types.")
+    parser.add_argument("--verbose", action='store_true',
+                        help="Print every frame header.")
+
+    cli_args = parser.parse_args()  
+
+    main(cli_args.path, cli_args.bases, cli_args.types, cli_args.verbose)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python 
+
+import json
+
+from pywub.daemon import daemon_request
+
+    
+def main(cli_args):
+
+    request = dict(cmd=cli_args.cmd)
+    if cli_args.bases is not None:
+        request['bases'] = cli_args.bases
+    if cli_args.config is not None:
+        with open(cli_args.config, 'r') as f:
+            request['config'] = f.read().split("\n")
+    if cli_args.cmd == 'run':
+        request.update(ntosend=cli_args.ntosend, runtime=cli_args.runtime)
+        if cli_args.ofile is not None:
+            request['ofile'] = cli_args.ofile
+
+    print(json.dumps(daemon_request(cli_args.socket, request), indent=2))
+
+
+if __name__ == "__main__": 
+    
+    import argparse
+    parser = argparse.ArgumentParser(description="Send a request to wub_daqd.py.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("cmd", type=str, choices=['status', 'setup', 'run', 'stop', 'forget', 'shutdown'],
+                        help="Request to send.")
+    parser.add_argument("--socket", type=str, default="/tmp/wub_daqd.sock",
+                        help="Control socket path of the daemon.")
+    parser.add_argument("--bases", type=int, nargs='*', default=None, 
+                        help="Bases the request applies to (default: all).")
+    parser.add_argument("--config", type=str, default=None, 
+                        help="Setup config file (setup and run).")
+    parser.add_argument("--ntosend", type=int, default=-1,
+                        help="Number of hits to send in batchmode. Negative means send all available.")
+    parser.add_argument("--runtime", type=float, default=5, 
+                        help="Maximum runtime before stopping the run.")    
+    parser.add_argument("--ofile", type=str, default=None, 
+                        help="Output file per base; {base} and {run} are filled in.")
+
+    cli_args = parser.parse_args()  
+
+    main(cli_args)
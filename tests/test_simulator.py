@@ -0,0 +1,199 @@
+'''
+Receive path checks against the simulated wuBase (pywub.simulator), so they
+run without hardware: frame splitting with resyncs, record files, and one
+short binary batch per store mode.
+'''
+
+import io
+import os
+import time
+import random
+import threading
+
+import pytest
+
+from pywub import parser
+from pywub import records
+from pywub.latency import percentile
+from pywub.rxring import wubRxRing
+from pywub.simulator import wubSimulator, pack_frame
+from pywub.control import wubCTL
+
+
+def make_frames(nframes: int, seed: int = 1) -> list[bytes]:
+    '''Wire frames (with start byte) of random nsamples and payload.'''
+    rng = random.Random(seed)
+    frames = []
+    for i in range(nframes):
+        nsamples = rng.randint(1, 64)
+        payload = bytes(rng.getrandbits(8) for _ in range(parser.calc_payload_size(nsamples)))
+        frames.append(pack_frame(nsamples, i, rng.getrandbits(48), rng.getrandbits(64), payload))
+    return frames
+
+
+def corrupted_stream(frames: list[bytes]) -> tuple[bytes, int]:
+    '''Join the frames with junk between some of them; returns the stream and the number of junk spans.'''
+    # Neither span can be taken for a frame: no start byte, or a start byte claiming too many samples.
+    junk = [b"\x00\x55\xaa", bytes([parser.START_BYTE]) + b"\xff\xff"]
+    parts = []
+    njunk = 0
+    for i, frame in enumerate(frames):
+        if i % 7 == 3:
+            parts.append(junk[njunk % 2])
+            njunk += 1
+        parts.append(frame)
+    return b"".join(parts), njunk
+
+
+def chunks(data: bytes, seed: int = 2):
+    rng = random.Random(seed)
+    pos = 0
+    while pos < len(data):
+        n = rng.randint(1, 300)
+        yield data[pos:pos + n]
+        pos += n
+
+
+def test_frame_decoder_resyncs():
+    frames = make_frames(200)
+    stream, njunk = corrupted_stream(frames)
+
+    decoder = parser.FrameDecoder()
+    decoded = []
+    for chunk in chunks(stream):
+        decoded += decoder.feed(chunk)
+
+    assert decoded == [f[parser.START_BYTE_WIDTH:] for f in frames]
+    assert decoder.pending == 0
+    assert decoder.nresyncs >= njunk
+
+
+def test_rx_ring_matches_decoder():
+    frames = make_frames(400)
+    stream, njunk = corrupted_stream(frames)
+
+    # Small enough to wrap several times.
+    ring = wubRxRing(capacity=4 * (parser.START_BYTE_WIDTH + parser.calc_frame_size(64)), max_nsamples=64)
+    decoder = parser.FrameDecoder(max_nsamples=64)
+    received = []
+    pos = 0
+    while pos < len(stream):
+        space = ring.writable()
+        n = min(len(space), len(stream) - pos, 257)
+        space[:n] = stream[pos:pos + n]
+        ring.commit(n)
+        pos += n
+        received += [bytes(f) for f in ring.frames()]
+        ring.release()
+
+    assert received == decoder.feed(stream)
+    assert ring.pending == 0
+    assert ring.nresyncs == decoder.nresyncs
+    assert ring.nbytes_skipped == decoder.nbytes_skipped
+    assert ring.nwraps > 0
+
+
+def test_records_round_trip():
+    frames = [f[parser.START_BYTE_WIDTH:] for f in make_frames(50)]
+    packed = records.pack_records(frames[:20], 3, 1000.5)
+    out = bytearray(8)
+    n = records.pack_records_into(out, frames[20:], 4, 1001.5)
+    data = packed + bytes(out[:n]) + records.pack_record(b"x", 5, 1002.5)
+
+    recs = list(records.iter_records(io.BytesIO(data)))
+    assert [r.data for r in recs] == frames + [b"x"]
+    assert [r.base for r in recs] == [3] * 20 + [4] * 30 + [5]
+    assert [r.timestamp for r in recs] == [1000.5] * 20 + [1001.5] * 30 + [1002.5]
+
+    index = records.build_index(io.BytesIO(data))
+    assert [offset for offset, _, _ in index] == [r.offset for r in recs]
+    assert records.read_record(io.BytesIO(data), index[25][0]).data == frames[25]
+
+    # Preallocated, unwritten space ends the data; a cut record is dropped.
+    assert len(list(records.iter_records(io.BytesIO(data + bytes(4096))))) == len(recs)
+    assert len(list(records.iter_records(io.BytesIO(data[:-1])))) == len(recs) - 1
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 11))
+    assert percentile(values, 50) == 5
+    assert percentile(values, 90) == 9
+    assert percentile(values, 95) == 10
+    assert percentile(values, 0) == 1
+    assert percentile([], 50) is None
+
+
+def run_batch(wubctl: wubCTL, datafile, duration: float = 0.5):
+    wubctl.prepare_batch()
+    rx_thread = threading.Thread(target=wubctl.batchmode_recv, args=(-1, 1), kwargs=dict(datafile=datafile))
+    rx_thread.start()
+    time.sleep(duration)
+    wubctl.request_stop = True
+    rx_thread.join(10)
+    assert not rx_thread.is_alive()
+
+
+@pytest.fixture
+def simulator():
+    sim = wubSimulator(rate=2000, nsamples=(8, 32), seed=3)
+    sim.start()
+    yield sim
+    sim.close()
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="the simulator needs a pty")
+@pytest.mark.parametrize("store_mode", ["bulk", "sb", "frame", "ring"])
+def test_binary_batch(simulator, store_mode):
+    wubctl = wubCTL(simulator.port, baud=1181818, mode='binary', store_mode=store_mode, timeout=0.5)
+    try:
+        wubctl.ensure_link()
+        out = io.BytesIO()
+        run_batch(wubctl, out)
+    finally:
+        wubctl.close()
+
+    data = out.getvalue()
+    assert len(data) > 0
+    assert wubctl.metrics.resyncs == 0
+
+    if store_mode == "bulk":
+        # The raw stream; only the frame cut by the stop may be incomplete.
+        decoder = parser.FrameDecoder()
+        frames = decoder.feed(data)
+        assert len(frames) > 0
+        assert decoder.nresyncs == 0
+    elif store_mode == "sb":
+        assert wubctl.nframes_binary > 0
+    else:
+        recs = list(records.iter_records(io.BytesIO(data)))
+        assert len(recs) == wubctl.metrics.frames > 0
+        frames = [r.data for r in recs]
+        assert all(r.base == 0 for r in recs)
+
+    if store_mode != "sb":
+        for frame in frames:
+            nsamples = parser.unpack_header(frame[:parser.HEADER_SIZE])[0]
+            assert 8 <= nsamples <= 32
+            assert len(frame) == parser.calc_frame_size(nsamples)
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="the simulator needs a pty")
+def test_ring_resyncs_per_batch():
+    sim = wubSimulator(rate=2000, nsamples=(8, 32), drop_rate=2e-4, seed=5)
+    sim.start()
+    wubctl = wubCTL(sim.port, baud=1181818, mode='binary', store_mode='ring', timeout=0.5)
+    try:
+        wubctl.ensure_link()
+        nresyncs = []
+        for _ in range(2):
+            before = wubctl._rx_ring.nresyncs if wubctl._rx_ring is not None else 0
+            out = io.BytesIO()
+            run_batch(wubctl, out)
+            # Each batch counts only its own resyncs, although the ring's counter runs on.
+            assert wubctl.metrics.resyncs == wubctl._rx_ring.nresyncs - before
+            assert len(list(records.iter_records(io.BytesIO(out.getvalue())))) == wubctl.metrics.frames
+            nresyncs.append(wubctl.metrics.resyncs)
+        assert sum(nresyncs) > 0
+    finally:
+        wubctl.close()
+        sim.close()